@@ -1,33 +1,198 @@
+import atexit
+import hashlib
+import heapq
+import os
+import secrets
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
 from datetime import datetime, timezone
+from functools import partial
+from itertools import islice
 from uuid import uuid4
 
-from flask import Flask, request, jsonify, render_template, session, redirect, url_for, abort
-from flask_bcrypt import Bcrypt
+from flask import Flask, Blueprint, Response, request, jsonify, render_template, session, redirect, url_for, abort, g, \
+    current_app, send_from_directory
 from flask_cors import CORS
 import sqlite3
 
 from db_utils import *
 from utils import *
-from costants import CONTENT_SECURITY_POLICY, ERROR_401_MESSAGE, API_PREFIX, FULL_NAME_PATTERN, COMPANY_NAME_PATTERN
+from holder_index import HolderIndex
+from registry_snapshot import RegistrySnapshot
+from bloom_filter import IbanBloomFilter
+from company_search import CompanySearchIndex
+from holder_search import parse_search_query, search_holders
+from bulk_mutations import plan_operations, apply_operations, lock_shards
+import metrics
+from verification_cache import VerificationCache
+from audit_log import AuditLog, AUDIT_COLUMNS
+from password_hashing import PasswordVerifier
+from response_compression import configure_compression, compress_response, get_identity_etag
+from request_profiler import RequestProfiler, CAPTURE_FILE_REGEX, describe_request
+from costants import CONTENT_SECURITY_POLICY, ERROR_401_MESSAGE, API_PREFIX, MAX_BATCH_ITEMS, \
+    MAX_COMPANY_SEARCH_RESULTS, MAX_IBANS_PAGE_SIZE, IBANS_STREAM_CHUNK_SIZE, MAX_VALIDATION_ITEMS, \
+    MAX_BULK_OPERATIONS, MAX_AUDIT_PAGE_SIZE, MAX_HOLDER_SEARCH_RESULTS, MAX_HOLDER_SEARCH_OFFSET, \
+    MAX_HOLDER_SEARCH_QUERY_LENGTH, PROFILE_TOKEN_HEADER
 
-app = Flask(__name__)
+bp = Blueprint("bank", __name__)
 
-app.config.from_object("config.Config")
-bcrypt = Bcrypt(app)
-cors = CORS(app, resources=app.config["CORS_RESOURCES"])
+# Set up by create_app(), in the same way as configure_database() sets up db_utils
+holder_index = None
+iban_filter = None
+verification_cache = None
+audit_log = None
+password_verifier = None
+company_search_index = None
+request_profiler = None
 
 
-@app.errorhandler(415)
+def load_holder_index(app):
+    conn = None
+    try:
+        conn = get_connection()
+        query_shards(conn, migrate_database)
+        query_shards(conn, lambda shard_conn: prune_change_log(shard_conn, app.config["CHANGE_FEED_RETENTION_DAYS"]))
+        if holder_index:
+            holder_index.load(conn)
+        if iban_filter:
+            iban_filter.load(conn)
+    except sqlite3.Error as e:
+        app.logger.error(f"Error loading the IBAN holder index: {e}")
+    finally:
+        release_connection(conn)
+
+
+def update_holder_index(conn, changes, removed_ibans=(), updated_ibans=()):
+    verification_cache.clear()
+    company_search_index.mark_stale()
+    if holder_index:
+        holder_index.apply_changes(conn, changes, removed_ibans, updated_ibans)
+    if iban_filter:
+        iban_filter.apply_changes(conn, changes, updated_ibans)
+
+
+def find_iban_holder(iban):
+    if holder_index:
+        return holder_index.get(iban)
+    if iban_filter and not iban_filter.might_contain(iban):
+        return None
+    conn = None
+    try:
+        conn = get_connection(get_iban_shard(iban))
+        return select_iban_holder(conn, iban)
+    finally:
+        release_connection(conn)
+
+
+def find_iban_holders(ibans):
+    if holder_index:
+        return holder_index.get_many(ibans)
+    if iban_filter:
+        ibans = [iban for iban in ibans if iban_filter.might_contain(iban)]
+        if not ibans:
+            return {}
+    conn = None
+    try:
+        conn = get_connection()
+        return select_iban_holders(conn, ibans)
+    finally:
+        release_connection(conn)
+
+
+
+@bp.app_errorhandler(415)
 def handle_415_error(error):
     error_description = "The content type of the request is not supported."
     return render_template("error_415.html", code=error.code, name=error.name, description=error_description), 415
 
 
-@app.after_request
+def get_endpoint_label():
+    # Without the blueprint name, as on the ASGI fast path
+    return request.endpoint.rpartition(".")[2] if request.endpoint else "unknown"
+
+
+def is_profiled(endpoint):
+    return request_profiler and endpoint not in request_profiler.excluded_endpoints
+
+
+# Registered before the other hooks, so that the profile also covers them
+@bp.before_app_request
+def start_profiling():
+    if is_profiled(get_endpoint_label()):
+        g.profile_started = time.perf_counter()
+        g.profile = request_profiler.start(request.headers.get(PROFILE_TOKEN_HEADER))
+
+
+@bp.after_app_request
+def finish_profiling(response):
+    if "profile_started" not in g:
+        return response
+    duration = time.perf_counter() - g.profile_started
+    profile = g.pop("profile")
+    if profile:
+        request_profiler.stop(profile)
+    endpoint = get_endpoint_label()
+    if profile or request_profiler.is_slow(endpoint, duration):
+        details = describe_request(request.method, request.path, request.args.to_dict(flat=False),
+                                   request.get_json(silent=True), response.status_code)
+        response.call_on_close(partial(request_profiler.save, endpoint, duration, profile, details))
+    return response
+
+
+@bp.teardown_app_request
+def stop_profiling(error):
+    # The response hooks are skipped when one of them fails
+    profile = g.pop("profile", None)
+    if profile:
+        request_profiler.stop(profile)
+
+
+def run_profiled(endpoint, path, token, function, data):
+    """Runs a verification of the ASGI fast path, which bypasses the hooks above, under the same profiling. Returns its
+    result and status, and the capture to save once the response is sent, or None."""
+    if not is_profiled(endpoint):
+        return (*metrics.run_for_endpoint(endpoint, function, data), None)
+    started = time.perf_counter()
+    profile = request_profiler.start(token)
+    try:
+        result, status = metrics.run_for_endpoint(endpoint, function, data)
+    finally:
+        if profile:
+            request_profiler.stop(profile)
+    duration = time.perf_counter() - started
+    if not profile and not request_profiler.is_slow(endpoint, duration):
+        return result, status, None
+    details = describe_request("POST", path, {}, data, status)
+    return result, status, partial(request_profiler.save, endpoint, duration, profile, details)
+
+
+@bp.before_app_request
+def start_request_timer():
+    g.request_started = metrics.start_request(get_endpoint_label())
+
+
+@bp.after_app_request
+def record_request_metrics(response):
+    if "request_started" in g:
+        metrics.finish_request(get_endpoint_label(), response.status_code, g.request_started)
+    return response
+
+
+@bp.after_app_request
+def compress(response):
+    return compress_response(response, request.accept_encodings)
+
+
+@bp.after_app_request
 def add_header(response):
-    response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, public, max-age=0"
-    response.headers["Pragma"] = "no-cache"
-    response.headers["Expires"] = "0"
+    if "ETag" in response.headers:
+        # Registry data carries validators: clients keep a private copy and revalidate it on every use
+        response.headers["Cache-Control"] = "private, no-cache"
+    else:
+        response.headers["Cache-Control"] = "no-store, no-cache, must-revalidate, public, max-age=0"
+        response.headers["Pragma"] = "no-cache"
+        response.headers["Expires"] = "0"
     response.headers['X-Frame-Options'] = 'SAMEORIGIN'
     response.headers['X-Content-Type-Options'] = 'nosniff'
     response.headers['Strict-Transport-Security'] = 'max-age=31536000; includeSubDomains'
@@ -35,31 +200,206 @@ def add_header(response):
     return response
 
 
-@app.route("/add-iban")
+@bp.route("/add-iban")
 def add_iban_page():
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
     return render_template("add_iban.html")
 
 
+def snake_to_camel(snake_str):
+    words = snake_str.split('_')
+    return words[0].lower() + ''.join(word.capitalize() for word in words[1:])
+
+
+IBAN_LIST_COLUMNS = {snake_to_camel(column): column for column in ("id", "iban", "first_name", "last_name", "company_name")}
+
+
+def serialize_iban_records(app, keys, rows, ndjson):
+    if ndjson:
+        for row in rows:
+            yield app.json.dumps(dict(zip(keys, row[1:]))) + "\n"
+        return
+    separator = "["
+    for row in rows:
+        yield separator + app.json.dumps(dict(zip(keys, row[1:])))
+        separator = ","
+    yield "[]" if separator == "[" else "]"
+
+
+def stream_iban_records(app, conn, rows):
+    try:
+        yield from rows
+    except sqlite3.Error as e:
+        app.logger.error(f"Error streaming query results: {e}")
+    finally:
+        rows.close()
+        release_connection(conn)
+
+
+def get_registry_validators(conn):
+    """Returns the ETag and Last-Modified of the requested representation of the registry."""
+    version, updated_at = get_registry_state(conn)
+    representation = f"{version}|{updated_at}|{request.full_path}|{request.accept_mimetypes.best}"
+    etag = hashlib.blake2b(representation.encode(), digest_size=12).hexdigest()
+    last_modified = datetime.strptime(updated_at, "%Y-%m-%d %H:%M:%S").replace(tzinfo=timezone.utc) \
+        if updated_at else None
+    return etag, last_modified
+
+
+def get_not_modified_etag(etag, last_modified):
+    """Returns the ETag of the 304 response if the copy of the client is current, or else None. A compressed copy was
+    sent with the encoding appended to its ETag, which the 304 response has to repeat."""
+    if request.if_none_match:
+        if request.if_none_match.star_tag:
+            return etag
+        return next((tag for tag in request.if_none_match.as_set(include_weak=True)
+                     if get_identity_etag(tag) == etag), None)
+    if last_modified and request.if_modified_since and last_modified <= request.if_modified_since:
+        return etag
+    return None
+
+
+def set_registry_validators(response, etag, last_modified):
+    response.set_etag(etag)
+    if last_modified:
+        response.last_modified = last_modified
+    return response
+
+
+def format_change_cursor(sequences):
+    # A cursor holds the position of the mirror in the change log of every shard
+    return sequences[0] if len(sequences) == 1 else ".".join(str(sequence) for sequence in sequences)
+
+
+def parse_change_cursor(cursor):
+    """Returns the position in the change log of every shard, or None if the cursor is not valid."""
+    parts = cursor.split(".")
+    if not all(part.isdigit() for part in parts):
+        return None
+    if parts == ["0"]:
+        return [0] * get_shard_count()
+    return [int(part) for part in parts]
+
+
 def get_all_ibans():
+    fields = request.args.get("fields", "")
+    keys = fields.split(",") if fields else list(IBAN_LIST_COLUMNS)
+    if any(key not in IBAN_LIST_COLUMNS for key in keys):
+        return jsonify({"error": "Fields are not valid"}), 400
+    limit = request.args.get("limit", type=int)
+    if limit is not None and not 1 <= limit <= MAX_IBANS_PAGE_SIZE:
+        return jsonify({"error": f"Limit must be between 1 and {MAX_IBANS_PAGE_SIZE}"}), 400
+    after = request.args.get("after", "")
+    if after and validate_iban_id(after):
+        return jsonify({"error": "Cursor is not valid"}), 400
+    columns = ", ".join(IBAN_LIST_COLUMNS[key] for key in keys)
+    query, params = f"SELECT id, {columns} FROM iban_holders", []
+    if after:
+        query, params = query + " WHERE id > ?", [after]
+    if limit or after:
+        query += " ORDER BY id"
+    if limit:
+        query, params = query + " LIMIT ?", params + [limit + 1]
+    ndjson = request.accept_mimetypes.best == "application/x-ndjson"
+    mimetype = "application/x-ndjson" if ndjson else "application/json"
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
-        conn.row_factory = sqlite3.Row
-        iban_records = selection_query_db(conn, "SELECT id, iban, first_name, last_name, company_name FROM iban_holders")
+        conn = get_connection()
+        etag, last_modified = get_registry_validators(conn)
+        not_modified_etag = get_not_modified_etag(etag, last_modified)
+        if not_modified_etag:
+            release_connection(conn)
+            return set_registry_validators(Response(status=304), not_modified_etag, last_modified)
+        # Read before the records, so that a mirror built from this dump misses no change when it follows the feed
+        change_cursor = format_change_cursor([bounds[1] for bounds in query_shards(conn, get_change_log_bounds)])
+        # Every shard returns its rows in id order, so merging them by id keeps the keyset pagination
+        records = select_from_shards(conn, query, params, key=(lambda row: row[0]) if limit or after else None)
+        if limit:
+            rows = list(islice(records, limit + 1))
+            records.close()
+            # Pages are small enough to be sent in one piece, which lets small ones skip compression
+            response = Response("".join(serialize_iban_records(current_app, keys, rows[:limit], ndjson)), mimetype=mimetype)
+            if len(rows) > limit:
+                response.headers["X-Next-Cursor"] = rows[limit - 1][0]
+            response.headers["X-Change-Cursor"] = str(change_cursor)
+            release_connection(conn)
+            return set_registry_validators(response, etag, last_modified)
+        # The records are read after the view returns, outside of the app context
+        app = current_app._get_current_object()
+        response = Response(serialize_iban_records(app, keys, stream_iban_records(app, conn, records), ndjson),
+                            mimetype=mimetype)
+        response.headers["X-Change-Cursor"] = str(change_cursor)
+        return set_registry_validators(response, etag, last_modified)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        release_connection(conn)
+        return jsonify({"error": "Something went wrong"}), 500
 
-        def snake_to_camel(snake_str):
-            words = snake_str.split('_')
-            return words[0].lower() + ''.join(word.capitalize() for word in words[1:])
 
-        result = [{snake_to_camel(key): value for key, value in dict(iban).items()} for iban in iban_records]
-        return jsonify(result), 200
+CHANGE_FEED_COLUMNS = ("iban", "first_name", "last_name", "company_name", "created_at", "updated_at")
+
+
+@bp.route(f"{API_PREFIX}/ibans/changes")
+def get_iban_changes():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    since = parse_change_cursor(request.args.get("since", "0"))
+    limit = request.args.get("limit", IBANS_STREAM_CHUNK_SIZE, type=int)
+    if since is None:
+        return jsonify({"error": "Cursor is not valid"}), 400
+    if not 1 <= limit <= MAX_IBANS_PAGE_SIZE:
+        return jsonify({"error": f"Limit must be between 1 and {MAX_IBANS_PAGE_SIZE}"}), 400
+    if len(since) != get_shard_count():
+        return jsonify({"error": "Cursor has expired, resync from the IBAN list"}), 410
+    conn = None
+    try:
+        conn = get_connection()
+        etag, last_modified = get_registry_validators(conn)
+        not_modified_etag = get_not_modified_etag(etag, last_modified)
+        if not_modified_etag:
+            return set_registry_validators(Response(status=304), not_modified_etag, last_modified)
+        shard_rows, latest_sequences = [], []
+        for shard, shard_since in enumerate(since):
+            with shard_connection(conn, shard) as shard_conn:
+                oldest, latest = get_change_log_bounds(shard_conn)
+                if shard_since < oldest - 1 and shard_since < latest:
+                    return jsonify({"error": "Cursor has expired, resync from the IBAN list"}), 410
+                latest_sequences.append(latest)
+                shard_rows.append([(shard, *row) for row in selection_query_db(
+                    shard_conn, f"SELECT c.changed_at, c.seq, c.operation, c.holder_id, c.iban, "
+                                f"{', '.join('h.' + c for c in CHANGE_FEED_COLUMNS)} FROM iban_changes c "
+                                f"LEFT JOIN iban_holders h ON h.id = c.holder_id WHERE c.seq > ? "
+                                f"ORDER BY c.seq LIMIT ?", (shard_since, limit))])
+        # Each shard keeps its own order, and the shards are interleaved by the time of their changes
+        rows = list(islice(heapq.merge(*shard_rows, key=lambda row: row[1]), limit))
+        # A holder moved to another shard by a change of bank is logged as deleted on the shard it left
+        gone_ids = list({row[4] for row in rows if row[6] is None})
+        moved_ids = {row[0] for row in select_from_shards(
+            conn, f"SELECT id FROM iban_holders WHERE id IN ({', '.join('?' * len(gone_ids))})", gone_ids)} \
+            if gone_ids and get_shard_count() > 1 else set()
+        # Holders changed several times in the page are sent once, with their current state at their last change
+        last_changes = {row[4]: (position, row) for position, row in enumerate(rows)
+                        if row[6] is not None or row[4] not in moved_ids}
+        changes = []
+        for _, row in sorted(last_changes.values()):
+            seq, operation, holder_id, logged_iban = row[2:6]
+            if row[6] is None:
+                changes.append({"seq": seq, "op": "delete", "id": holder_id, "iban": logged_iban})
+                continue
+            changes.append({"seq": seq, "op": operation, "id": holder_id,
+                            **{snake_to_camel(column): value for column, value in zip(CHANGE_FEED_COLUMNS, row[6:])}})
+        next_sequences = list(since)
+        for row in rows:
+            next_sequences[row[0]] = row[2]
+        response = jsonify({"changes": changes, "nextCursor": format_change_cursor(next_sequences),
+                            "hasMore": any(map(int.__lt__, next_sequences, latest_sequences))})
+        return set_registry_validators(response, etag, last_modified)
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         return jsonify({"error": "Something went wrong"}), 500
     finally:
-        close_connection(conn)
+        release_connection(conn)
 
 
 def add_iban():
@@ -70,27 +410,32 @@ def add_iban():
         return jsonify({"error": error}), 400
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
+        conn = get_connection(get_iban_shard(iban))
         result = selection_query_db(conn, "SELECT * FROM iban_holders WHERE iban = ?", (iban,), one=True)
         if result:
             return jsonify({"error": "IBAN inserted already exists"}), 409
         if surname:
-            action_query_db(conn, "INSERT INTO iban_holders (id, iban, first_name, last_name) VALUES (?, ?, ?, ?)",
-                            (str(uuid4()), iban, person_or_company_name, surname))
+            changes = action_query_db(conn,
+                                      "INSERT INTO iban_holders (id, iban, first_name, last_name) VALUES (?, ?, ?, ?)",
+                                      (str(uuid4()), iban, person_or_company_name, surname))
         else:
             person_or_company_name = normalize_company_legal_form(person_or_company_name)
-            action_query_db(conn, "INSERT INTO iban_holders (id, iban, company_name) VALUES (?, ?, ?)",
-                            (str(uuid4()), iban, person_or_company_name))
+            changes = action_query_db(conn,
+                                      "INSERT INTO iban_holders (id, iban, company_name, company_name_folded, "
+                                      "company_name_stripped, legal_form) VALUES (?, ?, ?, ?, ?, ?)",
+                                      (str(uuid4()), iban, person_or_company_name,
+                                       *normalize_company_name(person_or_company_name)))
+        update_holder_index(conn, changes, updated_ibans=(iban,))
         return jsonify({"message": "IBAN has been added successfully"}), 201
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         rollback_transaction(conn)
         return jsonify({"error": "Something went wrong"}), 500
     finally:
-        close_connection(conn)
+        release_connection(conn)
 
 
-@app.route(f"{API_PREFIX}/ibans", methods=["GET", "POST"])
+@bp.route(f"{API_PREFIX}/ibans", methods=["GET", "POST"])
 def get_or_add_ibans():
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
@@ -99,14 +444,14 @@ def get_or_add_ibans():
     return add_iban()
 
 
-@app.route("/remove-iban")
+@bp.route("/remove-iban")
 def remove_iban_page():
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
     return render_template("remove_iban.html")
 
 
-@app.route("/modify-iban")
+@bp.route("/modify-iban")
 def modify_iban_page():
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
@@ -119,18 +464,22 @@ def remove_iban(iban_id):
         return jsonify({"error": error}), 400
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
-        result = selection_query_db(conn, "SELECT * FROM iban_holders", one=True)
-        if not result:
+        conn = get_connection()
+        if not next(select_from_shards(conn, "SELECT 1 FROM iban_holders LIMIT 1"), None):
             return jsonify({"error": "There is no iban to remove"}), 404
-        action_query_db(conn, "DELETE FROM iban_holders WHERE id = ?", (iban_id,))
+        shard, result = select_holder_by_id(conn, iban_id)
+        changes = 0
+        if result:
+            with shard_connection(conn, shard) as shard_conn:
+                changes = action_query_db(shard_conn, "DELETE FROM iban_holders WHERE id = ?", (iban_id,))
+        update_holder_index(conn, changes, removed_ibans=(result[1],) if result else ())
         return jsonify({"message": "IBAN has been removed successfully"}), 200
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         rollback_transaction(conn)
         return jsonify({"error": "Something went wrong"}), 500
     finally:
-        close_connection(conn)
+        release_connection(conn)
 
 
 def modify_iban(old_iban_id):
@@ -141,38 +490,48 @@ def modify_iban(old_iban_id):
         return jsonify({"error": error}), 400
     conn = None
     try:
-        conn = sqlite3.connect(DATABASE)
-        result = selection_query_db(conn, "SELECT * FROM iban_holders", one=True)
-        if not result:
+        conn = get_connection()
+        if not next(select_from_shards(conn, "SELECT 1 FROM iban_holders LIMIT 1"), None):
             return jsonify({"error": "There is no iban to modify"}), 404
-        result = selection_query_db(conn, "SELECT * FROM iban_holders WHERE id = ?", (old_iban_id,), one=True)
+        shard, result = select_holder_by_id(conn, old_iban_id)
         old_iban = result[1] if result else None
         if old_iban != new_iban:
-            new_iban_result = selection_query_db(conn, "SELECT * FROM iban_holders WHERE iban = ?", (new_iban,), one=True)
+            with shard_connection(conn, get_iban_shard(new_iban)) as new_iban_conn:
+                new_iban_result = selection_query_db(new_iban_conn, "SELECT * FROM iban_holders WHERE iban = ?",
+                                                     (new_iban,), one=True)
             if new_iban_result:
                 return jsonify({"error": "IBAN inserted already exists"}), 409
         if result:
             if not has_iban_record_changed(result, person_or_company_name, surname, new_iban):
                 return jsonify({"message": "No changes have been made"}), 200
             update_timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
-            if result[2] and result[3] and surname:
-                action_query_db(conn,
-                                "UPDATE iban_holders SET first_name = ?, last_name = ?, iban = ?, updated_at = ? WHERE iban = ?",
-                                (person_or_company_name, surname, new_iban, update_timestamp, old_iban))
-            elif result[4] and not surname:
-                action_query_db(conn,
-                                "UPDATE iban_holders SET company_name = ?, iban = ?, updated_at = ? WHERE iban = ?",
-                                (person_or_company_name, new_iban, update_timestamp, old_iban))
+            with shard_connection(conn, shard) as shard_conn:
+                if result[2] and result[3] and surname:
+                    changes = action_query_db(shard_conn,
+                                              "UPDATE iban_holders SET first_name = ?, last_name = ?, iban = ?, updated_at = ? WHERE iban = ?",
+                                              (person_or_company_name, surname, new_iban, update_timestamp, old_iban))
+                elif result[4] and not surname:
+                    changes = action_query_db(shard_conn,
+                                              "UPDATE iban_holders SET company_name = ?, company_name_folded = ?, "
+                                              "company_name_stripped = ?, legal_form = ?, iban = ?, updated_at = ? WHERE iban = ?",
+                                              (person_or_company_name, *normalize_company_name(person_or_company_name),
+                                               new_iban, update_timestamp, old_iban))
+                else:
+                    changes = 0
+                if changes and get_iban_shard(new_iban) != shard:
+                    changes += move_holder(shard_conn, old_iban_id, get_iban_shard(new_iban))
+            if changes:
+                update_holder_index(conn, changes, (old_iban,), (new_iban,))
         return jsonify({"message": "IBAN has been modified successfully"}), 200
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         rollback_transaction(conn)
         return jsonify({"error": "Something went wrong"}), 500
     finally:
-        close_connection(conn)
+        release_connection(conn)
 
 
-@app.route(f"{API_PREFIX}/ibans/<uuid:iban_id>", methods=["PUT", "DELETE"])
+@bp.route(f"{API_PREFIX}/ibans/<uuid:iban_id>", methods=["PUT", "DELETE"])
 def remove_or_modify_iban(iban_id):
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
@@ -182,106 +541,579 @@ def remove_or_modify_iban(iban_id):
     return modify_iban(iban_id)
 
 
-@app.route(f"{API_PREFIX}/iban-verification", methods=["POST"])
-def verify_iban():
+@bp.route(f"{API_PREFIX}/ibans/bulk", methods=["POST"])
+def bulk_modify_ibans():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    data = request.json
+    operations = data.get("operations") if isinstance(data, dict) else None
+    mode = data.get("mode", "atomic") if isinstance(data, dict) else None
+    if not isinstance(operations, list) or not operations:
+        return jsonify({"error": "Operations are required"}), 400
+    if len(operations) > MAX_BULK_OPERATIONS:
+        return jsonify({"error": f"At most {MAX_BULK_OPERATIONS} operations can be applied at once"}), 400
+    if mode not in ("atomic", "best-effort"):
+        return jsonify({"error": "Mode must be either atomic or best-effort"}), 400
+    conn = None
+    try:
+        conn = get_connection()
+        with lock_shards(conn) as connections:
+            results, statements, removed_ibans, updated_ibans = plan_operations(conn, operations)
+            failed = sum(result["status"] >= 400 for result in results)
+            if failed and mode == "atomic":
+                return jsonify({"committed": False, "failed": failed, "results": results}), 400
+            changes = apply_operations(connections, statements)
+        update_holder_index(conn, changes, removed_ibans, updated_ibans)
+        return jsonify({"committed": True, "failed": failed, "results": results}), 200
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        rollback_transaction(conn)
+        return jsonify({"error": "Something went wrong"}), 500
+    finally:
+        release_connection(conn)
+
+
+@bp.route(f"{API_PREFIX}/company-search")
+def search_companies():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    company_name = remove_spaces(request.args.get("name", ""), "name")
+    if company_name == "":
+        return jsonify({"error": "Company name is required"}), 400
+    if not get_pattern("company_name").fullmatch(company_name):
+        return jsonify({"error": "Company name is not valid"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), MAX_COMPANY_SEARCH_RESULTS)
+    min_score = min(max(request.args.get("minScore", SIMILARITY_THRESHOLD, type=int), 0), 100)
+    conn = None
+    try:
+        conn = get_connection()
+        company_search_index.ensure_loaded(conn)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+    finally:
+        release_connection(conn)
+    return jsonify({"results": company_search_index.search(company_name, limit, min_score)}), 200
+
+
+@bp.route(f"{API_PREFIX}/ibans/search")
+def search_iban_holders():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    query = remove_spaces(request.args.get("q", ""), "q")
+    if len(query) > MAX_HOLDER_SEARCH_QUERY_LENGTH:
+        return jsonify({"error": "Search query is too long"}), 400
+    iban_prefix, terms = parse_search_query(query)
+    if not iban_prefix and not terms:
+        return jsonify({"error": "Search query must contain a word of at least 3 characters or an IBAN prefix"}), 400
+    limit = min(max(request.args.get("limit", 10, type=int), 1), MAX_HOLDER_SEARCH_RESULTS)
+    offset = request.args.get("offset", 0, type=int)
+    if not 0 <= offset <= MAX_HOLDER_SEARCH_OFFSET:
+        return jsonify({"error": f"Offset must be between 0 and {MAX_HOLDER_SEARCH_OFFSET}"}), 400
+    conn = None
+    try:
+        conn = get_connection()
+        rows, has_more = search_holders(conn, query, limit, offset)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+    finally:
+        release_connection(conn)
+    keys = list(IBAN_LIST_COLUMNS)
+    return jsonify({"results": [dict(zip(keys, row)) for row in rows],
+                    "nextOffset": offset + limit if has_more else None}), 200
+
+
+def check_iban_holder(result, person_or_company_name, surname):
+    if not result:
+        return {"error": "IBAN not found"}, 404
+    person_or_company_name = to_lower(person_or_company_name)
+    if result.first_name and result.last_name:
+        if result.first_name_folded == person_or_company_name and result.last_name_folded == to_lower(surname):
+            return {"message": "IBAN matches"}, 200
+        return {"message": "IBAN does not match"}, 200
+    if not surname and are_company_names_similar(person_or_company_name, result.company_name_folded,
+                                                 result.company_name_stripped):
+        if is_correct_input_legal_form(person_or_company_name, result.legal_form):
+            return {"message": "IBAN matches"}, 200
+    return {"message": "IBAN does not match"}, 200
+
+
+def check_sender_iban_holder(result, sender_name):
+    if not result:
+        return {"error": "IBAN not found"}, 404
+    if result.first_name and result.last_name:
+        if not (get_pattern("full_name").fullmatch(sender_name) or get_pattern("company_name").fullmatch(sender_name)):
+            return {"error": "Sender name is not valid"}, 400
+        sender_name = to_lower(sender_name)
+        if result.first_name_folded in sender_name and result.last_name_folded in sender_name:
+            return {"message": "IBAN matches"}, 200
+        return {"message": "IBAN does not match"}, 200
+    if not get_pattern("company_name").fullmatch(sender_name):
+        return {"error": "Sender name is not valid"}, 400
+    if are_company_names_similar(to_lower(sender_name), result.company_name_folded, result.company_name_stripped):
+        return {"message": "IBAN matches"}, 200
+    return {"message": "IBAN does not match"}, 200
+
+
+def parse_batch_items(data):
+    items = data.get("items") if isinstance(data, dict) else None
+    if not isinstance(items, list) or not items:
+        return None, "Items are required"
+    if len(items) > MAX_BATCH_ITEMS:
+        return None, f"A batch can contain at most {MAX_BATCH_ITEMS} items"
+    return items, ""
+
+
+@bp.route(f"{API_PREFIX}/iban-validation", methods=["POST"])
+def validate_iban_batch():
     data = request.json
+    ibans = data.get("ibans") if isinstance(data, dict) else None
+    if not isinstance(ibans, list) or not ibans:
+        return jsonify({"error": "IBANs are required"}), 400
+    if len(ibans) > MAX_VALIDATION_ITEMS:
+        return jsonify({"error": f"At most {MAX_VALIDATION_ITEMS} IBANs can be validated at once"}), 400
+    ibans = [remove_spaces(str(iban)).upper() for iban in ibans]
+    valid, reasons = validate_ibans(ibans)
+    results = [{"iban": iban, "valid": bool(is_valid), **({"reason": reason} if reason else {})}
+               for iban, is_valid, reason in zip(ibans, valid, reasons)]
+    return jsonify({"results": results}), 200
+
+
+def record_verification(verification, iban, name, surname, body, status):
+    if audit_log:
+        audit_log.record(verification, iban, name, surname, body, status)
+
+
+def verify_iban_data(data):
     person_or_company_name, surname, iban = parse_input_data(data)
-    error = validate_input(person_or_company_name, surname, iban)
+    body, status = verification_cache.get_or_compute(
+        ("iban", person_or_company_name, surname, iban),
+        lambda: compute_iban_verification(person_or_company_name, surname, iban))
+    record_verification("iban", iban, person_or_company_name, surname, body, status)
+    return body, status
+
+
+def compute_iban_verification(person_or_company_name, surname, iban):
+    with metrics.span("validation"):
+        error = validate_input(person_or_company_name, surname, iban)
+    if error:
+        return {"error": error}, 400
+    with metrics.span("lookup"):
+        result = find_iban_holder(iban)
+    with metrics.span("matching"):
+        return check_iban_holder(result, person_or_company_name, surname)
+
+
+def verify_sender_iban_data(data):
+    sender_name, iban = parse_sender_data(data)
+    body, status = verification_cache.get_or_compute(("sender", sender_name, iban),
+                                                     lambda: compute_sender_iban_verification(sender_name, iban))
+    record_verification("sender", iban, sender_name, None, body, status)
+    return body, status
+
+
+def compute_sender_iban_verification(sender_name, iban):
+    with metrics.span("validation"):
+        error = validate_iban(iban)
+    if error:
+        return {"error": error}, 400
+    with metrics.span("lookup"):
+        result = find_iban_holder(iban)
+    with metrics.span("matching"):
+        return check_sender_iban_holder(result, sender_name)
+
+
+@bp.route(f"{API_PREFIX}/iban-verification", methods=["POST"])
+def verify_iban():
+    data = request.json
+    try:
+        body, status = verify_iban_data(data)
+        metrics.set_outcome(body, status)
+        return jsonify(body), status
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+
+
+@bp.route(f"{API_PREFIX}/iban-verification/batch", methods=["POST"])
+def verify_iban_batch():
+    items, error = parse_batch_items(request.json)
     if error:
         return jsonify({"error": error}), 400
-    conn = None
+    parsed_items = []
+    for item in items:
+        try:
+            person_or_company_name, surname, iban = parse_input_data(item)
+        except (KeyError, TypeError):
+            parsed_items.append((None, None, None, "Item is not valid"))
+            continue
+        error = validate_input(person_or_company_name, surname, iban)
+        parsed_items.append((person_or_company_name, surname, iban, error))
     try:
-        conn = sqlite3.connect(DATABASE)
-        result = selection_query_db(conn, "SELECT * FROM iban_holders WHERE iban=?", (iban,), one=True)
-        if not result:
-            return jsonify({"error": "IBAN not found"}), 404
-        person_or_company_name = to_lower(person_or_company_name)
-        if result[2] and result[3]:
-            db_first_name, db_last_name = to_lower(result[2]), to_lower(result[3])
-            if db_first_name == person_or_company_name and db_last_name == to_lower(surname):
-                return jsonify({"message": "IBAN matches"}), 200
-            return jsonify({"message": "IBAN does not match"}), 200
-        db_company_name = to_lower(result[4])
-        if not surname and are_company_names_similar(person_or_company_name, db_company_name):
-            if is_correct_input_legal_form(person_or_company_name, db_company_name):
-                return jsonify({"message": "IBAN matches"}), 200
-        return jsonify({"message": "IBAN does not match"}), 200
+        with metrics.span("lookup"):
+            records = find_iban_holders({item[2] for item in parsed_items if not item[3]})
+        results = []
+        for person_or_company_name, surname, iban, error in parsed_items:
+            if error:
+                body, status = {"error": error}, 400
+            else:
+                body, status = check_iban_holder(records.get(iban), person_or_company_name, surname)
+            record_verification("iban", iban, person_or_company_name, surname, body, status)
+            results.append({"iban": iban, "status": status, **body})
+        return jsonify({"results": results}), 200
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         return jsonify({"error": "Something went wrong"}), 500
-    finally:
-        close_connection(conn)
 
 
-@app.route(f"{API_PREFIX}/sender-iban-verification", methods=["POST"])
+@bp.route(f"{API_PREFIX}/sender-iban-verification", methods=["POST"])
 def verify_sender_iban():
     data = request.json
-    sender_name, iban = parse_sender_data(data)
-    error = validate_iban(iban)
+    try:
+        body, status = verify_sender_iban_data(data)
+        metrics.set_outcome(body, status)
+        return jsonify(body), status
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+
+
+@bp.route(f"{API_PREFIX}/sender-iban-verification/batch", methods=["POST"])
+def verify_sender_iban_batch():
+    items, error = parse_batch_items(request.json)
     if error:
         return jsonify({"error": error}), 400
-    conn = None
+    parsed_items = []
+    for item in items:
+        try:
+            sender_name, iban = parse_sender_data(item)
+        except (KeyError, TypeError):
+            parsed_items.append((None, None, "Item is not valid"))
+            continue
+        parsed_items.append((sender_name, iban, validate_iban(iban)))
     try:
-        conn = sqlite3.connect(DATABASE)
-        result = selection_query_db(conn, "SELECT * FROM iban_holders WHERE iban = ?", (iban,), one=True)
-        if not result:
-            return jsonify({"error": "IBAN not found"}), 404
-        if result[2] and result[3]:
-            if not (regex.fullmatch(FULL_NAME_PATTERN, sender_name) or regex.fullmatch(COMPANY_NAME_PATTERN, sender_name)):
-                return jsonify({"error": "Sender name is not valid"}), 400
-            db_first_name, db_last_name = to_lower(result[2]), to_lower(result[3])
-            if db_first_name in to_lower(sender_name) and db_last_name in to_lower(sender_name):
-                return jsonify({"message": "IBAN matches"}), 200
-            return jsonify({"message": "IBAN does not match"}), 200
-        if not regex.fullmatch(COMPANY_NAME_PATTERN, sender_name):
-            return jsonify({"error": "Sender name is not valid"}), 400
-        db_company_name = to_lower(result[4])
-        if are_company_names_similar(to_lower(sender_name), db_company_name):
-            return jsonify({"message": "IBAN matches"}), 200
-        return jsonify({"message": "IBAN does not match"}), 200
+        with metrics.span("lookup"):
+            records = find_iban_holders({item[1] for item in parsed_items if not item[2]})
+        results = []
+        for sender_name, iban, error in parsed_items:
+            if error:
+                body, status = {"error": error}, 400
+            else:
+                body, status = check_sender_iban_holder(records.get(iban), sender_name)
+            record_verification("sender", iban, sender_name, None, body, status)
+            results.append({"iban": iban, "status": status, **body})
+        return jsonify({"results": results}), 200
     except sqlite3.Error as e:
-        app.logger.error(f"Error executing query: {e}")
+        current_app.logger.error(f"Error executing query: {e}")
         return jsonify({"error": "Something went wrong"}), 500
-    finally:
-        close_connection(conn)
 
 
-@app.route("/admin-HaZiNgTLamSe", methods=["GET", "POST"])
+def collect_counters():
+    counters = [
+        ("bank_api_database_connections_opened_total", "counter", "SQLite connections opened.",
+         connection_stats["opened"]),
+        ("bank_api_database_connections_reused_total", "counter", "Connections borrowed from the pool.",
+         connection_stats["reused"]),
+        ("bank_api_database_connections_closed_total", "counter", "SQLite connections closed.",
+         connection_stats["closed"]),
+        ("bank_api_database_pool_idle_connections", "gauge", "Connections waiting in the pools of all the shards.",
+         sum(connection_pool.qsize() for connection_pool in connection_pools)),
+        ("bank_api_similarity_cache_hits_total", "counter", "Similarity decisions served from the cache.",
+         similarity_cache.hits),
+        ("bank_api_similarity_cache_misses_total", "counter", "Similarity decisions computed.",
+         similarity_cache.misses),
+        ("bank_api_similarity_cache_evictions_total", "counter", "Similarity decisions evicted from the cache.",
+         similarity_cache.evictions),
+        ("bank_api_similarity_cache_entries", "gauge", "Similarity decisions currently cached.",
+         len(similarity_cache.entries)),
+    ]
+    counters += [
+        ("bank_api_verification_cache_hits_total", "counter", "Verifications served from the result cache.",
+         verification_cache.hits),
+        ("bank_api_verification_cache_misses_total", "counter", "Verifications computed.",
+         verification_cache.misses),
+        ("bank_api_verification_cache_coalesced_total", "counter",
+         "Verifications that waited for an identical one in flight.", verification_cache.coalesced),
+        ("bank_api_verification_cache_evictions_total", "counter", "Verification results evicted from the cache.",
+         verification_cache.evictions),
+        ("bank_api_verification_cache_entries", "gauge", "Verification results currently cached.",
+         len(verification_cache.entries)),
+    ]
+    if audit_log:
+        counters += [
+            ("bank_api_audit_log_enqueued_total", "counter", "Verification outcomes queued for the audit log.",
+             audit_log.enqueued),
+            ("bank_api_audit_log_written_total", "counter", "Verification outcomes written to the audit log.",
+             audit_log.written),
+            ("bank_api_audit_log_dropped_total", "counter", "Verification outcomes dropped because the queue was full.",
+             audit_log.dropped),
+            ("bank_api_audit_log_failed_total", "counter", "Verification outcomes lost to a failed write.",
+             audit_log.failed),
+            ("bank_api_audit_log_batches_total", "counter", "Transactions committed to the audit log.",
+             audit_log.batches),
+            ("bank_api_audit_log_queue_depth", "gauge", "Verification outcomes waiting to be written.",
+             audit_log.queue.qsize()),
+        ]
+    counters += [
+        ("bank_api_login_checks_pending", "gauge", "Password checks queued or running in the login process pool.",
+         password_verifier.pending),
+        ("bank_api_login_checks_total", "counter", "Password checks submitted to the login process pool.",
+         password_verifier.checks),
+        ("bank_api_login_rejected_busy_total", "counter", "Logins refused because the password check queue was full.",
+         password_verifier.rejected_busy),
+        ("bank_api_login_rejected_throttled_total", "counter",
+         "Logins refused for a username or address with a check in flight or too many failures.",
+         password_verifier.rejected_throttled),
+        ("bank_api_login_timeouts_total", "counter", "Password checks that exceeded the login timeout.",
+         password_verifier.timeouts),
+        ("bank_api_login_rehashes_total", "counter", "Passwords rehashed with the configured work factor.",
+         password_verifier.rehashes),
+    ]
+    if request_profiler:
+        counters += [
+            ("bank_api_profiler_profiles_total", "counter", "Requests profiled, sampled or carrying a profiling token.",
+             request_profiler.profiled),
+            ("bank_api_profiler_skipped_busy_total", "counter",
+             "Requests not profiled because another one was being profiled.", request_profiler.skipped_busy),
+            ("bank_api_profiler_slow_captures_total", "counter",
+             "Requests kept among the slowest of their endpoint.", request_profiler.slow_captures),
+            ("bank_api_profiler_write_errors_total", "counter", "Captures lost to a failed write.",
+             request_profiler.write_errors),
+        ]
+    if holder_index:
+        counters += [
+            ("bank_api_holder_index_records", "gauge", "IBAN holders in the in-memory index.",
+             holder_index.size),
+            ("bank_api_holder_index_version", "gauge", "Registry version of the in-memory index.",
+             holder_index.version or 0),
+            ("bank_api_holder_index_reloads_total", "counter", "Full reloads of the in-memory index.",
+             holder_index.reloads),
+        ]
+    if iban_filter:
+        counters += [
+            ("bank_api_bloom_filter_ibans", "gauge", "IBANs added to the Bloom filter since the last rebuild.",
+             iban_filter.count),
+            ("bank_api_bloom_filter_rebuilds_total", "counter", "Rebuilds of the Bloom filter from the database.",
+             iban_filter.rebuilds),
+        ]
+    return counters
+
+
+metrics.register_collector(collect_counters)
+
+
+@bp.route(f"{API_PREFIX}/audit")
+def get_audit_entries():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    if not audit_log:
+        return jsonify({"error": "The audit log is disabled"}), 404
+    limit = request.args.get("limit", 100, type=int)
+    before = request.args.get("before", type=int)
+    iban = remove_spaces(request.args.get("iban", "")).upper()
+    if not 1 <= limit <= MAX_AUDIT_PAGE_SIZE:
+        return jsonify({"error": f"Limit must be between 1 and {MAX_AUDIT_PAGE_SIZE}"}), 400
+    try:
+        rows = audit_log.select_recent(limit, before, iban)
+    except sqlite3.Error as e:
+        current_app.logger.error(f"Error executing query: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+    entries = [{snake_to_camel(column): value for column, value in zip(AUDIT_COLUMNS, row)} for row in rows]
+    return jsonify({"entries": entries, "nextCursor": rows[-1][0] if len(rows) == limit else None}), 200
+
+
+@bp.route(f"{API_PREFIX}/profiles")
+def get_profiles():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    if not request_profiler:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    try:
+        latest, slowest = request_profiler.list_captures()
+    except OSError as e:
+        current_app.logger.error(f"Error listing the profiles: {e}")
+        return jsonify({"error": "Something went wrong"}), 500
+    return jsonify({"latest": latest, "slowest": slowest}), 200
+
+
+@bp.route(f"{API_PREFIX}/profiles/<path:name>")
+def download_profile(name):
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    if not request_profiler or not CAPTURE_FILE_REGEX.fullmatch(name):
+        return jsonify({"error": "Profile not found"}), 404
+    return send_from_directory(os.path.abspath(request_profiler.directory), name, as_attachment=True)
+
+
+@bp.route(f"{API_PREFIX}/profiles/token", methods=["POST"])
+def issue_profile_token():
+    if "admin_id" not in session:
+        abort(401, ERROR_401_MESSAGE)
+    if not request_profiler:
+        return jsonify({"error": "Profiling is disabled"}), 404
+    token, expires = request_profiler.issue_token()
+    return jsonify({"header": PROFILE_TOKEN_HEADER, "token": token,
+                    "expiresAt": datetime.fromtimestamp(expires, timezone.utc).isoformat()}), 200
+
+
+@bp.route("/metrics")
+def get_metrics():
+    if "admin_id" not in session and request.remote_addr not in current_app.config["METRICS_ALLOWED_ADDRESSES"]:
+        abort(401, ERROR_401_MESSAGE)
+    return Response(metrics.render_prometheus(), mimetype="text/plain; version=0.0.4")
+
+
+def rehash_password(conn, admin_id, password):
+    """Stores the password hashed with the configured work factor. A failure leaves the previous hash in place."""
+    try:
+        action_query_db(conn, "UPDATE administrators SET password = ? WHERE id = ?",
+                         (password_verifier.hash(password), admin_id))
+    except (sqlite3.Error, FutureTimeoutError, BrokenProcessPool) as e:
+        rollback_transaction(conn)
+        current_app.logger.warning(f"Error rehashing the password: {e!r}")
+
+
+@bp.route("/admin-HaZiNgTLamSe", methods=["GET", "POST"])
 def login():
     if request.method == "POST":
         data = request.json
         username = str(data["username"])
         password = str(data["password"])
+        clients = (("username", username.casefold()), ("address", request.remote_addr))
+        rejection = password_verifier.admit(clients)
+        if rejection:
+            error, retry_after = rejection
+            return jsonify({"error": error}), 429, {"Retry-After": str(retry_after)}
         conn = None
+        holds_slot = True
         try:
-            conn = sqlite3.connect(DATABASE)
+            conn = get_connection()
             admin = selection_query_db(conn, "SELECT * FROM administrators WHERE username = ?", (username,), one=True)
-            if admin and bcrypt.check_password_hash(admin[2], password):
-                session["admin_id"] = admin[0]
-                return jsonify({"message": "Login successful"}), 200
-            return jsonify({"error": "Invalid username or password"}), 400
+            # From here the slot is released by verify()
+            holds_slot = False
+            if not password_verifier.verify(clients, admin[2] if admin else None, password):
+                return jsonify({"error": "Invalid username or password"}), 400
+            if password_verifier.needs_rehash(admin[2]):
+                rehash_password(conn, admin[0], password)
+            session["admin_id"] = admin[0]
+            return jsonify({"message": "Login successful"}), 200
         except sqlite3.Error as e:
-            app.logger.error(f"Error executing query: {e}")
+            current_app.logger.error(f"Error executing query: {e}")
             return jsonify({"error": "Something went wrong"}), 500
+        except (FutureTimeoutError, BrokenProcessPool) as e:
+            current_app.logger.error(f"Error checking the password: {e!r}")
+            return jsonify({"error": "Login is temporarily unavailable, please try again shortly"}), 503
         finally:
-            close_connection(conn)
+            if holds_slot:
+                password_verifier.release(clients, False)
+            release_connection(conn)
     if "admin_id" in session:
-        return redirect(url_for("home"))
+        return redirect(url_for("bank.home"))
     return render_template("login.html")
 
 
-@app.route("/logout-mPAcTuGbItYR")
+@bp.route("/logout-mPAcTuGbItYR")
 def logout():
     session.clear()
-    return redirect(url_for("login"))
+    return redirect(url_for("bank.login"))
 
 
-@app.route("/")
+@bp.route("/")
 def home():
     if "admin_id" not in session:
         abort(401, ERROR_401_MESSAGE)
     return render_template("home.html")
 
 
+def load_secret_key(path):
+    """Returns the key stored at path, generating it if missing. It is written to a temporary file and linked into place,
+    so that workers starting together all end up with the key of the first one."""
+    if not os.path.exists(path):
+        temporary_path = f"{path}.{os.getpid()}"
+        with open(os.open(temporary_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "w") as key_file:
+            key_file.write(secrets.token_hex(32))
+        try:
+            os.link(temporary_path, path)
+        except FileExistsError:
+            pass
+        finally:
+            os.remove(temporary_path)
+    with open(path) as key_file:
+        return key_file.read().strip()
+
+
+def warm_up(app):
+    """Does the work otherwise left to the first requests: compiles the patterns, imports rapidfuzz, fills the connection
+    pools, starts the lookup structures and compiles the templates."""
+    warm_patterns()
+    try:
+        warm_connection_pool()
+        # Starts the refreshers of the holder index or Bloom filter and goes through the lookup once
+        find_iban_holder("IT00X0000000000000000000000")
+    except sqlite3.Error as e:
+        app.logger.error(f"Error warming up: {e}")
+    for template in app.jinja_env.list_templates():
+        app.jinja_env.get_template(template)
+
+
+def create_app(config=None):
+    """Builds the app from config.Config, with the keys of config taking precedence. The registry components are
+    module-level, as the database settings are, so a process serves a single app."""
+    global holder_index, iban_filter, verification_cache, audit_log, password_verifier, company_search_index, \
+        request_profiler
+    app = Flask(__name__)
+    app.config.from_object("config.Config")
+    app.config.update(config or {})
+    if not app.config["SECRET_KEY"]:
+        app.config["SECRET_KEY"] = load_secret_key(app.config["SECRET_KEY_PATH"])
+    CORS(app, resources=app.config["CORS_RESOURCES"])
+    configure_database(app.config)
+    configure_similarity(app.config)
+    metrics.configure_metrics(app.config)
+    configure_compression(app.config)
+    if app.config["REGISTRY_SNAPSHOT_ENABLED"]:
+        holder_index = RegistrySnapshot(app.config["REGISTRY_SNAPSHOT_PATH"],
+                                        app.config["HOLDER_INDEX_REFRESH_INTERVAL"])
+    elif app.config["HOLDER_INDEX_ENABLED"]:
+        holder_index = HolderIndex(app.config["HOLDER_INDEX_REFRESH_INTERVAL"])
+    else:
+        holder_index = None
+    iban_filter = IbanBloomFilter(app.config["BLOOM_FILTER_FALSE_POSITIVE_RATE"], app.config["BLOOM_FILTER_PATH"],
+                                  app.config["BLOOM_FILTER_REFRESH_INTERVAL"],
+                                  app.config["BLOOM_FILTER_REBUILD_INTERVAL"]) if app.config["BLOOM_FILTER_ENABLED"] \
+        else None
+    verification_cache = VerificationCache(app.config["VERIFICATION_CACHE_SIZE"], app.config["VERIFICATION_CACHE_TTL"])
+    audit_log = AuditLog(app.config["AUDIT_LOG_DATABASE"], app.config["AUDIT_LOG_QUEUE_SIZE"],
+                         app.config["AUDIT_LOG_BATCH_SIZE"],
+                         app.config["AUDIT_LOG_FLUSH_INTERVAL"]) if app.config["AUDIT_LOG_ENABLED"] else None
+    if audit_log:
+        atexit.register(audit_log.close)
+    password_verifier = PasswordVerifier(app.config["BCRYPT_LOG_ROUNDS"], app.config["LOGIN_WORKERS"],
+                                         app.config["LOGIN_MAX_PENDING"], app.config["LOGIN_TIMEOUT"],
+                                         app.config["LOGIN_MAX_FAILURES"], app.config["LOGIN_FAILURE_WINDOW"])
+    atexit.register(password_verifier.close)
+    company_search_index = CompanySearchIndex(app.config["COMPANY_SEARCH_WORKERS"],
+                                              app.config["COMPANY_SEARCH_REFRESH_INTERVAL"])
+    request_profiler = RequestProfiler(app.config["PROFILES_DIRECTORY"], app.config["PROFILE_SAMPLE_RATE"],
+                                       app.config["PROFILE_RING_SIZE"], app.config["PROFILE_SLOWEST_SIZE"],
+                                       app.config["SECRET_KEY"], app.config["PROFILE_TOKEN_TTL"],
+                                       app.config["PROFILE_EXCLUDED_ENDPOINTS"]) \
+        if app.config["PROFILING_ENABLED"] else None
+    app.register_blueprint(bp)
+    load_holder_index(app)
+    if app.config["WARM_UP_ENABLED"]:
+        warm_up(app)
+    return app
+
+
 if __name__ == '__main__':
-    app.run(host="localhost", debug=True)
+    from config import Config
+
+    # asgi.py builds the app served by uvicorn itself, so building one here as well would load the registry twice
+    if Config.ASGI_SERVING:
+        import uvicorn
+
+        uvicorn.run("asgi:application", host="localhost", port=5000, backlog=4096)
+    else:
+        create_app().run(host="localhost", debug=True)
@@ -0,0 +1,107 @@
+import asyncio
+import json
+import re
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+
+from asgiref.wsgi import WsgiToAsgi
+
+import metrics
+from app import create_app, add_header, run_profiled, verify_iban_data, verify_sender_iban_data
+from costants import API_PREFIX, PROFILE_TOKEN_HEADER
+
+VERIFICATION_HANDLERS = {
+    f"{API_PREFIX}/iban-verification": ("verify_iban", verify_iban_data),
+    f"{API_PREFIX}/sender-iban-verification": ("verify_sender_iban", verify_sender_iban_data),
+}
+
+MAX_BODY_SIZE = 64 * 1024
+
+app = create_app()
+flask_application = WsgiToAsgi(app)
+executor = ThreadPoolExecutor(max_workers=app.config["ASGI_EXECUTOR_WORKERS"], thread_name_prefix="verification")
+
+
+def get_header(scope, header_name):
+    return next((value.decode("latin-1") for name, value in scope["headers"] if name == header_name), None)
+
+
+def is_json_request(scope):
+    for name, value in scope["headers"]:
+        if name == b"content-type":
+            return value.split(b";")[0].strip().lower() == b"application/json"
+    return False
+
+
+def get_cors_headers(scope):
+    origin = get_header(scope, b"origin")
+    resource = app.config["CORS_RESOURCES"].get(scope["path"], {})
+    if origin and any(re.match(allowed_origin, origin) for allowed_origin in resource.get("origins", [])):
+        return [(b"access-control-allow-origin", origin.encode("latin-1")), (b"vary", b"Origin")]
+    return []
+
+
+async def read_body(receive):
+    body = b""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            return None, False
+        body += message.get("body", b"")
+        more_body = message.get("more_body", False)
+        if len(body) > MAX_BODY_SIZE or not more_body:
+            return body, more_body
+
+
+def replay_body(body, more_body, receive):
+    sent = False
+
+    async def replayed_receive():
+        nonlocal sent
+        if sent:
+            return await receive()
+        sent = True
+        return {"type": "http.request", "body": body, "more_body": more_body}
+
+    return replayed_receive
+
+
+async def send_json(send, scope, body, status):
+    response = app.response_class(app.json.dumps(body), status=status, mimetype="application/json")
+    add_header(response)
+    headers = [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in response.headers.items()]
+    await send({"type": "http.response.start", "status": status, "headers": headers + get_cors_headers(scope)})
+    await send({"type": "http.response.body", "body": response.get_data()})
+
+
+async def application(scope, receive, send):
+    handler = VERIFICATION_HANDLERS.get(scope.get("path")) if scope["type"] == "http" else None
+    if not handler or scope["method"] != "POST" or not is_json_request(scope):
+        return await flask_application(scope, receive, send)
+    endpoint, handler = handler
+    started = metrics.start_request(endpoint)
+    body, more_body = await read_body(receive)
+    if body is None:
+        return
+    result = capture = None
+    try:
+        if more_body:
+            raise ValueError("Request body is too large")
+        data = json.loads(body)
+        if not isinstance(data, dict):
+            raise ValueError("Request body is not a JSON object")
+        result, status, capture = await asyncio.get_running_loop().run_in_executor(
+            executor, run_profiled, endpoint, scope["path"], get_header(scope, PROFILE_TOKEN_HEADER.lower().encode()),
+            handler, data)
+    except (ValueError, KeyError, TypeError, AttributeError):
+        pass
+    except sqlite3.Error as e:
+        app.logger.error(f"Error executing query: {e}")
+        result, status = {"error": "Something went wrong"}, 500
+    if result is None:
+        # Malformed requests are replayed to Flask so that they get exactly the same error responses
+        return await flask_application(scope, replay_body(body, more_body, receive), send)
+    await send_json(send, scope, result, status)
+    metrics.finish_request(endpoint, status, started, metrics.get_outcome(result, status))
+    if capture:
+        executor.submit(capture)
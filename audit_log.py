@@ -0,0 +1,130 @@
+import os
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime, timezone
+
+AUDIT_COLUMNS = ("id", "recorded_at", "verification", "iban", "name", "surname", "status", "outcome")
+
+
+class AuditLog:
+    """Durable record of the verification outcomes, written off the request path.
+
+    Requests only put a tuple on a bounded queue. A background thread drains it and inserts the entries in batches,
+    one transaction per batch, into a separate SQLite file. When the queue is full the entry is dropped and counted,
+    so that a slow disk never slows down the verifications.
+    """
+
+    def __init__(self, path, queue_size=10000, batch_size=500, flush_interval=0.5, put_timeout=0.0):
+        self.path = path
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.put_timeout = put_timeout
+        self.lock = threading.Lock()
+        self.writer = None
+        self.writer_pid = None
+        self.stopping = threading.Event()
+        self.enqueued = 0
+        self.written = 0
+        self.dropped = 0
+        self.batches = 0
+        self.failed = 0
+
+    def open_connection(self):
+        connection = sqlite3.connect(self.path, check_same_thread=False)
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = NORMAL")
+        connection.execute(
+            "CREATE TABLE IF NOT EXISTS verification_audit (id INTEGER PRIMARY KEY AUTOINCREMENT, "
+            "recorded_at TIMESTAMP NOT NULL, verification VARCHAR(6) NOT NULL, iban VARCHAR(34), name VARCHAR(120), "
+            "surname VARCHAR(50), status INTEGER NOT NULL, outcome VARCHAR(80))")
+        connection.execute("CREATE INDEX IF NOT EXISTS verification_audit_iban ON verification_audit (iban)")
+        connection.commit()
+        return connection
+
+    def record(self, verification, iban, name, surname, body, status):
+        self.start_writer()
+        entry = (time.time(), verification, iban, name, surname, status, body.get("message") or body.get("error"))
+        try:
+            if self.put_timeout:
+                self.queue.put(entry, timeout=self.put_timeout)
+            else:
+                self.queue.put_nowait(entry)
+            self.enqueued += 1
+        except queue.Full:
+            self.dropped += 1
+
+    def start_writer(self):
+        if self.writer_pid == os.getpid():
+            return
+        with self.lock:
+            if self.writer_pid == os.getpid():
+                return
+            self.writer_pid = os.getpid()
+            self.stopping.clear()
+            self.writer = threading.Thread(target=self.write_periodically, name="audit-log-writer", daemon=True)
+            self.writer.start()
+
+    def drain(self, first_entry=None):
+        entries = [first_entry] if first_entry else []
+        while len(entries) < self.batch_size:
+            try:
+                entries.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return entries
+
+    def write(self, connection, entries):
+        rows = [(datetime.fromtimestamp(recorded_at, timezone.utc).strftime("%Y-%m-%d %H:%M:%S.%f"), *entry)
+                for recorded_at, *entry in entries]
+        try:
+            connection.executemany(
+                "INSERT INTO verification_audit (recorded_at, verification, iban, name, surname, status, outcome) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+            connection.commit()
+            self.written += len(rows)
+            self.batches += 1
+        except sqlite3.Error:
+            connection.rollback()
+            self.failed += len(rows)
+
+    def write_periodically(self):
+        connection = self.open_connection()
+        try:
+            while not self.stopping.is_set():
+                try:
+                    first_entry = self.queue.get(timeout=self.flush_interval)
+                except queue.Empty:
+                    continue
+                # Entries that arrived while the previous batch was being committed go into the same transaction
+                self.write(connection, self.drain(first_entry))
+            while not self.queue.empty():
+                self.write(connection, self.drain())
+        finally:
+            connection.close()
+
+    def close(self):
+        """Writes the entries still queued. Called on shutdown."""
+        if self.writer is None or self.writer_pid != os.getpid():
+            return
+        self.stopping.set()
+        self.writer.join(timeout=10)
+
+    def select_recent(self, limit, before=None, iban=None):
+        connection = self.open_connection()
+        try:
+            query, params = f"SELECT {', '.join(AUDIT_COLUMNS)} FROM verification_audit", []
+            conditions = []
+            if before:
+                conditions.append("id < ?")
+                params.append(before)
+            if iban:
+                conditions.append("iban = ?")
+                params.append(iban)
+            if conditions:
+                query += " WHERE " + " AND ".join(conditions)
+            return connection.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        finally:
+            connection.close()
@@ -0,0 +1,104 @@
+import argparse
+import json
+import os
+import platform
+import random
+import time
+from datetime import datetime, timezone
+
+from benchmarks.generate_data import generate_rows
+from benchmarks.run import RESULTS_DIRECTORY, get_commit, summarize
+
+# Names an analyst could paste from an email, from a common pair of words to one no company is close to
+QUERIES = ["energia italia s.p.a.", "Costruzioni Ferraro SpA", "auto service snc", "green tech s.r.l.",
+           "tessile moda nord s.r.l.", "Sapori di Casa S.a.s. di Rossi & C.", "cybersonic", "meccanica",
+           "Zeta Quantum srl"]
+
+
+def build_company_rows(count, seed):
+    """Returns count company rows shaped as the index loads them from iban_holders."""
+    return [(holder_id, iban, company_name, company_name_folded, company_name_stripped)
+            for holder_id, iban, _, _, company_name, company_name_folded, company_name_stripped, _
+            in generate_rows(count, 1.0, seed)]
+
+
+def search_full_scan(index, company_name, limit, score_cutoff):
+    """Returns the ids and scores of the results when every name is scored with the three scorers, as the search did
+    before it bounded the candidates."""
+    import numpy as np
+    from rapidfuzz import process, fuzz
+
+    names = index.columns[3]
+    scores = np.zeros(len(names))
+    for scorer, weight in ((fuzz.ratio, 0.4), (fuzz.partial_ratio, 0.2), (fuzz.WRatio, 0.4)):
+        scores += weight * process.cdist([company_name], names, scorer=scorer, dtype=np.float64,
+                                         workers=index.workers)[0]
+    scores = np.round(scores)
+    matched_names = np.flatnonzero(scores >= score_cutoff)
+    rows, scores = index.rank_rows(matched_names, scores[matched_names])
+    return [(index.columns[0][row], int(score)) for row, score in zip(rows[:limit], scores[:limit])]
+
+
+def main():
+    from company_search import CompanySearchIndex, build_index
+    from utils import to_lower
+
+    parser = argparse.ArgumentParser(description="Latency of the fuzzy company search over synthetic company names")
+    parser.add_argument("--companies", type=int, default=1_000_000)
+    parser.add_argument("--iterations", type=int, default=20, help="Searches per query")
+    parser.add_argument("--workers", type=int, default=1, help="rapidfuzz worker threads (-1 uses all cores)")
+    parser.add_argument("--min-score", type=int, default=85)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--full-scan", action="store_true",
+                        help="Also time scoring every distinct name, and check that both find the same names")
+    parser.add_argument("--output", help="Defaults to benchmarks/results/<commit>-company-search.json")
+    args = parser.parse_args()
+
+    index = CompanySearchIndex(args.workers)
+    rows = build_company_rows(args.companies, args.seed)
+    started = time.perf_counter()
+    index.columns = build_index(rows)
+    build_seconds = time.perf_counter() - started
+    print(f"Index of {len(rows)} companies, {len(index.columns[3])} distinct names, built in {build_seconds:.2f} s")
+    queries = QUERIES + [company_name for _, _, company_name, _, _ in random.Random(args.seed).sample(rows, 5)]
+
+    micro = {}
+    for query in queries:
+        samples = []
+        started = time.perf_counter()
+        for _ in range(args.iterations):
+            call_started = time.perf_counter()
+            results = index.search(query, 10, args.min_score)
+            samples.append(time.perf_counter() - call_started)
+        micro[f"company search {query!r}"] = summarize(samples, time.perf_counter() - started)
+        if args.full_scan:
+            started = time.perf_counter()
+            full_scan_results = search_full_scan(index, to_lower(query), 10, args.min_score)
+            elapsed = time.perf_counter() - started
+            micro[f"company search {query!r} (full scan)"] = summarize([elapsed], elapsed)
+            assert [(result["id"], result["score"]) for result in results] == full_scan_results, \
+                f"Different results for {query!r}"
+    commit = get_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "size": f"{args.companies}-companies",
+        "iterations": args.iterations,
+        "workers": args.workers,
+        "cpu_count": os.cpu_count(),
+        "build_seconds": round(build_seconds, 2),
+        "micro": micro,
+        "endpoints": {},
+    }
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{commit}-company-search.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    for name, result in micro.items():
+        print(f"{name:75} p50 {result['p50_us'] / 1000:>9.2f} ms  p99 {result['p99_us'] / 1000:>9.2f} ms")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,33 @@
+import argparse
+import json
+
+
+def load_results(path):
+    with open(path, encoding="utf-8") as results_file:
+        report = json.load(results_file)
+    return report, {**report["micro"], **report["endpoints"]}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare two benchmark result files")
+    parser.add_argument("baseline")
+    parser.add_argument("candidate")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative p50 slowdown reported as a regression")
+    args = parser.parse_args()
+
+    baseline_report, baseline = load_results(args.baseline)
+    candidate_report, candidate = load_results(args.candidate)
+    print(f"{baseline_report['commit']} -> {candidate_report['commit']}")
+    regressions = 0
+    for name, result in candidate.items():
+        if name not in baseline:
+            continue
+        change = result["p50_us"] / baseline[name]["p50_us"] - 1 if baseline[name]["p50_us"] else 0
+        flag = "REGRESSION" if change > args.threshold else ""
+        regressions += bool(flag)
+        print(f"{name:55} p50 {baseline[name]['p50_us']:>10} -> {result['p50_us']:>10} us ({change:+.1%}) {flag}")
+    raise SystemExit(1 if regressions else 0)
+
+
+if __name__ == "__main__":
+    main()
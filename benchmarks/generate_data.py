@@ -0,0 +1,111 @@
+import argparse
+import os
+import random
+import sqlite3
+import string
+from uuid import uuid4
+
+import bcrypt
+from rich.console import Console
+
+from initialize_database import create_tables
+from utils import IBAN_LETTERS_TO_DIGITS, normalize_company_name
+
+console = Console()
+
+SIZES = {"10k": 10_000, "1m": 1_000_000, "10m": 10_000_000}
+
+BENCHMARK_ADMIN = ("benchmark", "benchmark")
+
+FIRST_NAMES = ["Luca", "Francesca", "Andrea", "Elisa", "Marco", "Maria Elena", "Giulia", "Matteo", "Chiara", "Davide",
+               "Serena", "Paolo", "Alessandro", "Sara", "Giovanni", "Federica", "Lorenzo", "Martina", "Luigi Francesco"]
+LAST_NAMES = ["Moretti", "Russo", "Romano", "Conti", "De Luca", "Galli", "Ricci", "Lo Monaco", "Ferraro", "Bianchi",
+              "Rizzo", "Martini", "Esposito", "Colombo", "Bruno", "Greco", "Marino", "D'Angelo", "Fontana", "Caruso"]
+COMPANY_WORDS = ["Costruzioni", "Auto", "Service", "Design", "Arredo", "Sapori", "Casa", "Fashion", "Style", "Cyber",
+                 "Sonic", "Logistica", "Trasporti", "Edil", "Green", "Energia", "Tech", "Nord", "Sud", "Italia",
+                 "Servizi", "Alimentari", "Moda", "Impianti", "Consulting", "Digital", "Meccanica", "Tessile"]
+LEGAL_FORMS = ["S.r.l.", "S.p.A.", "S.n.c.", "S.a.s.", "S.r.l.s.", "S.s.", "S.a.p.a."]
+PARTNERSHIP_FORMS = {"S.n.c.", "S.a.s."}
+
+
+def make_iban(rng, sequence):
+    cin = rng.choice(string.ascii_uppercase)
+    abi, cab = rng.randrange(1000, 99999), rng.randrange(10000, 99999)
+    bban = f"{cin}{abi:05d}{cab:05d}{sequence:012d}"
+    check_digits = 98 - int((bban + "IT00").translate(IBAN_LETTERS_TO_DIGITS)) % 97
+    return f"IT{check_digits:02d}{bban}"
+
+
+def make_company_name(rng):
+    words = " ".join(rng.sample(COMPANY_WORDS, rng.randint(1, 3)))
+    legal_form = rng.choice(LEGAL_FORMS)
+    if legal_form in PARTNERSHIP_FORMS and rng.random() < 0.5:
+        return f"{words} {legal_form} di {rng.choice(LAST_NAMES)} & C."
+    return f"{words} {legal_form}"
+
+
+def generate_rows(count, company_ratio, seed):
+    rng = random.Random(seed)
+    for sequence in range(count):
+        iban = make_iban(rng, sequence)
+        if rng.random() < company_ratio:
+            company_name = make_company_name(rng)
+            yield str(uuid4()), iban, None, None, company_name, *normalize_company_name(company_name)
+        else:
+            yield str(uuid4()), iban, rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES), None, None, None, None
+
+
+def generate_database(path, count, company_ratio=0.3, seed=42, batch_size=100_000):
+    if os.path.exists(path):
+        os.remove(path)
+    connection = sqlite3.connect(path)
+    try:
+        cursor = connection.cursor()
+        connection.execute("PRAGMA journal_mode = WAL")
+        connection.execute("PRAGMA synchronous = OFF")
+        create_tables(cursor)
+        username, password = BENCHMARK_ADMIN
+        # A low work factor keeps the benchmark logins cheap
+        hashed_password = bcrypt.hashpw(password.encode(), bcrypt.gensalt(rounds=4)).decode()
+        cursor.execute("INSERT INTO administrators (id, username, password) VALUES (?, ?, ?)",
+                       (str(uuid4()), username, hashed_password))
+        rows = generate_rows(count, company_ratio, seed)
+        inserted = 0
+        while inserted < count:
+            batch = [row for _, row in zip(range(batch_size), rows)]
+            cursor.executemany(
+                "INSERT INTO iban_holders (id, iban, first_name, last_name, company_name, company_name_folded, "
+                "company_name_stripped, legal_form) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", batch)
+            connection.commit()
+            inserted += len(batch)
+            console.print(f"[cyan]{inserted}/{count} holders written to {path}[/cyan]")
+    finally:
+        connection.close()
+
+
+def sample_ibans(path, count, seed=7):
+    connection = sqlite3.connect(path)
+    try:
+        total = connection.execute("SELECT MAX(rowid) FROM iban_holders").fetchone()[0] or 0
+        rng = random.Random(seed)
+        rowids = [rng.randint(1, total) for _ in range(count)] if total else []
+        query = "SELECT iban, first_name, last_name, company_name FROM iban_holders WHERE rowid = ?"
+        return [row for row in (connection.execute(query, (rowid,)).fetchone() for rowid in rowids) if row]
+    finally:
+        connection.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic iban_holders databases for the benchmarks")
+    parser.add_argument("--size", choices=SIZES, default="10k")
+    parser.add_argument("--output", help="Defaults to benchmarks/data/<size>/BankDatabase.db")
+    parser.add_argument("--company-ratio", type=float, default=0.3)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    output = args.output or os.path.join("benchmarks", "data", args.size, "BankDatabase.db")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    generate_database(output, SIZES[args.size], args.company_ratio, args.seed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import argparse
+import json
+import os
+import platform
+import random
+import subprocess
+import time
+from datetime import datetime, timezone
+
+import db_utils
+from benchmarks.generate_data import BENCHMARK_ADMIN, SIZES, generate_database, sample_ibans
+
+RESULTS_DIRECTORY = os.path.join("benchmarks", "results")
+
+
+def summarize(samples, elapsed):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p99_us": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1e6, 2),
+        "requests_per_second": round(len(samples) / elapsed, 1),
+    }
+
+
+def measure(function, arguments, iterations):
+    samples = []
+    started = time.perf_counter()
+    for index in range(iterations):
+        call_started = time.perf_counter()
+        function(*arguments[index % len(arguments)])
+        samples.append(time.perf_counter() - call_started)
+    return summarize(samples, time.perf_counter() - started)
+
+
+def run_micro_benchmarks(holders, iterations):
+    from utils import is_valid_iban, are_company_names_similar, extract_legal_form, similarity_cache, to_lower, \
+        normalize_company_name
+
+    company_names = [company_name for _, _, _, company_name in holders if company_name]
+    companies = [normalize_company_name(company_name) for company_name in company_names]
+    company_pairs = [(to_lower(company_name.split(" ")[0]), folded, stripped)
+                     for company_name, (folded, stripped, _) in zip(company_names, companies)]
+    cache_size = similarity_cache.max_size
+    similarity_cache.resize(0)
+    try:
+        similarity = measure(are_company_names_similar, company_pairs, iterations)
+    finally:
+        similarity_cache.resize(cache_size)
+    return {
+        "is_valid_iban": measure(is_valid_iban, [(holder[0],) for holder in holders], iterations),
+        "are_company_names_similar": similarity,
+        "are_company_names_similar_cached": measure(are_company_names_similar, company_pairs[:50], iterations),
+        "extract_legal_form": measure(extract_legal_form, [(folded,) for folded, _, _ in companies], iterations),
+    }
+
+
+def build_requests(holders):
+    rng = random.Random(11)
+    unknown_iban = "IT60X0542811101000000123456"
+    verification, sender_verification = [], []
+    for iban, first_name, last_name, company_name in holders:
+        if company_name:
+            verification.append({"name": company_name.split(" di ")[0], "iban": iban})
+            sender_verification.append({"sender": company_name, "iban": iban})
+        else:
+            verification.append({"name": first_name, "surname": last_name, "iban": iban})
+            sender_verification.append({"sender": f"{first_name} {last_name}", "iban": iban})
+    verification.append({"name": "Mario", "surname": "Rossi", "iban": unknown_iban})
+    batch = [{"items": rng.sample(verification, min(100, len(verification)))} for _ in range(10)]
+    validation = [{"ibans": [holder[0] for holder in rng.sample(holders, min(1000, len(holders)))]}]
+    search_names = [company_name.split(" ")[0] for _, _, _, company_name in holders if company_name][:20]
+    return [
+        ("POST /api/v1/iban-verification", "post", "/api/v1/iban-verification", verification),
+        ("POST /api/v1/sender-iban-verification", "post", "/api/v1/sender-iban-verification", sender_verification),
+        ("POST /api/v1/iban-verification/batch (100 items)", "post", "/api/v1/iban-verification/batch", batch),
+        ("POST /api/v1/iban-validation (1000 items)", "post", "/api/v1/iban-validation", validation),
+        ("GET /api/v1/ibans?limit=1000", "get", "/api/v1/ibans?limit=1000", [None]),
+        ("GET /api/v1/company-search", "get", "/api/v1/company-search?name={}", search_names or ["Costruzioni"]),
+    ]
+
+
+def run_load_benchmarks(holders, iterations):
+    from app import create_app
+
+    client = create_app().test_client()
+    username, password = BENCHMARK_ADMIN
+    client.post("/admin-HaZiNgTLamSe", json={"username": username, "password": password})
+    results = {}
+    for name, method, url, payloads in build_requests(holders):
+        samples, statuses = [], {}
+        started = time.perf_counter()
+        for index in range(iterations):
+            payload = payloads[index % len(payloads)]
+            call_started = time.perf_counter()
+            if method == "post":
+                response = client.post(url, json=payload)
+            else:
+                response = client.get(url.format(payload) if payload else url)
+            response.get_data()
+            samples.append(time.perf_counter() - call_started)
+            statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+        results[name] = {**summarize(samples, time.perf_counter() - started), "statuses": statuses}
+    return results
+
+
+def get_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Micro-benchmarks and in-process load test of the Banking API")
+    parser.add_argument("--size", choices=SIZES, default="10k")
+    parser.add_argument("--database", help="Defaults to benchmarks/data/<size>/BankDatabase.db, generated if missing")
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--output", help="Defaults to benchmarks/results/<commit>-<size>.json")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join("benchmarks", "data", args.size, "BankDatabase.db")
+    if not os.path.exists(database):
+        os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+        generate_database(database, SIZES[args.size])
+    db_utils.DATABASE = database
+    holders = sample_ibans(database, 1000)
+
+    commit = get_commit()
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "size": args.size,
+        "iterations": args.iterations,
+        "micro": run_micro_benchmarks(holders, args.iterations),
+        "endpoints": run_load_benchmarks(holders, args.iterations),
+    }
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{commit}-{args.size}.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    for section in ("micro", "endpoints"):
+        for name, result in report[section].items():
+            print(f"{name:55} p50 {result['p50_us']:>10} us  p99 {result['p99_us']:>10} us  "
+                  f"{result['requests_per_second']:>10} req/s")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
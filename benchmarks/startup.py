@@ -0,0 +1,114 @@
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+
+# Nothing of the app is imported at the top, so that a worker measures the imports of app.py in full
+
+# The verification endpoints, which need no session and are the ones a restarted worker must serve quickly
+FIRST_REQUESTS = ("POST /api/v1/iban-verification", "POST /api/v1/sender-iban-verification",
+                  "POST /api/v1/iban-verification/batch (100 items)", "POST /api/v1/iban-validation (1000 items)")
+
+
+def run_worker(database, warm_up, requests_per_endpoint):
+    """Boots the app in this process and measures its startup and first requests, in seconds."""
+    started = time.perf_counter()
+    import config
+    import db_utils
+
+    config.Config.WARM_UP_ENABLED = warm_up
+    db_utils.DATABASE = database
+    import app as app_module
+    imported = time.perf_counter()
+    # Trees before the app factory build the app when app.py is imported
+    app = app_module.create_app() if hasattr(app_module, "create_app") else app_module.app
+    ready = time.time()
+    created = time.perf_counter()
+    from benchmarks.generate_data import sample_ibans
+    from benchmarks.run import build_requests
+
+    client = app.test_client()
+    timings = {"import": imported - started, "create_app": created - imported}
+    requests = {name: payloads for name, _, _, payloads in build_requests(sample_ibans(database, 1000, seed=13))}
+    for name in FIRST_REQUESTS:
+        samples = []
+        for index in range(requests_per_endpoint):
+            payload = requests[name][index % len(requests[name])]
+            call_started = time.perf_counter()
+            client.post(name.split()[1], json=payload).get_data()
+            samples.append(time.perf_counter() - call_started)
+        timings[f"{name} first"] = samples[0]
+        timings[f"{name} next"] = sorted(samples[1:])[len(samples[1:]) // 2]
+    return ready, timings
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "p50_us": round(samples[len(samples) // 2] * 1e6, 2),
+        "p99_us": round(samples[-1] * 1e6, 2),
+    }
+
+
+def run_workers(database, warm_up, runs, requests_per_endpoint):
+    """Starts a fresh interpreter per run, as a recycled worker of a pre-fork server is."""
+    samples = {}
+    for _ in range(runs):
+        spawned = time.time()
+        worker = subprocess.run([sys.executable, "-c", "import json; from benchmarks.startup import run_worker; "
+                                 f"print(json.dumps(run_worker({database!r}, {warm_up}, {requests_per_endpoint})))"],
+                                capture_output=True, text=True, check=True)
+        ready, timings = json.loads(worker.stdout.strip().splitlines()[-1])
+        samples.setdefault("time to ready", []).append(ready - spawned)
+        for name, seconds in timings.items():
+            samples.setdefault(name, []).append(seconds)
+    return {name: summarize(values) for name, values in samples.items()}
+
+
+def main():
+    from benchmarks.generate_data import SIZES, generate_database
+    from benchmarks.run import RESULTS_DIRECTORY, get_commit
+
+    parser = argparse.ArgumentParser(description="Time to first request and first-request latency of a fresh worker")
+    parser.add_argument("--size", choices=SIZES, default="10k")
+    parser.add_argument("--database", help="Defaults to benchmarks/data/<size>/BankDatabase.db, generated if missing")
+    parser.add_argument("--runs", type=int, default=10)
+    parser.add_argument("--requests", type=int, default=20, help="Requests per endpoint after boot")
+    parser.add_argument("--output", help="Defaults to benchmarks/results/<commit>-<size>-startup.json")
+    args = parser.parse_args()
+
+    database = args.database or os.path.join("benchmarks", "data", args.size, "BankDatabase.db")
+    if not os.path.exists(database):
+        os.makedirs(os.path.dirname(database) or ".", exist_ok=True)
+        generate_database(database, SIZES[args.size])
+
+    commit = get_commit()
+    endpoints = {}
+    for label, warm_up in (("warm-up", True), ("no warm-up", False)):
+        for name, result in run_workers(database, warm_up, args.runs, args.requests).items():
+            endpoints[f"{name} ({label})"] = result
+    report = {
+        "commit": commit,
+        "timestamp": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "size": args.size,
+        "runs": args.runs,
+        "micro": {},
+        "endpoints": endpoints,
+    }
+    output = args.output or os.path.join(RESULTS_DIRECTORY, f"{commit}-{args.size}-startup.json")
+    os.makedirs(os.path.dirname(output) or ".", exist_ok=True)
+    with open(output, "w", encoding="utf-8") as output_file:
+        json.dump(report, output_file, indent=2)
+    for name, result in endpoints.items():
+        print(f"{name:75} p50 {result['p50_us']:>12} us  max {result['p99_us']:>12} us")
+    print(f"Results written to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+import hashlib
+import math
+import os
+import struct
+import threading
+import time
+
+import numpy as np
+
+from db_utils import get_connection, release_connection, get_registry_version, get_registry_fingerprint, \
+    select_from_shards
+
+FILE_MAGIC = b"IBBF"
+FILE_FORMAT_VERSION = 1
+# Magic, format version, number of bits, number of hashes, capacity, number of IBANs added, registry version and
+# registry fingerprint
+FILE_HEADER = struct.Struct("<4sHQHQQq16s")
+MINIMUM_CAPACITY = 10000
+# Room left for IBANs added between two rebuilds before the false-positive rate degrades
+CAPACITY_HEADROOM = 1.5
+UINT64_MASK = (1 << 64) - 1
+
+
+def hash_iban(iban):
+    digest = hashlib.blake2b(iban.encode(), digest_size=16).digest()
+    return int.from_bytes(digest[:8], "little"), int.from_bytes(digest[8:], "little") | 1
+
+
+def get_positions(iban, num_bits, num_hashes):
+    first_hash, second_hash = hash_iban(iban)
+    return [((first_hash + index * second_hash) & UINT64_MASK) % num_bits for index in range(num_hashes)]
+
+
+def get_filter_size(capacity, false_positive_rate):
+    bits = math.ceil(-capacity * math.log(false_positive_rate) / math.log(2) ** 2)
+    return bits, max(1, round(bits / capacity * math.log(2)))
+
+
+class IbanBloomFilter:
+    """Compact probabilistic set of the registered IBANs.
+
+    A negative answer is definite, so unknown IBANs are rejected without a database lookup. IBANs removed from the
+    registry stay in the filter, and only cost a regular lookup, until the next periodic rebuild. Writes made by other
+    processes are detected through the registry version and trigger a rebuild.
+    """
+
+    def __init__(self, false_positive_rate=0.01, path=None, refresh_interval=1.0, rebuild_interval=3600.0):
+        self.false_positive_rate = false_positive_rate
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.rebuild_interval = rebuild_interval
+        # The bits, number of bits and number of hashes, replaced together so that a lookup never mixes two filters
+        self.state = (bytearray(1), 8, 1)
+        self.capacity = 0
+        self.count = 0
+        self.version = None
+        self.fingerprint = b""
+        self.built_at = 0.0
+        self.rebuilds = 0
+        self.lock = threading.RLock()
+        self.refresher_pid = None
+
+    def might_contain(self, iban):
+        self.start_refresher()
+        bits, num_bits, num_hashes = self.state
+        return all(bits[position >> 3] & (1 << (position & 7))
+                   for position in get_positions(iban, num_bits, num_hashes))
+
+    def add(self, iban):
+        with self.lock:
+            bits, num_bits, num_hashes = self.state
+            for position in get_positions(iban, num_bits, num_hashes):
+                bits[position >> 3] |= 1 << (position & 7)
+            self.count += 1
+
+    def build(self, connection):
+        with self.lock:
+            version, fingerprint = get_registry_version(connection), get_registry_fingerprint(connection)
+            ibans = [row[0] for row in select_from_shards(connection, "SELECT iban FROM iban_holders")]
+            capacity = max(MINIMUM_CAPACITY, int(len(ibans) * CAPACITY_HEADROOM))
+            num_bits, num_hashes = get_filter_size(capacity, self.false_positive_rate)
+            bits = np.zeros((num_bits + 7) // 8, dtype=np.uint8)
+            if ibans:
+                hashes = np.array([hash_iban(iban) for iban in ibans], dtype=np.uint64)
+                first_hashes, second_hashes = hashes[:, 0], hashes[:, 1]
+                with np.errstate(over="ignore"):
+                    for index in range(num_hashes):
+                        positions = (first_hashes + np.uint64(index) * second_hashes) % np.uint64(num_bits)
+                        np.bitwise_or.at(bits, positions >> np.uint64(3),
+                                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+            self.state = (bytearray(bits.tobytes()), num_bits, num_hashes)
+            self.capacity, self.count, self.version = capacity, len(ibans), version
+            self.fingerprint = fingerprint
+            self.built_at = time.monotonic()
+            self.rebuilds += 1
+            self.save()
+
+    def load(self, connection):
+        """Loads the persisted filter if it matches the current registry, otherwise rebuilds it."""
+        with self.lock:
+            if self.path and os.path.exists(self.path):
+                try:
+                    with open(self.path, "rb") as filter_file:
+                        header = filter_file.read(FILE_HEADER.size)
+                        magic, format_version, num_bits, num_hashes, capacity, count, version, fingerprint = \
+                            FILE_HEADER.unpack(header)
+                        if magic == FILE_MAGIC and format_version == FILE_FORMAT_VERSION and \
+                                version == get_registry_version(connection) and \
+                                fingerprint == get_registry_fingerprint(connection) and \
+                                num_hashes == get_filter_size(capacity, self.false_positive_rate)[1]:
+                            bits = bytearray(filter_file.read())
+                            if len(bits) == (num_bits + 7) // 8:
+                                self.state = (bits, num_bits, num_hashes)
+                                self.capacity, self.count, self.version = capacity, count, version
+                                self.fingerprint = fingerprint
+                                self.built_at = time.monotonic()
+                                return
+                except (OSError, struct.error):
+                    pass
+            self.build(connection)
+
+    def save(self):
+        if not self.path:
+            return
+        bits, num_bits, num_hashes = self.state
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as filter_file:
+            filter_file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_FORMAT_VERSION, num_bits, num_hashes,
+                                               self.capacity, self.count, self.version or 0,
+                                               self.fingerprint))
+            filter_file.write(bits)
+        os.replace(temporary_path, self.path)
+
+    def apply_changes(self, connection, changes, added_ibans=()):
+        with self.lock:
+            for iban in added_ibans:
+                self.add(iban)
+            version = get_registry_version(connection)
+            if self.version is None or version != self.version + changes:
+                self.build(connection)
+                return
+            self.version = version
+
+    def needs_rebuild(self):
+        return self.count > self.capacity or time.monotonic() - self.built_at >= self.rebuild_interval
+
+    def refresh_if_stale(self):
+        connection = None
+        try:
+            connection = get_connection()
+            if self.needs_rebuild() or get_registry_version(connection) != self.version:
+                self.build(connection)
+        finally:
+            release_connection(connection)
+
+    def start_refresher(self):
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            threading.Thread(target=self.refresh_periodically, daemon=True).start()
+
+    def refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                # The next iteration retries, e.g. while the database is locked by a long write
+                continue
@@ -0,0 +1,243 @@
+import argparse
+import csv
+import json
+import sqlite3
+from itertools import islice
+from uuid import uuid4
+
+from rich.console import Console
+
+from db_utils import DATABASE, MAX_QUERY_PARAMETERS, configure_database, get_shard_count, get_iban_shard, \
+    open_connection, migrate_database, rebuild_search_index
+from utils import parse_input_data, validate_input, normalize_company_legal_form, normalize_company_name
+
+console = Console()
+
+EXPORT_QUERY = "SELECT first_name, last_name, company_name, iban FROM iban_holders"
+
+
+def detect_format(path, file_format):
+    if file_format:
+        return file_format
+    return "jsonl" if path.endswith((".jsonl", ".ndjson")) else "csv"
+
+
+def read_records(input_file, file_format):
+    if file_format == "jsonl":
+        for line in input_file:
+            if line.strip():
+                try:
+                    yield json.loads(line)
+                except json.JSONDecodeError:
+                    yield {"line": line.rstrip("\n")}
+        return
+    for record in csv.DictReader(input_file):
+        # An empty surname column marks a company, exactly like a missing "surname" key in the API
+        if not record.get("surname"):
+            record.pop("surname", None)
+        yield record
+
+
+class RecordWriter:
+    def __init__(self, output_file, file_format, fieldnames):
+        self.output_file = output_file
+        self.file_format = file_format
+        self.csv_writer = None
+        if file_format == "csv":
+            self.csv_writer = csv.DictWriter(output_file, fieldnames=fieldnames, extrasaction="ignore")
+            self.csv_writer.writeheader()
+
+    def write(self, record):
+        if self.csv_writer:
+            self.csv_writer.writerow(record)
+        else:
+            self.output_file.write(json.dumps(record, ensure_ascii=False) + "\n")
+
+
+def prepare_record(record):
+    try:
+        person_or_company_name, surname, iban = parse_input_data(record)
+    except (KeyError, TypeError, AttributeError):
+        return None, "Record is not valid"
+    error = validate_input(person_or_company_name, surname, iban)
+    if error:
+        return None, error
+    if surname:
+        return (str(uuid4()), iban, person_or_company_name, surname, None, None, None, None), ""
+    company_name = normalize_company_legal_form(person_or_company_name)
+    return (str(uuid4()), iban, None, None, company_name, *normalize_company_name(company_name)), ""
+
+
+def select_existing_ibans(cursor, ibans):
+    existing_ibans = set()
+    for start in range(0, len(ibans), MAX_QUERY_PARAMETERS):
+        chunk = ibans[start:start + MAX_QUERY_PARAMETERS]
+        placeholders = ", ".join("?" * len(chunk))
+        cursor.execute(f"SELECT iban FROM iban_holders WHERE iban IN ({placeholders})", chunk)
+        existing_ibans.update(row[0] for row in cursor.fetchall())
+    return existing_ibans
+
+
+def drop_secondary_indexes(cursor):
+    """Drops the indexes created with CREATE INDEX, and returns them to be created again after the load. The index of
+    the UNIQUE constraint on iban has no SQL of its own and is kept on purpose: select_existing_ibans looks every batch
+    up through it, and it keeps the IBANs unique if a holder is added while the load runs."""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'iban_holders' "
+                   "AND sql IS NOT NULL")
+    indexes = cursor.fetchall()
+    for name, _ in indexes:
+        cursor.execute(f"DROP INDEX {name}")
+    return indexes
+
+
+def drop_insert_triggers(cursor):
+    """Drops the triggers that bump the registry version, log to the change feed and index the names on every inserted
+    row, and returns them to be created again once catch_up_imported_rows has done their work for the whole load."""
+    cursor.execute("SELECT name, sql FROM sqlite_master WHERE type = 'trigger' AND tbl_name = 'iban_holders' "
+                   "AND name LIKE 'iban_holders_insert_%'")
+    triggers = cursor.fetchall()
+    for name, _ in triggers:
+        cursor.execute(f"DROP TRIGGER {name}")
+    return triggers
+
+
+def catch_up_imported_rows(cursor, last_rowid):
+    """Records the rows inserted after last_rowid in the change feed with a single statement, rebuilds the search
+    index and bumps the registry version once."""
+    cursor.execute("INSERT INTO iban_changes (holder_id, iban, operation) "
+                   "SELECT id, iban, 'insert' FROM iban_holders WHERE rowid > ? ORDER BY rowid", (last_rowid,))
+    if not cursor.rowcount:
+        return
+    rebuild_search_index(cursor)
+    cursor.execute("UPDATE registry_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1")
+
+
+def import_records(input_path, rejects_path, file_format=None, batch_size=50000):
+    """Imports the records of a file in one transaction per shard, which drops the secondary indexes and the insert
+    triggers of iban_holders, loads the records, does the work of the triggers once and restores them. A failure or a
+    killed import rolls all of it back, so the schema is never left without them. Meant to run while the app is not
+    writing, as the shards stay locked until the end of the load."""
+    file_format = detect_format(input_path, file_format)
+    imported, rejected = 0, 0
+    connections, indexes, triggers, last_rowids = [], [], [], []
+    try:
+        for shard in range(get_shard_count()):
+            connection = open_connection(shard)
+            connections.append(connection)
+            migrate_database(connection)
+            cursor = connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            last_rowids.append(cursor.execute("SELECT COALESCE(MAX(rowid), 0) FROM iban_holders").fetchone()[0])
+            indexes.append(drop_secondary_indexes(cursor))
+            triggers.append(drop_insert_triggers(cursor))
+        with open(input_path, newline="", encoding="utf-8") as input_file, \
+                open(rejects_path, "w", newline="", encoding="utf-8") as rejects_file:
+            records = read_records(input_file, file_format)
+            rejects = RecordWriter(rejects_file, file_format, ["name", "surname", "iban", "error"])
+            while True:
+                batch = list(islice(records, batch_size))
+                if not batch:
+                    break
+                rows, batch_ibans = [], set()
+                for record in batch:
+                    row, error = prepare_record(record)
+                    if not error and row[1] in batch_ibans:
+                        error = "IBAN inserted already exists"
+                    if error:
+                        rejects.write({**(record if isinstance(record, dict) else {}), "error": error})
+                        rejected += 1
+                        continue
+                    batch_ibans.add(row[1])
+                    rows.append(row)
+                rows_by_shard = {}
+                for row in rows:
+                    rows_by_shard.setdefault(get_iban_shard(row[1]), []).append(row)
+                for shard, shard_rows in rows_by_shard.items():
+                    cursor = connections[shard].cursor()
+                    existing_ibans = select_existing_ibans(cursor, [row[1] for row in shard_rows])
+                    for row in shard_rows:
+                        if row[1] in existing_ibans:
+                            rejects.write({"name": row[2] or row[4], "surname": row[3], "iban": row[1],
+                                           "error": "IBAN inserted already exists"})
+                            rejected += 1
+                    shard_rows = [row for row in shard_rows if row[1] not in existing_ibans]
+                    cursor.executemany(
+                        "INSERT INTO iban_holders (id, iban, first_name, last_name, company_name, company_name_folded, "
+                        "company_name_stripped, legal_form) VALUES (?, ?, ?, ?, ?, ?, ?, ?)", shard_rows)
+                    imported += len(shard_rows)
+                console.print(f"[cyan]Imported {imported} records, rejected {rejected}[/cyan]")
+        for connection, shard_indexes, shard_triggers, last_rowid in zip(connections, indexes, triggers, last_rowids):
+            catch_up_imported_rows(connection.cursor(), last_rowid)
+            for _, sql in shard_triggers + shard_indexes:
+                connection.execute(sql)
+        for connection in connections:
+            connection.commit()
+    except (sqlite3.Error, OSError) as e:
+        console.print(f"[bold red]Import failed:[/bold red] {e}")
+        for connection in connections:
+            connection.rollback()
+        imported = 0
+    finally:
+        for connection in connections:
+            connection.close()
+    return imported, rejected
+
+
+def export_records(output_path, file_format=None, batch_size=50000):
+    file_format = detect_format(output_path, file_format)
+    exported = 0
+    connection = None
+    try:
+        with open(output_path, "w", newline="", encoding="utf-8") as output_file:
+            writer = RecordWriter(output_file, file_format, ["name", "surname", "iban"])
+            for shard in range(get_shard_count()):
+                connection = open_connection(shard)
+                cursor = connection.execute(EXPORT_QUERY)
+                while True:
+                    rows = cursor.fetchmany(batch_size)
+                    if not rows:
+                        break
+                    for first_name, last_name, company_name, iban in rows:
+                        if company_name:
+                            writer.write({"name": company_name, "iban": iban})
+                        else:
+                            writer.write({"name": first_name, "surname": last_name, "iban": iban})
+                    exported += len(rows)
+                connection.close()
+                connection = None
+    except (sqlite3.Error, OSError) as e:
+        console.print(f"[bold red]Export failed:[/bold red] {e}")
+    finally:
+        if connection:
+            connection.close()
+    return exported
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Bulk import and export of the iban_holders table of {DATABASE}")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    import_parser = subparsers.add_parser("import", help="Import holders from a CSV or JSONL file")
+    import_parser.add_argument("input", help="CSV (name,surname,iban) or JSONL file with the same fields")
+    import_parser.add_argument("--rejects", help="File where rejected records are written with the reason")
+    import_parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    import_parser.add_argument("--batch-size", type=int, default=50000, help="Records validated and inserted at a time")
+    export_parser = subparsers.add_parser("export", help="Export holders to a CSV or JSONL file")
+    export_parser.add_argument("output")
+    export_parser.add_argument("--format", choices=["csv", "jsonl"], help="Defaults to the file extension")
+    export_parser.add_argument("--batch-size", type=int, default=50000, help="Rows fetched at a time")
+    args = parser.parse_args()
+    # Reads the number of shards recorded in the database
+    configure_database({})
+
+    if args.command == "import":
+        rejects_path = args.rejects or f"{args.input}.rejects"
+        imported, rejected = import_records(args.input, rejects_path, args.format, args.batch_size)
+        console.print(f"[bold green]{imported} records imported[/bold green], "
+                      f"[bold yellow]{rejected} rejected[/bold yellow] (see {rejects_path})")
+    else:
+        exported = export_records(args.output, args.format, args.batch_size)
+        console.print(f"[bold green]{exported} records exported to {args.output}[/bold green]")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from uuid import uuid4
+
+from db_utils import MAX_QUERY_PARAMETERS, get_connection, release_connection, get_iban_shard, get_shard_count, \
+    select_from_shards, copy_holder
+from utils import parse_input_data, validate_input, validate_iban_id, normalize_company_legal_form, \
+    normalize_company_name, has_iban_record_changed
+
+OPERATIONS = ("add", "modify", "delete")
+
+
+def parse_operation(operation):
+    """Returns the parsed operation and the error that rejects it, without touching the database."""
+    if not isinstance(operation, dict) or operation.get("op") not in OPERATIONS:
+        return {"op": None}, "Operation is not valid"
+    if operation["op"] == "delete":
+        iban_id = str(operation.get("id", ""))
+        return {"op": "delete", "id": iban_id}, validate_iban_id(iban_id)
+    try:
+        person_or_company_name, surname, iban = parse_input_data(operation)
+    except (KeyError, TypeError, AttributeError):
+        return {"op": operation["op"]}, "Operation is not valid"
+    parsed = {"op": operation["op"], "name": person_or_company_name, "surname": surname, "iban": iban}
+    if operation["op"] == "add":
+        if surname is None:
+            parsed["name"] = normalize_company_legal_form(person_or_company_name)
+        return parsed, validate_input(person_or_company_name, surname, iban)
+    parsed["id"] = str(operation.get("id", ""))
+    return parsed, validate_input(person_or_company_name, surname, iban, parsed["id"])
+
+
+def select_existing_holders(connection, iban_ids, ibans):
+    """Loads the rows referenced by a set of operations with a few IN queries instead of one probe per operation."""
+    rows_by_id, ids_by_iban = {}, {}
+    for column, values in (("id", list(iban_ids)), ("iban", list(ibans))):
+        for start in range(0, len(values), MAX_QUERY_PARAMETERS):
+            chunk = values[start:start + MAX_QUERY_PARAMETERS]
+            placeholders = ", ".join("?" * len(chunk))
+            query = f"SELECT * FROM iban_holders WHERE {column} IN ({placeholders})"
+            for row in select_from_shards(connection, query, chunk):
+                rows_by_id[row[0]] = row
+                ids_by_iban[row[1]] = row[0]
+    return rows_by_id, ids_by_iban
+
+
+def plan_operations(connection, operations):
+    """Checks every operation against the registry as left by the operations before it.
+
+    Returns one result per operation, the statements that apply the successful ones in order with the shard they
+    run on, and the IBANs they remove and add or update.
+    """
+    parsed_operations = [parse_operation(operation) for operation in operations]
+    rows_by_id, ids_by_iban = select_existing_holders(
+        connection, {parsed["id"] for parsed, error in parsed_operations if not error and "id" in parsed},
+        {parsed["iban"] for parsed, error in parsed_operations if not error and "iban" in parsed})
+    update_timestamp = datetime.now(timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    results, statements, removed_ibans, updated_ibans = [], [], set(), set()
+    for parsed, error in parsed_operations:
+        body, status, statement = {"error": error}, 400, None
+        operation, iban_id, iban = parsed["op"], parsed.get("id"), parsed.get("iban")
+        if error:
+            pass
+        elif operation == "add":
+            if ids_by_iban.get(iban):
+                body, status = {"error": "IBAN inserted already exists"}, 409
+            else:
+                iban_id = str(uuid4())
+                if parsed["surname"]:
+                    statement = (get_iban_shard(iban),
+                                 "INSERT INTO iban_holders (id, iban, first_name, last_name) VALUES (?, ?, ?, ?)",
+                                 (iban_id, iban, parsed["name"], parsed["surname"]))
+                    row = (iban_id, iban, parsed["name"], parsed["surname"], None)
+                else:
+                    statement = (get_iban_shard(iban), "INSERT INTO iban_holders (id, iban, company_name, "
+                                 "company_name_folded, company_name_stripped, legal_form) VALUES (?, ?, ?, ?, ?, ?)",
+                                 (iban_id, iban, parsed["name"], *normalize_company_name(parsed["name"])))
+                    row = (iban_id, iban, None, None, parsed["name"])
+                rows_by_id[iban_id], ids_by_iban[iban] = row, iban_id
+                updated_ibans.add(iban)
+                body, status = {"message": "IBAN has been added successfully"}, 201
+        elif not rows_by_id.get(iban_id):
+            body, status = {"error": f"There is no iban to {'remove' if operation == 'delete' else 'modify'}"}, 404
+        elif operation == "delete":
+            old_iban = rows_by_id[iban_id][1]
+            statement = (get_iban_shard(old_iban), "DELETE FROM iban_holders WHERE id = ?", (iban_id,))
+            rows_by_id[iban_id], ids_by_iban[old_iban] = None, None
+            removed_ibans.add(old_iban)
+            iban = old_iban
+            body, status = {"message": "IBAN has been removed successfully"}, 200
+        else:
+            row, name, surname = rows_by_id[iban_id], parsed["name"], parsed["surname"]
+            is_person = bool(row[2] and row[3])
+            if iban != row[1] and ids_by_iban.get(iban):
+                body, status = {"error": "IBAN inserted already exists"}, 409
+            elif is_person != bool(surname):
+                body, status = {"error": "A person cannot be changed into a company or vice versa"}, 400
+            elif not has_iban_record_changed(row, name, surname, iban):
+                body, status = {"message": "No changes have been made"}, 200
+            else:
+                shard = get_iban_shard(row[1])
+                if is_person:
+                    statement = (shard, "UPDATE iban_holders SET first_name = ?, last_name = ?, iban = ?, "
+                                        "updated_at = ? WHERE id = ?", (name, surname, iban, update_timestamp, iban_id))
+                    new_row = (iban_id, iban, name, surname, None)
+                else:
+                    statement = (shard, "UPDATE iban_holders SET company_name = ?, company_name_folded = ?, "
+                                        "company_name_stripped = ?, legal_form = ?, iban = ?, updated_at = ? "
+                                        "WHERE id = ?",
+                                 (name, *normalize_company_name(name), iban, update_timestamp, iban_id))
+                    new_row = (iban_id, iban, None, None, name)
+                if get_iban_shard(iban) != shard:
+                    # The holder follows its new bank: the statement without a query moves it to the other shard
+                    statements.append(statement)
+                    statement = (shard, None, (iban_id, get_iban_shard(iban)))
+                ids_by_iban[row[1]] = None
+                rows_by_id[iban_id], ids_by_iban[iban] = new_row, iban_id
+                removed_ibans.add(row[1])
+                updated_ibans.add(iban)
+                body, status = {"message": "IBAN has been modified successfully"}, 200
+        results.append({"op": operation, "id": iban_id, "iban": iban, "status": status, **body})
+        if statement:
+            statements.append(statement)
+    return results, statements, removed_ibans, updated_ibans
+
+
+@contextmanager
+def lock_shards(connection):
+    """Yields a connection to every shard, each holding the write lock of its shard, so that no other write comes in
+    between planning the operations and applying them.
+
+    Every shard is locked, since the shard of a holder referenced by id is only known once it has been read, and in
+    shard order, so that two bulk requests cannot deadlock. What is left uncommitted is rolled back on exit.
+    """
+    connections = {}
+    try:
+        for shard in range(get_shard_count()):
+            connections[shard] = connection if getattr(connection, "shard", 0) == shard else get_connection(shard)
+            connections[shard].execute("BEGIN IMMEDIATE")
+        yield connections
+    finally:
+        for current_connection in connections.values():
+            if current_connection.in_transaction:
+                current_connection.rollback()
+            if current_connection is not connection:
+                release_connection(current_connection)
+
+
+def apply_operations(connections, statements):
+    """Runs the planned statements in the transactions of lock_shards() and returns the number of changed rows.
+
+    Each shard is changed atomically, and the shards are committed one after the other once every statement has run:
+    a failing statement leaves all the shards unchanged. A failing commit, e.g. on a full disk, still keeps the changes
+    of the shards committed before it, and a holder moved between two shards can then end up on both or on neither.
+    """
+    changes = 0
+    for shard, query, params in statements:
+        if query is None:
+            holder_id, target_shard = params
+            copy_holder(connections[shard], connections[target_shard], holder_id)
+            query, params = "DELETE FROM iban_holders WHERE id = ?", (holder_id,)
+            changes += 1
+        changes += connections[shard].execute(query, params).rowcount
+    for current_connection in connections.values():
+        current_connection.commit()
+    return changes
@@ -0,0 +1,211 @@
+import os
+import threading
+from operator import itemgetter
+
+import numpy as np
+
+from db_utils import get_connection, release_connection, select_from_shards, get_registry_version
+from utils import SIMILARITY_THRESHOLD, to_lower, normalize_company_name
+
+
+# Names scored ahead of the others to raise the cutoff to the score of the last result
+PRESCORED_NAMES = 256
+# Characters are counted in 64 groups of code points, so that a name costs 64 bytes in the index
+CHARACTER_GROUPS = 64
+
+
+def count_characters(names):
+    """Returns the length of each name and its number of characters of every group, one row per group. The counts are
+    capped at 255, which keeps them exact for queries, at most 80 characters long."""
+    lengths = np.fromiter(map(len, names), dtype=np.intp, count=len(names))
+    codes = np.frombuffer("".join(names).encode("utf-32-le", "surrogatepass"), dtype=np.uint32) % CHARACTER_GROUPS
+    counts = np.zeros((CHARACTER_GROUPS, len(names)), dtype=np.uint16)
+    np.add.at(counts, (codes, np.repeat(np.arange(len(names)), lengths)), 1)
+    return lengths, np.minimum(counts, 255).astype(np.uint8)
+
+
+def get_target_score(score_cutoff):
+    # np.round rounds halves to even, so a weighted score half a point below the cutoff can still reach it
+    return score_cutoff - 0.5 - 1e-9
+
+
+def get_weighted_ratio_caps(lengths, query_length):
+    """Returns what WRatio can exceed the ratio by: 95% of a token ratio for names of similar lengths, and 90% or 60% of
+    a partial ratio when one name is 1.5 or 8 times longer than the other."""
+    shorter, longer = np.minimum(lengths, query_length), np.maximum(lengths, query_length)
+    return np.where(longer < 1.5 * shorter, 95, np.where(longer < 8 * shorter, 90, 60))
+
+
+def build_index(rows):
+    """Builds the columns of the index from (id, iban, company_name, company_name_folded, company_name_stripped) rows.
+
+    Every distinct name is scored once per search: a company holding several IBANs shares one name, and a row whose name
+    has a partners clause is found through its stripped variant as well. The rows of a name are listed in name_rows,
+    from name_starts[name] to name_starts[name + 1].
+    """
+    columns = list(zip(*rows)) or [(), (), (), (), ()]
+    ids, ibans, company_names, folded_names, stripped_names = (np.array(column, dtype=object) for column in columns)
+    partner_rows = np.flatnonzero(stripped_names != folded_names)
+    names, name_ids = np.unique(np.concatenate((folded_names, stripped_names[partner_rows])), return_inverse=True)
+    row_ids = np.concatenate((np.arange(len(ids)), partner_rows))
+    order = np.argsort(name_ids, kind="stable")
+    name_starts = np.searchsorted(name_ids[order], np.arange(len(names) + 1))
+    names = names.tolist()
+    return (ids, ibans, company_names, names, *count_characters(names), row_ids[order], name_starts)
+
+
+class CompanySearchIndex:
+    """Company names of iban_holders kept as arrays for batched rapidfuzz scoring.
+
+    A search only scores the names that can still reach the cutoff. The characters a name shares with the query bound
+    its ratio and partial ratio, which leaves out most names before rapidfuzz sees them, and each scorer then runs with
+    the cutoff its candidates need given the scores already known. When the names with the best bounds already fill
+    the results, the cutoff is raised to the score of the last one. The results are those of scoring every name.
+
+    The first search builds the index. After that, a background thread rebuilds it when the registry version changes
+    and swaps it in, so that searches keep scoring the previous index, at most refresh_interval seconds old, instead of
+    rebuilding it themselves after every write. Writes made by this process wake the thread up at once.
+    """
+
+    def __init__(self, workers=-1, refresh_interval=1.0):
+        self.workers = workers
+        self.refresh_interval = refresh_interval
+        self.version = None
+        self.columns = build_index([])
+        self.lock = threading.Lock()
+        self.stale = threading.Event()
+        self.refresher_pid = None
+        self.reloads = 0
+
+    def load(self, connection):
+        version = get_registry_version(connection)
+        rows = select_from_shards(connection,
+                                  "SELECT id, iban, company_name, company_name_folded, company_name_stripped "
+                                  "FROM iban_holders WHERE company_name IS NOT NULL")
+        rows = [row if row[3] is not None else (*row[:3], *normalize_company_name(row[2])[:2]) for row in rows]
+        # The columns are replaced together, so that a search never mixes two versions of the index
+        self.columns = build_index(rows)
+        self.version = version
+        self.reloads += 1
+
+    def ensure_loaded(self, connection):
+        self.start_refresher()
+        if self.version is not None:
+            return
+        with self.lock:
+            if self.version is None:
+                self.load(connection)
+
+    def mark_stale(self):
+        self.stale.set()
+
+    def refresh_if_stale(self):
+        connection = None
+        try:
+            connection = get_connection()
+            if get_registry_version(connection) != self.version:
+                with self.lock:
+                    self.load(connection)
+        finally:
+            release_connection(connection)
+
+    def start_refresher(self):
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            threading.Thread(target=self.refresh_periodically, daemon=True).start()
+
+    def refresh_periodically(self):
+        while True:
+            self.stale.wait(self.refresh_interval)
+            self.stale.clear()
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                # The next iteration retries, e.g. while the database is locked by a long write
+                continue
+
+    def score_in_bands(self, company_name, names, indexes, scorer, needed):
+        """Scores the names at indexes in bands of ten points of the score each needs, which rapidfuzz takes as a cutoff
+        to skip most of the work. Scores below the cutoff of their band are 0."""
+        from rapidfuzz import process
+
+        scores = np.zeros(len(indexes))
+        bands = np.clip(needed // 10, 0, 10)
+        for band in np.unique(bands):
+            in_band = np.flatnonzero(bands == band)
+            choices = [names[indexes[i]] for i in in_band] if len(in_band) == 1 else \
+                itemgetter(*indexes[in_band])(names)
+            scores[in_band] = process.cdist([company_name], choices, scorer=scorer, dtype=np.float64,
+                                            workers=self.workers, score_cutoff=band * 10)[0]
+        return scores
+
+    def get_score_bounds(self, company_name, lengths, character_counts):
+        """Returns bounds of the ratio and partial ratio of every name with the query, and what its WRatio can exceed the
+        ratio by. A common subsequence, and so both ratios, has at most the characters both names share."""
+        _, query_counts = count_characters([company_name])
+        common = np.zeros(len(lengths), dtype=np.uint16)
+        for group in np.flatnonzero(query_counts[:, 0]):
+            common += np.minimum(character_counts[group], query_counts[group, 0])
+        shorter = np.minimum(lengths, len(company_name))
+        return (200 * common / np.maximum(lengths + len(company_name), 1),
+                200 * common / np.maximum(shorter + common, 1), get_weighted_ratio_caps(lengths, len(company_name)))
+
+    def score_names(self, company_name, names, candidates, bounds, score_cutoff):
+        """Returns the candidate names that reach score_cutoff, and their weighted scores."""
+        from rapidfuzz import fuzz
+
+        target = get_target_score(score_cutoff)
+        partial_ratio_bounds, weighted_ratio_caps = bounds[1][candidates], bounds[2][candidates]
+        # The ratio needed below the cap of WRatio, or else above it, where WRatio can be as high as the ratio
+        needed_ratio = np.minimum((target - 0.2 * partial_ratio_bounds - 0.4 * weighted_ratio_caps) / 0.4,
+                                  (target - 0.2 * partial_ratio_bounds) / 0.8)
+        ratio = self.score_in_bands(company_name, names, candidates, fuzz.ratio, needed_ratio)
+        kept = np.flatnonzero(0.4 * ratio + 0.2 * partial_ratio_bounds + 0.4 * np.maximum(ratio, weighted_ratio_caps)
+                              >= target)
+        candidates, ratio, partial_ratio_bounds = candidates[kept], ratio[kept], partial_ratio_bounds[kept]
+        weighted_ratio = self.score_in_bands(company_name, names, candidates, fuzz.WRatio,
+                                             (target - 0.4 * ratio - 0.2 * partial_ratio_bounds) / 0.4)
+        kept = np.flatnonzero(0.4 * ratio + 0.2 * partial_ratio_bounds + 0.4 * weighted_ratio >= target)
+        candidates, ratio, weighted_ratio = candidates[kept], ratio[kept], weighted_ratio[kept]
+        partial_ratio = self.score_in_bands(company_name, names, candidates, fuzz.partial_ratio,
+                                            (target - 0.4 * ratio - 0.4 * weighted_ratio) / 0.2)
+        scores = np.round(0.4 * ratio + 0.2 * partial_ratio + 0.4 * weighted_ratio)
+        matches = np.flatnonzero(scores >= score_cutoff)
+        return candidates[matches], scores[matches]
+
+    def rank_rows(self, matched_names, name_scores):
+        """Returns the rows of the matched names, best score first, and their scores."""
+        name_rows, name_starts = self.columns[6:]
+        starts, counts = name_starts[matched_names], np.diff(name_starts)[matched_names]
+        rows = name_rows[np.arange(counts.sum()) + np.repeat(starts - np.cumsum(counts) + counts, counts)]
+        scores = np.repeat(name_scores, counts)
+        # A row found through both its name and its stripped variant keeps the best of the two scores
+        order = np.lexsort((rows, -scores))
+        rows, first = np.unique(rows[order], return_index=True)
+        scores = scores[order][first]
+        order = np.lexsort((rows, -scores))
+        return rows[order], scores[order]
+
+    def search(self, company_name, limit=10, score_cutoff=SIMILARITY_THRESHOLD):
+        company_name = to_lower(company_name)
+        ids, ibans, company_names, names, lengths, character_counts = self.columns[:6]
+        bounds = self.get_score_bounds(company_name, lengths, character_counts)
+        ratio_bounds, partial_ratio_bounds, weighted_ratio_caps = bounds
+        score_bounds = 0.4 * ratio_bounds + 0.2 * partial_ratio_bounds + \
+            0.4 * np.maximum(ratio_bounds, weighted_ratio_caps)
+        candidates = np.flatnonzero(score_bounds >= get_target_score(score_cutoff))
+        if len(candidates) > PRESCORED_NAMES:
+            # The names with the best bounds are scored first: the results must reach the limit-th best score of their
+            # rows, which leaves out most of the other names
+            prescored = candidates[np.argpartition(-score_bounds[candidates], PRESCORED_NAMES)[:PRESCORED_NAMES]]
+            _, scores = self.rank_rows(*self.score_names(company_name, names, prescored, bounds, score_cutoff))
+            if len(scores) >= limit:
+                score_cutoff = scores[limit - 1]
+                candidates = candidates[score_bounds[candidates] >= get_target_score(score_cutoff)]
+        rows, scores = self.rank_rows(*self.score_names(company_name, names, candidates, bounds, score_cutoff))
+        return [{"id": ids[row], "iban": ibans[row], "companyName": company_names[row], "score": int(score)}
+                for row, score in zip(rows[:limit], scores[:limit])]
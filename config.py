@@ -1,10 +1,90 @@
-import secrets
+import os
 
 
 class Config:
-    SECRET_KEY = secrets.token_hex(16)
+    # Sessions are signed with SECRET_KEY, which all the workers must share. Without the environment variable, a random
+    # key is generated once and kept in SECRET_KEY_PATH
+    SECRET_KEY = os.environ.get("SECRET_KEY")
+    SECRET_KEY_PATH = "secret_key"
     SESSION_COOKIE_SAMESITE = "Lax"
     # SESSION_COOKIE_SECURE=True,  # Send cookie only over HTTPS
+    # Set DATABASE_POOLING to False to open and close a connection on every request
+    DATABASE_POOLING = True
+    DATABASE_POOL_SIZE = 8
+    DATABASE_STATEMENT_CACHE_SIZE = 256
+    DATABASE_PRAGMAS = {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -16000, "mmap_size": 268435456}
+    # Serve IBAN lookups from an in-process copy of iban_holders, checked against the registry version every interval
+    HOLDER_INDEX_ENABLED = False
+    HOLDER_INDEX_REFRESH_INTERVAL = 1.0
+    # Under a pre-fork server, serve IBAN lookups from a memory-mapped snapshot file shared by all the workers instead
+    REGISTRY_SNAPSHOT_ENABLED = False
+    REGISTRY_SNAPSHOT_PATH = "registry_snapshot.bin"
+    # Maximum number of cached company-name similarity decisions (0 disables the cache)
+    SIMILARITY_CACHE_SIZE = 10000
+    # Skip the remaining fuzzy scorers once the weighted score can no longer cross the threshold
+    SIMILARITY_EARLY_EXIT = True
+    # Identical verifications are computed once while in flight, and their results are reused for VERIFICATION_CACHE_TTL
+    # seconds or until the next write to the registry (0 disables the cache, not the coalescing). A write clears the
+    # cache of the worker that made it only: the other workers may serve results older than the write for up to
+    # VERIFICATION_CACHE_TTL seconds, which is the staleness bound to keep in mind when raising it
+    VERIFICATION_CACHE_SIZE = 10000
+    VERIFICATION_CACHE_TTL = 5.0
+    # Worker threads used by rapidfuzz for the company search (-1 uses all cores)
+    COMPANY_SEARCH_WORKERS = -1
+    # The company search index is rebuilt in the background, and may miss the writes of other workers for this long
+    COMPANY_SEARCH_REFRESH_INTERVAL = 1.0
+    # Serve the app through asgi.py with uvicorn, handling the verification endpoints asynchronously
+    ASGI_SERVING = os.environ.get("ASGI_SERVING", "false").lower() == "true"
+    ASGI_EXECUTOR_WORKERS = 32
+    # Reject unknown IBANs without a database lookup using a Bloom filter over the registered IBANs. The filter is
+    # persisted to BLOOM_FILTER_PATH, and rebuilt every BLOOM_FILTER_REBUILD_INTERVAL seconds to drop removed IBANs.
+    # Under several workers, an IBAN added by another one is reported unknown for up to BLOOM_FILTER_REFRESH_INTERVAL
+    # seconds, so the filter is off unless that delay is acceptable
+    BLOOM_FILTER_ENABLED = False
+    BLOOM_FILTER_FALSE_POSITIVE_RATE = 0.01
+    BLOOM_FILTER_PATH = "iban_bloom_filter.bin"
+    BLOOM_FILTER_REFRESH_INTERVAL = 1.0
+    BLOOM_FILTER_REBUILD_INTERVAL = 3600.0
+    # Entries of the change feed older than this are pruned at startup; mirrors that fall further behind must resync
+    CHANGE_FEED_RETENTION_DAYS = 30
+    # Compress responses larger than COMPRESSION_MIN_SIZE bytes with gzip, or brotli/zstd when they are installed
+    COMPRESSION_ENABLED = True
+    COMPRESSION_MIN_SIZE = 1024
+    COMPRESSION_LEVEL = 6
+    # Every verification outcome is queued and written in batches by a background thread to a separate database.
+    # Entries are dropped, and counted on /metrics, when the queue is full
+    AUDIT_LOG_ENABLED = True
+    AUDIT_LOG_DATABASE = "AuditLog.db"
+    AUDIT_LOG_QUEUE_SIZE = 10000
+    AUDIT_LOG_BATCH_SIZE = 500
+    AUDIT_LOG_FLUSH_INTERVAL = 0.5
+    # Administrator passwords are checked by LOGIN_WORKERS processes, so that a burst of logins never holds up the
+    # verifications. A login is refused with 429 when LOGIN_MAX_PENDING checks are in progress, when another one for the
+    # same username or address is, or after LOGIN_MAX_FAILURES failures within LOGIN_FAILURE_WINDOW seconds.
+    # Passwords hashed with a work factor other than BCRYPT_LOG_ROUNDS are rehashed at the next successful login
+    BCRYPT_LOG_ROUNDS = 12
+    LOGIN_WORKERS = 2
+    LOGIN_MAX_PENDING = 8
+    LOGIN_TIMEOUT = 5.0
+    LOGIN_MAX_FAILURES = 5
+    LOGIN_FAILURE_WINDOW = 300.0
+    # Compile the patterns, fill the connection pools and start the lookup structures when the app is created, before
+    # it serves any request, rather than on the first requests
+    WARM_UP_ENABLED = True
+    # Requests are profiled with cProfile when sampled, with probability PROFILE_SAMPLE_RATE, or when they carry the
+    # X-Profile-Token header issued to an administrator by /api/v1/profiles/token, valid for PROFILE_TOKEN_TTL seconds.
+    # The latest PROFILE_RING_SIZE profiles are kept in PROFILES_DIRECTORY, with the inputs of the PROFILE_SLOWEST_SIZE
+    # slowest requests of each endpoint
+    PROFILING_ENABLED = True
+    PROFILES_DIRECTORY = "profiles"
+    PROFILE_SAMPLE_RATE = 0.0
+    PROFILE_RING_SIZE = 100
+    PROFILE_SLOWEST_SIZE = 10
+    PROFILE_TOKEN_TTL = 900
+    PROFILE_EXCLUDED_ENDPOINTS = ["login", "static"]
+    # Latency histograms and counters exposed in Prometheus text format at /metrics
+    METRICS_ENABLED = True
+    METRICS_ALLOWED_ADDRESSES = ["127.0.0.1", "::1"]
     CORS_RESOURCES = {
         r"/api/v1/iban-verification": {
             "origins": [r"moz-extension://*"],
@@ -16,4 +96,19 @@ class Config:
             "methods": ["POST"],
             "allow_headers": ["Content-Type"]
         },
+        r"/api/v1/iban-validation": {
+            "origins": [r"moz-extension://*"],
+            "methods": ["POST"],
+            "allow_headers": ["Content-Type"]
+        },
+        r"/api/v1/iban-verification/batch": {
+            "origins": [r"moz-extension://*"],
+            "methods": ["POST"],
+            "allow_headers": ["Content-Type"]
+        },
+        r"/api/v1/sender-iban-verification/batch": {
+            "origins": [r"moz-extension://*"],
+            "methods": ["POST"],
+            "allow_headers": ["Content-Type"]
+        },
     }
@@ -1,13 +1,37 @@
 API_PREFIX = "/api/v1"
 
+MAX_BATCH_ITEMS = 500
+
+MAX_COMPANY_SEARCH_RESULTS = 100
+
+MAX_HOLDER_SEARCH_RESULTS = 50
+
+MAX_HOLDER_SEARCH_OFFSET = 1000
+
+MAX_HOLDER_SEARCH_QUERY_LENGTH = 90
+
+MAX_VALIDATION_ITEMS = 10000
+
+MAX_BULK_OPERATIONS = 10000
+
+MAX_AUDIT_PAGE_SIZE = 1000
+
+MAX_IBANS_PAGE_SIZE = 5000
+
+IBANS_STREAM_CHUNK_SIZE = 1000
+
+PROFILE_TOKEN_HEADER = "X-Profile-Token"
+
 CONTENT_SECURITY_POLICY = "default-src 'self'; style-src 'self' 'unsafe-inline' https://fonts.googleapis.com; " \
                           "script-src 'self' 'sha256-QJamAcIceIM9NR8F7WkzTuJx2U9cAgS1aqV/jjjfk8Q=' " \
                           "'sha256-1NO0GGtrRFTLlCsqy+i+Ff+7Y5QQYIuf9erhVGUmUlk='; font-src https://fonts.gstatic.com; " \
-                          "object-src 'none'; frame-src 'none'; base-uri 'none'; "
+                          "object-src 'none'; frame-src 'none'; base-uri 'none';"
 # "img-src 'self' data:; connect-src 'self'; base-uri 'self'; form-action 'self'; frame-ancestors 'none';"
 
 IBAN_PATTERN = r"IT[0-9]{2}[A-Z]{1}[0-9]{10}[A-Z0-9]{12}"
 
+IBAN_LENGTH = 27
+
 COMPANY_NAME_PATTERN = r"[\p{L} \d'’\-&.,]{1,80}"
 
 FIRST_NAME_PATTERN = r"[\p{L} '’\-]{1,40}"
@@ -20,6 +44,8 @@ UUID_V4_PATTERN = r"[a-f0-9]{8}-[a-f0-9]{4}-4[a-f0-9]{3}-[89ab][a-f0-9]{3}-[a-f0
 
 LEGAL_FORMS_PATTERN = r"\b(ss|snc|sas|spa|srls|srl|sapa)\b"
 
+COMPANY_PARTNERS_PATTERN = r"\bdi\b[\p{L} '’\-]+(&\sc.)?$"
+
 LEGAL_FORMS = [
     r"\bs\.?s\.?\b", r"\bs\.?n\.?c\.?\b", r"\bs\.?a\.?s\.?\b", r"\bs\.?p\.?a\.?\b", r"\bs\.?r\.?l\.?s\.?\b",
     r"\bs\.?r\.?l\.?\b", r"\bs\.?a\.?p\.?a\.?\b"
@@ -1,5 +1,225 @@
+import hashlib
+import heapq
+import os
+import queue
+import sqlite3
+import zlib
+from contextlib import contextmanager
+from itertools import chain
+
+from utils import to_holder_record, normalize_company_name
+
 DATABASE = "BankDatabase.db"
 
+HOLDER_COLUMNS = "id, iban, first_name, last_name, company_name, company_name_folded, company_name_stripped, legal_form"
+
+NORMALIZED_COMPANY_COLUMNS = {
+    "company_name_folded": "VARCHAR(80)",
+    "company_name_stripped": "VARCHAR(80)",
+    "legal_form": "VARCHAR(4)",
+}
+
+MAX_QUERY_PARAMETERS = 500
+
+# Stored in PRAGMA user_version once migrate_database() has run, to be bumped whenever it changes
+SCHEMA_VERSION = 1
+
+database_settings = {
+    "pooling": True,
+    "pool_size": 8,
+    "statement_cache_size": 256,
+    "pragmas": {"journal_mode": "WAL", "synchronous": "NORMAL", "cache_size": -16000, "mmap_size": 268435456},
+    "shards": 1,
+}
+connection_pools = [queue.LifoQueue()]
+connection_stats = {"opened": 0, "reused": 0, "closed": 0}
+inherited_connections = []
+
+
+class ShardConnection(sqlite3.Connection):
+    """SQLite connection that remembers its shard, so that it goes back to the pool of that shard."""
+    shard = 0
+
+
+def configure_database(config):
+    database_settings["pooling"] = config.get("DATABASE_POOLING", database_settings["pooling"])
+    database_settings["pool_size"] = config.get("DATABASE_POOL_SIZE", database_settings["pool_size"])
+    database_settings["statement_cache_size"] = config.get("DATABASE_STATEMENT_CACHE_SIZE",
+                                                           database_settings["statement_cache_size"])
+    database_settings["pragmas"] = config.get("DATABASE_PRAGMAS", database_settings["pragmas"])
+    close_pooled_connections()
+    database_settings["shards"] = load_shard_layout()
+    connection_pools[:] = [queue.LifoQueue() for _ in range(database_settings["shards"])]
+
+
+def get_shard_path(shard):
+    """Shard 0 is DATABASE itself, which also holds the administrators, so a single shard is the unsharded layout."""
+    if shard == 0:
+        return DATABASE
+    root, extension = os.path.splitext(DATABASE)
+    return f"{root}.shard{shard}{extension}"
+
+
+def get_shard_count():
+    return database_settings["shards"]
+
+
+def load_shard_layout():
+    """Returns the number of shards recorded in DATABASE by initialize_database.py or reshard.py."""
+    if not os.path.exists(DATABASE):
+        return 1
+    connection = sqlite3.connect(DATABASE)
+    try:
+        row = connection.execute("SELECT shards FROM shard_layout WHERE id = 1").fetchone()
+        return row[0] if row else 1
+    except sqlite3.OperationalError:
+        # Databases created before sharding have no layout table
+        return 1
+    finally:
+        connection.close()
+
+
+def save_shard_layout(connection, shards):
+    connection.execute("CREATE TABLE IF NOT EXISTS shard_layout (id INTEGER PRIMARY KEY CHECK (id = 1), "
+                       "shards INTEGER NOT NULL)")
+    connection.execute("INSERT OR REPLACE INTO shard_layout (id, shards) VALUES (1, ?)", (shards,))
+
+
+def get_bank_code(iban):
+    """ABI code of an Italian IBAN, after the country code, the check digits and the CIN."""
+    return iban[5:10]
+
+
+def get_iban_shard(iban, shards=None):
+    """Maps an IBAN to its shard by a hash of its ABI code, so that all the accounts of a bank share a shard."""
+    shards = shards or database_settings["shards"]
+    if shards == 1:
+        return 0
+    return zlib.crc32(get_bank_code(iban).encode()) % shards
+
+
+def open_connection(shard=0):
+    connection_stats["opened"] += 1
+    connection = sqlite3.connect(get_shard_path(shard), factory=ShardConnection,
+                                 cached_statements=database_settings["statement_cache_size"], check_same_thread=False)
+    connection.shard = shard
+    for pragma, value in database_settings["pragmas"].items():
+        connection.execute(f"PRAGMA {pragma} = {value}")
+    return connection
+
+
+def get_connection(shard=0):
+    if not database_settings["pooling"]:
+        connection_stats["opened"] += 1
+        connection = sqlite3.connect(get_shard_path(shard), factory=ShardConnection)
+        connection.shard = shard
+        return connection
+    try:
+        connection = connection_pools[shard].get_nowait()
+        connection_stats["reused"] += 1
+        return connection
+    except queue.Empty:
+        return open_connection(shard)
+
+
+def release_connection(connection):
+    if not connection:
+        return
+    if not database_settings["pooling"]:
+        connection_stats["closed"] += 1
+        connection.close()
+        return
+    connection.row_factory = None
+    if connection.in_transaction:
+        connection.rollback()
+    shard = getattr(connection, "shard", 0)
+    if shard >= len(connection_pools) or connection_pools[shard].qsize() >= database_settings["pool_size"]:
+        connection_stats["closed"] += 1
+        connection.close()
+        return
+    connection_pools[shard].put_nowait(connection)
+
+
+def close_pooled_connections():
+    for connection_pool in connection_pools:
+        while True:
+            try:
+                connection_pool.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def discard_inherited_connections():
+    """Starts a forked process, e.g. a worker of a pre-fork server, with empty pools. The inherited connections are kept
+    open rather than closed, as closing them could checkpoint or remove the write-ahead log the parent is using."""
+    for connection_pool in connection_pools:
+        while True:
+            try:
+                inherited_connections.append(connection_pool.get_nowait())
+            except queue.Empty:
+                break
+
+
+os.register_at_fork(after_in_child=discard_inherited_connections)
+
+
+def warm_connection_pool():
+    """Fills the pool of every shard with connections that have the IBAN lookup prepared, so that the first requests
+    neither open a connection nor compile a statement."""
+    if not database_settings["pooling"]:
+        return
+    connections = []
+    try:
+        for shard in range(database_settings["shards"]):
+            for _ in range(database_settings["pool_size"]):
+                connections.append(get_connection(shard))
+                selection_query_db(connections[-1], f"SELECT {HOLDER_COLUMNS} FROM iban_holders WHERE iban = ?",
+                                   ("",), one=True)
+    finally:
+        for connection in connections:
+            release_connection(connection)
+
+
+@contextmanager
+def shard_connection(connection, shard):
+    """Yields a connection to the shard: the given one if it is already on it, a pooled one otherwise."""
+    if getattr(connection, "shard", 0) == shard:
+        yield connection
+        return
+    other_connection = None
+    try:
+        other_connection = get_connection(shard)
+        yield other_connection
+    finally:
+        release_connection(other_connection)
+
+
+def query_shards(connection, function):
+    """Calls function with a connection to every shard and returns its results in shard order."""
+    results = []
+    for shard in range(database_settings["shards"]):
+        with shard_connection(connection, shard) as current_connection:
+            results.append(function(current_connection))
+    return results
+
+
+def select_from_shards(connection, query, params=(), key=None):
+    """Runs a query on every shard and yields the rows of all of them.
+
+    Rows are merged by key when the query sorts by it, and are otherwise yielded one shard after the other. The other
+    shards' connections are held until the rows are exhausted or the generator is closed.
+    """
+    connections = []
+    try:
+        for shard in range(database_settings["shards"]):
+            connections.append(connection if getattr(connection, "shard", 0) == shard else get_connection(shard))
+        cursors = [current_connection.execute(query, params) for current_connection in connections]
+        yield from heapq.merge(*cursors, key=key) if key else chain(*cursors)
+    finally:
+        for current_connection in connections:
+            if current_connection is not connection:
+                release_connection(current_connection)
+
 
 def selection_query_db(connection, query, params=(), one=False):
     cursor = connection.cursor()
@@ -12,3 +232,198 @@ def action_query_db(connection, query, params):
     cursor = connection.cursor()
     cursor.execute(query, params)
     connection.commit()
+    return cursor.rowcount
+
+
+def select_iban_holder(connection, iban):
+    with shard_connection(connection, get_iban_shard(iban)) as current_connection:
+        row = selection_query_db(current_connection, f"SELECT {HOLDER_COLUMNS} FROM iban_holders WHERE iban = ?",
+                                 (iban,), one=True)
+    return to_holder_record(row)
+
+
+def select_iban_holders(connection, ibans):
+    ibans_by_shard = {}
+    for iban in ibans:
+        ibans_by_shard.setdefault(get_iban_shard(iban), []).append(iban)
+    records = {}
+    for shard, shard_ibans in ibans_by_shard.items():
+        with shard_connection(connection, shard) as current_connection:
+            for start in range(0, len(shard_ibans), MAX_QUERY_PARAMETERS):
+                chunk = shard_ibans[start:start + MAX_QUERY_PARAMETERS]
+                placeholders = ", ".join("?" * len(chunk))
+                query = f"SELECT {HOLDER_COLUMNS} FROM iban_holders WHERE iban IN ({placeholders})"
+                for row in selection_query_db(current_connection, query, chunk):
+                    records[row[1]] = to_holder_record(row)
+    return records
+
+
+def select_holder_by_id(connection, holder_id):
+    """Returns the shard and the row of a holder. IDs carry no bank code, so the shards are probed in turn."""
+    for shard in range(database_settings["shards"]):
+        with shard_connection(connection, shard) as current_connection:
+            row = selection_query_db(current_connection, "SELECT * FROM iban_holders WHERE id = ?", (holder_id,),
+                                     one=True)
+        if row:
+            return shard, row
+    return None, None
+
+
+def copy_holder(source_connection, target_connection, holder_id):
+    """Inserts the row of a holder into another shard, within the open transactions of both connections."""
+    cursor = source_connection.execute("SELECT * FROM iban_holders WHERE id = ?", (holder_id,))
+    row = cursor.fetchone()
+    columns = [column[0] for column in cursor.description]
+    target_connection.execute(f"INSERT INTO iban_holders ({', '.join(columns)}) "
+                              f"VALUES ({', '.join('?' * len(columns))})", row)
+
+
+def move_holder(connection, holder_id, shard):
+    """Moves a holder whose IBAN has been changed to one of a bank on another shard, and returns the changed rows.
+
+    A transaction cannot span two database files, so the copy is committed first: a failure in between leaves the
+    holder on both shards rather than on neither.
+    """
+    with shard_connection(connection, shard) as target_connection:
+        copy_holder(connection, target_connection, holder_id)
+        target_connection.commit()
+    return 1 + action_query_db(connection, "DELETE FROM iban_holders WHERE id = ?", (holder_id,))
+
+
+def migrate_database(connection):
+    """Brings the schema of a shard up to date. A shard already at SCHEMA_VERSION is left alone without scanning its
+    holders, so that starting a worker does not pay for the migration every time."""
+    cursor = connection.cursor()
+    if cursor.execute("PRAGMA user_version").fetchone()[0] >= SCHEMA_VERSION:
+        return
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'iban_holders'")
+    if not cursor.fetchone():
+        return
+    cursor.execute("PRAGMA table_info(iban_holders)")
+    existing_columns = {column[1] for column in cursor.fetchall()}
+    for column, column_type in NORMALIZED_COMPANY_COLUMNS.items():
+        if column not in existing_columns:
+            cursor.execute(f"ALTER TABLE iban_holders ADD COLUMN {column} {column_type}")
+    cursor.execute("SELECT id, company_name FROM iban_holders WHERE company_name IS NOT NULL AND company_name_folded IS NULL")
+    cursor.executemany(
+        "UPDATE iban_holders SET company_name_folded = ?, company_name_stripped = ?, legal_form = ? WHERE id = ?",
+        [(*normalize_company_name(company_name), holder_id) for holder_id, company_name in cursor.fetchall()])
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS registry_version (id INTEGER PRIMARY KEY CHECK (id = 1), version INTEGER NOT NULL, "
+        "updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    cursor.execute("INSERT OR IGNORE INTO registry_version (id, version) VALUES (1, 0)")
+    for operation in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS iban_holders_{operation.lower()}_version AFTER {operation} ON iban_holders "
+            f"BEGIN UPDATE registry_version SET version = version + 1, updated_at = CURRENT_TIMESTAMP WHERE id = 1; END")
+    migrate_change_log(cursor)
+    migrate_search_index(cursor)
+    cursor.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+    connection.commit()
+
+
+def migrate_change_log(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'iban_changes'")
+    created = not cursor.fetchone()
+    cursor.execute(
+        "CREATE TABLE IF NOT EXISTS iban_changes (seq INTEGER PRIMARY KEY AUTOINCREMENT, holder_id CHAR(36) NOT NULL, "
+        "iban CHAR(27) NOT NULL, operation VARCHAR(6) NOT NULL, changed_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP)")
+    if created:
+        # Existing holders are logged as inserts, so that a mirror can start from the beginning of the feed
+        cursor.execute("INSERT INTO iban_changes (holder_id, iban, operation) "
+                       "SELECT id, iban, 'insert' FROM iban_holders ORDER BY created_at, rowid")
+    for operation, row in (("INSERT", "NEW"), ("UPDATE", "NEW"), ("DELETE", "OLD")):
+        cursor.execute(
+            f"CREATE TRIGGER IF NOT EXISTS iban_holders_{operation.lower()}_change_log AFTER {operation} "
+            f"ON iban_holders BEGIN INSERT INTO iban_changes (holder_id, iban, operation) "
+            f"VALUES ({row}.id, {row}.iban, '{operation.lower()}'); END")
+
+
+def migrate_search_index(cursor):
+    """Creates the trigram index over the holder names used by the admin search, if SQLite has FTS5.
+
+    The index refers to the holders by the implicit rowid of iban_holders, which VACUUM may renumber, so a shard must be
+    vacuumed with vacuum_shard, which rebuilds the index afterwards.
+    """
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'iban_holders_search'")
+    if cursor.fetchone():
+        return
+    try:
+        cursor.execute("CREATE VIRTUAL TABLE iban_holders_search USING fts5(first_name, last_name, company_name, "
+                       "content = 'iban_holders', tokenize = 'trigram')")
+    except sqlite3.OperationalError:
+        # Without FTS5, or before SQLite 3.34, the search falls back to scanning the table
+        return
+    cursor.execute("INSERT INTO iban_holders_search (iban_holders_search) VALUES ('rebuild')")
+    old_values = "'delete', old.rowid, old.first_name, old.last_name, old.company_name"
+    new_values = "new.rowid, new.first_name, new.last_name, new.company_name"
+    for operation, statements in (
+            ("INSERT", f"INSERT INTO iban_holders_search (rowid, first_name, last_name, company_name) "
+                       f"VALUES ({new_values});"),
+            ("DELETE", f"INSERT INTO iban_holders_search (iban_holders_search, rowid, first_name, last_name, "
+                       f"company_name) VALUES ({old_values});"),
+            ("UPDATE OF first_name, last_name, company_name",
+             f"INSERT INTO iban_holders_search (iban_holders_search, rowid, first_name, last_name, company_name) "
+             f"VALUES ({old_values}); INSERT INTO iban_holders_search (rowid, first_name, last_name, company_name) "
+             f"VALUES ({new_values});")):
+        cursor.execute(f"CREATE TRIGGER IF NOT EXISTS iban_holders_{operation.split()[0].lower()}_search "
+                       f"AFTER {operation} ON iban_holders BEGIN {statements} END")
+
+
+def rebuild_search_index(cursor):
+    cursor.execute("SELECT name FROM sqlite_master WHERE type = 'table' AND name = 'iban_holders_search'")
+    if cursor.fetchone():
+        cursor.execute("INSERT INTO iban_holders_search (iban_holders_search) VALUES ('rebuild')")
+
+
+def vacuum_shard(connection):
+    """Vacuums a shard and rebuilds its search index, whose rowids may no longer match those of iban_holders."""
+    connection.execute("VACUUM")
+    rebuild_search_index(connection.cursor())
+    connection.commit()
+
+
+def prune_change_log(connection, retention_days):
+    cursor = connection.cursor()
+    # Changes are logged in time order, so when the oldest one is retained the table is not scanned
+    cursor.execute("SELECT changed_at >= datetime('now', ?) FROM iban_changes ORDER BY seq LIMIT 1",
+                   (f"-{retention_days} days",))
+    oldest = cursor.fetchone()
+    if oldest is None or oldest[0]:
+        return 0
+    cursor.execute("DELETE FROM iban_changes WHERE changed_at < datetime('now', ?)", (f"-{retention_days} days",))
+    connection.commit()
+    return cursor.rowcount
+
+
+def get_change_log_bounds(connection):
+    """Returns the sequence number of the oldest retained change and of the latest change ever logged on the shard."""
+    oldest = selection_query_db(connection, "SELECT MIN(seq) FROM iban_changes", one=True)[0]
+    latest = selection_query_db(connection, "SELECT seq FROM sqlite_sequence WHERE name = 'iban_changes'", one=True)
+    latest = latest[0] if latest else 0
+    return oldest or latest + 1, latest
+
+
+def select_registry_state(connection):
+    result = selection_query_db(connection, "SELECT version, updated_at FROM registry_version WHERE id = 1", one=True)
+    return result if result else (0, None)
+
+
+def get_registry_version(connection):
+    # Every changed row bumps the version of its shard, so the sum over the shards grows by one per changed row
+    return sum(version for version, _ in query_shards(connection, select_registry_state))
+
+
+def get_registry_state(connection):
+    states = query_shards(connection, select_registry_state)
+    return sum(version for version, _ in states), max((updated_at for _, updated_at in states if updated_at),
+                                                      default=None)
+
+
+def get_registry_fingerprint(connection):
+    # The version alone is not enough to tell apart a re-initialized database that went through as many writes
+    results = query_shards(connection, lambda current_connection: selection_query_db(
+        current_connection, "SELECT (SELECT updated_at FROM registry_version WHERE id = 1), "
+                            "(SELECT COUNT(*) FROM iban_holders)", one=True))
+    fingerprint = ";".join(f"{updated_at}|{count}" for updated_at, count in results)
+    return hashlib.blake2b(fingerprint.encode(), digest_size=16).digest()
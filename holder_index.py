@@ -0,0 +1,84 @@
+import os
+import threading
+import time
+
+from db_utils import HOLDER_COLUMNS, get_connection, release_connection, select_from_shards, select_iban_holders, \
+    get_registry_version
+from utils import to_holder_record
+
+
+class HolderIndex:
+    """In-process copy of iban_holders keyed by IBAN.
+
+    Reads are plain dictionary lookups. Writes made by this process are applied in place, while writes made by other
+    processes are detected through the registry version and trigger a full reload.
+    """
+
+    def __init__(self, refresh_interval=1.0):
+        self.records = {}
+        self.version = None
+        self.refresh_interval = refresh_interval
+        self.lock = threading.RLock()
+        self.refresher_pid = None
+        self.reloads = 0
+
+    @property
+    def size(self):
+        return len(self.records)
+
+    def load(self, connection):
+        with self.lock:
+            version = get_registry_version(connection)
+            rows = select_from_shards(connection, f"SELECT {HOLDER_COLUMNS} FROM iban_holders")
+            self.records = {row[1]: to_holder_record(row) for row in rows}
+            self.version = version
+            self.reloads += 1
+
+    def get(self, iban):
+        self.start_refresher()
+        return self.records.get(iban)
+
+    def get_many(self, ibans):
+        self.start_refresher()
+        records = self.records
+        return {iban: records[iban] for iban in ibans if iban in records}
+
+    def apply_changes(self, connection, changes, removed_ibans=(), updated_ibans=()):
+        with self.lock:
+            version = get_registry_version(connection)
+            if self.version is None or version != self.version + changes:
+                self.load(connection)
+                return
+            updated_records = select_iban_holders(connection, updated_ibans)
+            # An IBAN can be both removed and added back, or added and removed again, by the same bulk operation
+            for iban in {*removed_ibans, *updated_ibans}.difference(updated_records):
+                self.records.pop(iban, None)
+            self.records.update(updated_records)
+            self.version = version
+
+    def refresh_if_stale(self):
+        connection = None
+        try:
+            connection = get_connection()
+            if get_registry_version(connection) != self.version:
+                self.load(connection)
+        finally:
+            release_connection(connection)
+
+    def start_refresher(self):
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            threading.Thread(target=self.refresh_periodically, daemon=True).start()
+
+    def refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                # The next iteration retries, e.g. while the database is locked by a long write
+                continue
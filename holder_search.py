@@ -0,0 +1,70 @@
+import re
+from itertools import islice
+
+from db_utils import select_from_shards, selection_query_db
+from utils import remove_spaces
+
+# A country code and check digits, followed by the start of the BBAN
+IBAN_PREFIX_REGEX = re.compile(r"[A-Z]{2}[0-9]([0-9][A-Z0-9]{0,30})?")
+# The trigram index cannot match shorter terms
+MIN_SEARCH_TERM_LENGTH = 3
+SEARCH_COLUMNS = "h.id, h.iban, h.first_name, h.last_name, h.company_name"
+# Shorter names are closer to the searched words
+NAME_LENGTH = "LENGTH(COALESCE(h.company_name, h.first_name || ' ' || h.last_name))"
+
+
+def parse_search_query(query):
+    """Returns the IBAN prefix the query stands for, or else the terms long enough to be searched in the names."""
+    compact_query = remove_spaces(query).upper()
+    if IBAN_PREFIX_REGEX.fullmatch(compact_query):
+        return compact_query, []
+    return None, [term for term in query.split() if len(term) >= MIN_SEARCH_TERM_LENGTH]
+
+
+def escape_like(term):
+    return term.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+
+
+def has_search_index(connection):
+    return bool(selection_query_db(connection, "SELECT 1 FROM sqlite_master WHERE type = 'table' "
+                                               "AND name = 'iban_holders_search'", one=True))
+
+
+def build_names_query(connection, terms):
+    """Returns the query matching every term in the names, with holders whose name starts with the first term first.
+
+    BM25 ranking is left out: on names it mostly favours the shorter ones, which the length does for much less work,
+    and it would not be comparable across shards.
+    """
+    starts_with = " OR ".join(f"COALESCE(h.{column}, '') LIKE ? ESCAPE '\\'"
+                              for column in ("first_name", "last_name", "company_name"))
+    params = [escape_like(terms[0]) + "%"] * 3
+    if has_search_index(connection):
+        match = " ".join('"' + term.replace('"', '""') + '"' for term in terms)
+        return (f"SELECT {SEARCH_COLUMNS}, NOT ({starts_with}) AS weak, {NAME_LENGTH} AS name_length "
+                f"FROM iban_holders_search s JOIN iban_holders h ON h.rowid = s.rowid "
+                f"WHERE iban_holders_search MATCH ? ORDER BY weak, name_length, h.iban LIMIT ?", params + [match])
+    contains = " AND ".join("(COALESCE(h.first_name, '') || ' ' || COALESCE(h.last_name, '') || ' ' || "
+                            "COALESCE(h.company_name, '')) LIKE ? ESCAPE '\\'" for _ in terms)
+    return (f"SELECT {SEARCH_COLUMNS}, NOT ({starts_with}) AS weak, {NAME_LENGTH} AS name_length "
+            f"FROM iban_holders h WHERE {contains} ORDER BY weak, name_length, h.iban LIMIT ?", params + [f"%{escape_like(term)}%" for term in terms])
+
+
+def search_holders(connection, query, limit, offset=0):
+    """Returns a page of the holders matching the query, best matches first, and whether there are more.
+
+    Every shard returns its own best offset + limit + 1 matches, which are merged by the same ordering.
+    """
+    iban_prefix, terms = parse_search_query(query)
+    if iban_prefix:
+        # Served by the unique index on iban, as the prefix is made of letters and digits only
+        rows = select_from_shards(connection, f"SELECT {SEARCH_COLUMNS} FROM iban_holders h WHERE h.iban GLOB ? "
+                                              f"ORDER BY h.iban LIMIT ?", (iban_prefix + "*", offset + limit + 1),
+                                  key=lambda row: row[1])
+    else:
+        search_query, params = build_names_query(connection, terms)
+        rows = select_from_shards(connection, search_query, params + [offset + limit + 1],
+                                  key=lambda row: (row[5], row[6], row[1]))
+    page = list(islice(rows, offset, offset + limit + 1))
+    rows.close()
+    return [row[:5] for row in page[:limit]], len(page) > limit
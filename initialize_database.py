@@ -1,17 +1,19 @@
+import argparse
+import os
 import sqlite3
 import random
 from datetime import datetime, timezone
 from uuid import uuid4
 
-from flask_bcrypt import Bcrypt
-
 from rich.console import Console
 from rich.panel import Panel
 from rich.prompt import Prompt
 
-from db_utils import DATABASE
+from config import Config
+from db_utils import DATABASE, migrate_database, get_shard_path, get_iban_shard, load_shard_layout, save_shard_layout
+from password_hashing import hash_password
+from utils import normalize_company_name
 
-bcrypt = Bcrypt()
 console = Console()
 
 
@@ -38,16 +40,19 @@ def generate_random_timestamp():
     return timestamp.strftime("%Y-%m-%d %H:%M:%S")
 
 
-def create_tables(cursor):
+def create_tables(cursor, shard=0):
     cursor.execute(
         "CREATE TABLE IF NOT EXISTS iban_holders (id CHAR(36) PRIMARY KEY, iban CHAR(27) UNIQUE NOT NULL, first_name VARCHAR(40), last_name "
-        "VARCHAR(50), company_name VARCHAR(80), created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP)")
-    cursor.execute(
-        "CREATE TABLE IF NOT EXISTS administrators (id CHAR(36) PRIMARY KEY, username VARCHAR(50) UNIQUE NOT NULL, "
-        "password CHAR(60) NOT NULL)")
+        "VARCHAR(50), company_name VARCHAR(80), created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP, updated_at TIMESTAMP, "
+        "company_name_folded VARCHAR(80), company_name_stripped VARCHAR(80), legal_form VARCHAR(4))")
+    if shard == 0:
+        cursor.execute(
+            "CREATE TABLE IF NOT EXISTS administrators (id CHAR(36) PRIMARY KEY, username VARCHAR(50) UNIQUE NOT NULL, "
+            "password CHAR(60) NOT NULL)")
+    migrate_database(cursor.connection)
 
 
-def populate_iban_holders_table(cursor):
+def populate_iban_holders_table(cursors):
     iban_holders = [
         {"iban": "IT18Y0306905020051014470177", "name": "Luca", "surname": "Moretti"},
         {"iban": "IT83F0760116300001014243537", "name": "Francesca", "surname": "Russo"},
@@ -69,47 +74,65 @@ def populate_iban_holders_table(cursor):
         # {"iban": "IT35A0760111900000011662327", "name": "Serena", "surname": "Martini"},
     ]
     for record in iban_holders:
+        cursor = cursors[get_iban_shard(record["iban"], len(cursors))]
         creation_timestamp = generate_random_timestamp()
         if "name" in record:
             cursor.execute(
                 f"INSERT INTO iban_holders (id, iban, first_name, last_name, created_at) VALUES (?, ?, ?, ?, ?)",
                 (str(uuid4()), record["iban"], record["name"], record["surname"], creation_timestamp))
         else:
-            cursor.execute(f"INSERT INTO iban_holders (id, iban, company_name, created_at) VALUES (?, ?, ?, ?)",
-                           (str(uuid4()), record["iban"], record["company"], creation_timestamp))
+            cursor.execute(
+                f"INSERT INTO iban_holders (id, iban, company_name, company_name_folded, company_name_stripped, legal_form, "
+                f"created_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (str(uuid4()), record["iban"], record["company"], *normalize_company_name(record["company"]),
+                 creation_timestamp))
 
 
-def initialize_database():
-    connection = None
+def initialize_database(shards=1):
+    if os.path.exists(DATABASE) and load_shard_layout() != shards:
+        console.print(f"[bold red]{DATABASE} is split into {load_shard_layout()} shards:[/bold red] "
+                      f"use reshard.py to change their number")
+        return
+    connections = []
     try:
-        connection = sqlite3.connect(DATABASE)
-        cursor = connection.cursor()
-        create_tables(cursor)
-        cursor.execute("SELECT COUNT(*) as total FROM iban_holders")
-        records_count = cursor.fetchone()[0]
+        for shard in range(shards):
+            connections.append(sqlite3.connect(get_shard_path(shard)))
+            create_tables(connections[shard].cursor(), shard)
+        save_shard_layout(connections[0], shards)
+        connections[0].commit()
+        cursors = [connection.cursor() for connection in connections]
+        records_count = sum(cursor.execute("SELECT COUNT(*) as total FROM iban_holders").fetchone()[0]
+                            for cursor in cursors)
         if records_count < 1:
-            populate_iban_holders_table(cursor)
+            populate_iban_holders_table(cursors)
             # "Paolo_Caruso_3cX6"
             admin_username = Prompt.ask("[bold yellow]Choose a username for the administrator[/bold yellow]")
             print()
             # "DyA7K2u1CZj9"
             admin_password = Prompt.ask("[bold yellow]Choose a strong password for the administrator[/bold yellow]")
-            hashed_password = bcrypt.generate_password_hash(admin_password).decode("utf-8")
-            cursor.execute("INSERT INTO administrators (id, username, password) VALUES (?, ?, ?)",
-                           (str(uuid4()), admin_username, hashed_password))
-            connection.commit()
+            hashed_password = hash_password(admin_password, Config.BCRYPT_LOG_ROUNDS)
+            cursors[0].execute("INSERT INTO administrators (id, username, password) VALUES (?, ?, ?)",
+                               (str(uuid4()), admin_username, hashed_password))
+            for connection in connections:
+                connection.commit()
             print()
             console.print(Panel.fit(
                 f"[bold cyan]Username:[/bold cyan] {admin_username}\n[bold cyan]Password:[/bold cyan] {admin_password}",
                 title="[bold magenta]Admin Credentials[/bold magenta]", padding=(1, 1)))
     except sqlite3.Error as e:
         console.print(f"[bold red]Database initialization failed:[/bold red] {e}")
-        if connection:
+        for connection in connections:
             connection.rollback()
     finally:
-        if connection:
+        for connection in connections:
             connection.close()
 
 
 if __name__ == "__main__":
-    initialize_database()
+    parser = argparse.ArgumentParser(description=f"Create {DATABASE} with sample holders and an administrator")
+    parser.add_argument("--shards", type=int, default=1,
+                        help="Database files the holders are split into by bank code (default: 1)")
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("--shards must be at least 1")
+    initialize_database(args.shards)
@@ -0,0 +1,128 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import nullcontext
+
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+OUTCOMES = {"IBAN matches": "match", "IBAN does not match": "no_match"}
+
+metrics_settings = {"enabled": True}
+
+# Histograms are sharded by thread: a shard is only written by the thread that owns it, so recording never takes a lock
+shards = {}
+collectors = []
+request_context = threading.local()
+
+
+def configure_metrics(config):
+    metrics_settings["enabled"] = config.get("METRICS_ENABLED", metrics_settings["enabled"])
+
+
+def get_shard():
+    shard = shards.get(threading.get_ident())
+    if shard is None:
+        shard = shards.setdefault(threading.get_ident(), {})
+    return shard
+
+
+def observe(metric, labels, seconds):
+    shard = get_shard()
+    histogram = shard.get((metric, labels))
+    if histogram is None:
+        # One counter per bucket, one for +Inf and the sum of the observed values
+        histogram = shard[(metric, labels)] = [0] * (len(LATENCY_BUCKETS) + 1) + [0.0]
+    histogram[bisect_left(LATENCY_BUCKETS, seconds)] += 1
+    histogram[-1] += seconds
+
+
+def start_request(endpoint):
+    request_context.endpoint = endpoint
+    request_context.outcome = None
+    return time.perf_counter()
+
+
+def finish_request(endpoint, status, started, outcome=None):
+    if not metrics_settings["enabled"]:
+        return
+    outcome = outcome or getattr(request_context, "outcome", None) or str(status)
+    observe("request", (endpoint, outcome), time.perf_counter() - started)
+
+
+def get_outcome(body, status):
+    return OUTCOMES.get(body.get("message"), str(status)) if status == 200 else str(status)
+
+
+def set_outcome(body, status):
+    request_context.outcome = get_outcome(body, status)
+
+
+def run_for_endpoint(endpoint, function, *args):
+    request_context.endpoint = endpoint
+    return function(*args)
+
+
+class Span:
+    __slots__ = ("stage", "started")
+
+    def __init__(self, stage):
+        self.stage = stage
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+
+    def __exit__(self, *exc_info):
+        endpoint = getattr(request_context, "endpoint", None) or "unknown"
+        observe("stage", (endpoint, self.stage), time.perf_counter() - self.started)
+
+
+def span(stage):
+    return Span(stage) if metrics_settings["enabled"] else nullcontext()
+
+
+def register_collector(collector):
+    collectors.append(collector)
+
+
+def merge_histograms():
+    merged = {}
+    for shard in list(shards.values()):
+        for key, histogram in list(shard.items()):
+            total = merged.setdefault(key, [0] * (len(LATENCY_BUCKETS) + 1) + [0.0])
+            for index, value in enumerate(histogram):
+                total[index] += value
+    return merged
+
+
+def format_labels(labels):
+    return ",".join(f'{name}="{value}"' for name, value in labels)
+
+
+def render_histogram(lines, name, description, label_names, histograms):
+    lines.append(f"# HELP {name} {description}")
+    lines.append(f"# TYPE {name} histogram")
+    for label_values, histogram in sorted(histograms.items()):
+        labels = list(zip(label_names, label_values))
+        cumulative = 0
+        for bound, count in zip((*LATENCY_BUCKETS, "+Inf"), histogram[:-1]):
+            cumulative += count
+            lines.append(f"{name}_bucket{{{format_labels(labels + [('le', bound)])}}} {cumulative}")
+        lines.append(f"{name}_sum{{{format_labels(labels)}}} {histogram[-1]}")
+        lines.append(f"{name}_count{{{format_labels(labels)}}} {cumulative}")
+
+
+def render_prometheus():
+    merged = merge_histograms()
+    lines = []
+    render_histogram(lines, "bank_api_request_duration_seconds", "Request latency by endpoint and outcome.",
+                     ("endpoint", "outcome"), {labels: value for (metric, labels), value in merged.items()
+                                               if metric == "request"})
+    render_histogram(lines, "bank_api_stage_duration_seconds", "Time spent in each stage of a request.",
+                     ("endpoint", "stage"), {labels: value for (metric, labels), value in merged.items()
+                                             if metric == "stage"})
+    for collector in collectors:
+        for name, metric_type, description, value in collector():
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
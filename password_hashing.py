@@ -0,0 +1,156 @@
+import math
+import multiprocessing
+import os
+import threading
+import time
+from collections import OrderedDict, deque
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+
+import bcrypt
+
+
+def check_password(password_hash, password):
+    return bcrypt.checkpw(password.encode("utf-8"), password_hash.encode("utf-8"))
+
+
+def hash_password(password, rounds):
+    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+
+
+def get_log_rounds(password_hash):
+    """Returns the work factor of a bcrypt hash, e.g. 12 for "$2b$12$...", or None if it is not a bcrypt hash."""
+    parts = password_hash.split("$")
+    return int(parts[2]) if len(parts) == 4 and parts[2].isdigit() else None
+
+
+class PasswordVerifier:
+    """Checks administrator passwords in a small process pool, away from the threads serving the API.
+
+    A bcrypt check takes hundreds of milliseconds of CPU by design. Running it in separate processes keeps a burst of
+    logins from starving the verification endpoints, and admission control bounds the burst itself: a check is
+    refused when max_pending checks are already queued or running, when one for the same username or address is in
+    flight, or when the username or address had max_failures failed logins within failure_window seconds.
+    """
+
+    def __init__(self, rounds=12, workers=2, max_pending=8, timeout=5.0, max_failures=5, failure_window=300.0,
+                 max_tracked_clients=100000):
+        self.rounds = rounds
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.max_failures = max_failures
+        self.failure_window = failure_window
+        self.max_tracked_clients = max_tracked_clients
+        self.lock = threading.Lock()
+        self.pool = None
+        self.pool_pid = None
+        self.pending = 0
+        self.in_flight = {}
+        self.failures = OrderedDict()
+        self.checks = 0
+        self.rejected_busy = 0
+        self.rejected_throttled = 0
+        self.timeouts = 0
+        self.rehashes = 0
+
+    def get_pool(self):
+        """Returns the pool of the current process. A pool inherited through a fork has no workers, so a new one is
+        started in every worker of a pre-fork server."""
+        if self.pool_pid == os.getpid():
+            return self.pool
+        with self.lock:
+            if self.pool_pid != os.getpid():
+                # Spawned as fresh interpreters: a fork would copy the locks held by the threads of this process. A
+                # fork server would not do either, as it cannot be reached from a worker forked after it was started
+                self.pool = ProcessPoolExecutor(self.workers, mp_context=multiprocessing.get_context("spawn"))
+                self.pool_pid = os.getpid()
+            return self.pool
+
+    def get_failures(self, client, now):
+        failures = self.failures.get(client)
+        while failures and failures[0] <= now - self.failure_window:
+            failures.popleft()
+        if failures is not None and not failures:
+            del self.failures[client]
+            return None
+        return failures
+
+    def admit(self, clients):
+        """Reserves a slot for a password check by the given clients, e.g. the username and the remote address.
+
+        Returns None when admitted, or else the reason for the refusal and the seconds to wait before retrying.
+        """
+        now = time.monotonic()
+        with self.lock:
+            if self.pending >= self.max_pending:
+                self.rejected_busy += 1
+                return "Too many login attempts in progress, please try again shortly", 1
+            for client in clients:
+                failures = self.get_failures(client, now)
+                if failures and len(failures) >= self.max_failures:
+                    self.rejected_throttled += 1
+                    return ("Too many failed login attempts, please try again later",
+                            math.ceil(failures[0] + self.failure_window - now))
+                if client in self.in_flight:
+                    self.rejected_throttled += 1
+                    return "Another login attempt is in progress, please try again shortly", 1
+            self.pending += 1
+            for client in clients:
+                self.in_flight[client] = self.in_flight.get(client, 0) + 1
+        return None
+
+    def release(self, clients, failed):
+        now = time.monotonic()
+        with self.lock:
+            self.pending -= 1
+            for client in clients:
+                self.in_flight[client] -= 1
+                if not self.in_flight[client]:
+                    del self.in_flight[client]
+                if failed:
+                    self.failures.setdefault(client, deque()).append(now)
+                    self.failures.move_to_end(client)
+            while len(self.failures) > self.max_tracked_clients:
+                self.failures.popitem(last=False)
+
+    def verify(self, clients, password_hash, password):
+        """Checks the password of clients admitted by admit() and releases their slot once the check is over.
+
+        An unknown username is passed as a None hash and counts as a failed attempt. Raises FutureTimeoutError, which
+        is only the builtin TimeoutError from Python 3.11, when the check takes longer than timeout; the slot is then
+        held until the check actually ends.
+        """
+        if password_hash is None:
+            self.release(clients, True)
+            return False
+        try:
+            future = self.get_pool().submit(check_password, password_hash, password)
+        except Exception:
+            self.release(clients, False)
+            raise
+        self.checks += 1
+        # Only a completed check with a wrong password counts as a failure
+        future.add_done_callback(lambda done: self.release(
+            clients, not done.cancelled() and done.exception() is None and not done.result()))
+        try:
+            return future.result(timeout=self.timeout)
+        except FutureTimeoutError:
+            self.timeouts += 1
+            raise
+        except BrokenProcessPool:
+            # A worker died, e.g. killed by the OOM killer: the next check starts a new pool
+            self.pool_pid = None
+            raise
+
+    def needs_rehash(self, password_hash):
+        return get_log_rounds(password_hash) != self.rounds
+
+    def hash(self, password):
+        password_hash = self.get_pool().submit(hash_password, password, self.rounds).result(timeout=self.timeout)
+        self.rehashes += 1
+        return password_hash
+
+    def close(self):
+        if self.pool is not None and self.pool_pid == os.getpid():
+            self.pool.shutdown(wait=False, cancel_futures=True)
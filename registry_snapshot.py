@@ -0,0 +1,250 @@
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+from costants import IBAN_LENGTH
+from db_utils import HOLDER_COLUMNS, get_connection, release_connection, get_registry_version, \
+    get_registry_fingerprint, select_iban_holders, select_from_shards
+from utils import HolderRecord, to_holder_record
+
+try:
+    import fcntl
+except ImportError:
+    # Windows has no pre-fork servers, so concurrent rebuilds by several workers are not a concern there
+    fcntl = None
+
+FILE_MAGIC = b"IBSN"
+FILE_FORMAT_VERSION = 1
+# Magic, format version, number of records, registry version and registry fingerprint
+FILE_HEADER = struct.Struct("<4sHQq16s")
+# Records are sorted by IBAN and point to the fields of the holder in the names blob that follows them
+RECORD = struct.Struct(f"<{IBAN_LENGTH}sxII")
+RECORD_DTYPE = np.dtype({"names": ["iban", "offset", "length"], "formats": [f"S{IBAN_LENGTH}", "<u4", "<u4"],
+                         "offsets": [0, IBAN_LENGTH + 1, IBAN_LENGTH + 5], "itemsize": RECORD.size})
+FIELD_SEPARATOR = "\x1f"
+NULL_FIELD = "\x00"
+
+
+def encode_record(record):
+    fields = (record.id, *record[2:])
+    return FIELD_SEPARATOR.join(NULL_FIELD if field is None else field for field in fields).encode()
+
+
+def decode_record(iban, data):
+    fields = [None if field == NULL_FIELD else field for field in data.decode().split(FIELD_SEPARATOR)]
+    return HolderRecord(fields[0], iban, *fields[1:])
+
+
+class SnapshotView:
+    """One generation of the snapshot file, mapped read-only."""
+
+    def __init__(self, path):
+        with open(path, "rb") as snapshot_file:
+            self.inode = os.fstat(snapshot_file.fileno()).st_ino
+            self.mm = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, format_version, self.count, self.version, self.fingerprint = FILE_HEADER.unpack_from(self.mm)
+        if magic != FILE_MAGIC or format_version != FILE_FORMAT_VERSION:
+            raise ValueError(f"{path} is not a registry snapshot")
+        self.blob_offset = FILE_HEADER.size + self.count * RECORD.size
+
+    def find(self, iban):
+        key = iban.encode("ascii", "replace")
+        if len(key) != IBAN_LENGTH:
+            return None
+        mm, low, high = self.mm, 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start = FILE_HEADER.size + middle * RECORD.size
+            if mm[start:start + IBAN_LENGTH] < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low == self.count:
+            return None
+        record_iban, offset, length = RECORD.unpack_from(mm, FILE_HEADER.size + low * RECORD.size)
+        if record_iban != key:
+            return None
+        start = self.blob_offset + offset
+        return decode_record(iban, mm[start:start + length])
+
+    def get_entries(self):
+        return np.frombuffer(self.mm, dtype=RECORD_DTYPE, count=self.count, offset=FILE_HEADER.size)
+
+
+class RegistrySnapshot:
+    """Memory-mapped, read-only copy of iban_holders shared by all the worker processes through the page cache.
+
+    Lookups binary-search the mapped file without copying it. Every write produces a new generation of the file,
+    which replaces the previous one atomically; workers switch to it the next time they check the file, while
+    lookups already in progress keep using the generation they started with.
+    """
+
+    def __init__(self, path, refresh_interval=1.0):
+        self.path = path
+        self.refresh_interval = refresh_interval
+        self.view = None
+        self.lock = threading.RLock()
+        self.refresher_pid = None
+        self.reloads = 0
+
+    @property
+    def size(self):
+        view = self.view
+        return view.count if view else 0
+
+    @property
+    def version(self):
+        view = self.view
+        return view.version if view else None
+
+    @contextmanager
+    def locked_file(self, blocking=True):
+        """Serializes writers of the snapshot file across processes. Yields False if it is held and not blocking."""
+        if fcntl is None:
+            yield True
+            return
+        with open(f"{self.path}.lock", "a") as lock_file:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                yield False
+                return
+            try:
+                yield True
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def remap_if_replaced(self):
+        try:
+            inode = os.stat(self.path).st_ino
+        except FileNotFoundError:
+            return
+        if self.view is None or self.view.inode != inode:
+            self.view = SnapshotView(self.path)
+            self.reloads += 1
+
+    def is_current(self, connection, check_fingerprint=True):
+        view = self.view
+        if view is None or view.version != get_registry_version(connection):
+            return False
+        return not check_fingerprint or view.fingerprint == get_registry_fingerprint(connection)
+
+    def load(self, connection):
+        with self.lock, self.locked_file():
+            try:
+                self.remap_if_replaced()
+            except ValueError:
+                self.view = None
+            if not self.is_current(connection):
+                self.build(connection)
+
+    def build(self, connection):
+        """Writes a new generation from the whole table. Must be called with the file lock held."""
+        version, fingerprint = get_registry_version(connection), get_registry_fingerprint(connection)
+        rows = select_from_shards(connection, f"SELECT {HOLDER_COLUMNS} FROM iban_holders ORDER BY iban",
+                                  key=lambda row: row[1])
+        entries, blob, size = [], [], 0
+        for row in rows:
+            data = encode_record(to_holder_record(row))
+            entries.append((row[1].encode(), size, len(data)))
+            blob.append(data)
+            size += len(data)
+        self.write(np.array(entries, dtype=RECORD_DTYPE), blob, version, fingerprint)
+
+    def write(self, entries, blob, version, fingerprint):
+        temporary_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(temporary_path, "wb") as snapshot_file:
+            snapshot_file.write(FILE_HEADER.pack(FILE_MAGIC, FILE_FORMAT_VERSION, len(entries), version, fingerprint))
+            # Structured dtype promotion drops the padding byte, so the layout is enforced on every write
+            snapshot_file.write(entries.astype(RECORD_DTYPE, copy=False).tobytes())
+            for data in blob:
+                snapshot_file.write(data)
+        os.replace(temporary_path, self.path)
+        self.remap_if_replaced()
+
+    def apply_changes(self, connection, changes, removed_ibans=(), updated_ibans=()):
+        with self.lock, self.locked_file():
+            self.remap_if_replaced()
+            version = get_registry_version(connection)
+            view = self.view
+            if view is not None and view.version == version:
+                # Another worker already wrote the generation that includes these changes
+                return
+            if view is None or version != view.version + changes:
+                self.build(connection)
+                return
+            # The blob of the previous generation is reused as is: removed records are only dropped from the index,
+            # and the blob is compacted by the next full build once they take up half of it
+            entries = view.get_entries()
+            changed_ibans = np.array([iban.encode() for iban in {*removed_ibans, *updated_ibans}],
+                                     dtype=RECORD_DTYPE["iban"])
+            kept_entries = entries[~np.isin(entries["iban"], changed_ibans)]
+            blob_size = len(view.mm) - view.blob_offset
+            if int(kept_entries["length"].sum()) * 2 < blob_size:
+                self.build(connection)
+                return
+            blob, added_entries = [view.mm[view.blob_offset:]], []
+            for iban, record in sorted(select_iban_holders(connection, updated_ibans).items()):
+                data = encode_record(record)
+                added_entries.append((iban.encode(), blob_size, len(data)))
+                blob.append(data)
+                blob_size += len(data)
+            merged_entries = np.concatenate([kept_entries, np.array(added_entries, dtype=RECORD_DTYPE)])
+            merged_entries = merged_entries[np.argsort(merged_entries["iban"], kind="stable")]
+            del entries, kept_entries
+            self.write(merged_entries, blob, version, get_registry_fingerprint(connection))
+
+    def get(self, iban):
+        self.start_refresher()
+        view = self.view
+        return view.find(iban) if view else None
+
+    def get_many(self, ibans):
+        self.start_refresher()
+        view = self.view
+        records = {}
+        for iban in ibans:
+            record = view.find(iban) if view else None
+            if record:
+                records[iban] = record
+        return records
+
+    def refresh_if_stale(self):
+        with self.lock:
+            self.remap_if_replaced()
+            connection = None
+            try:
+                connection = get_connection()
+                if self.is_current(connection, check_fingerprint=False):
+                    return
+                # Only one worker rebuilds after a write made outside the app, e.g. by bulk_io.py
+                with self.locked_file(blocking=False) as acquired:
+                    if acquired:
+                        self.remap_if_replaced()
+                        if not self.is_current(connection):
+                            self.build(connection)
+            finally:
+                release_connection(connection)
+
+    def start_refresher(self):
+        if self.refresher_pid == os.getpid():
+            return
+        with self.lock:
+            if self.refresher_pid == os.getpid():
+                return
+            self.refresher_pid = os.getpid()
+            threading.Thread(target=self.refresh_periodically, daemon=True).start()
+
+    def refresh_periodically(self):
+        while True:
+            time.sleep(self.refresh_interval)
+            try:
+                self.refresh_if_stale()
+            except Exception:
+                # The next iteration retries, e.g. while the database is locked by a long write
+                continue
@@ -0,0 +1,207 @@
+import cProfile
+import hashlib
+import hmac
+import json
+import marshal
+import os
+import random
+import re
+import threading
+import time
+from datetime import datetime, timezone
+
+# The credentials of the login are never written to a capture
+REDACTED_FIELDS = {"password", "username"}
+MAX_CAPTURED_STRING_LENGTH = 1000
+MAX_CAPTURED_ITEMS = 20
+# Paths of the capture files under the profiles directory, as listed by list_captures()
+CAPTURE_FILE_REGEX = re.compile(r"(latest|slowest/[a-z_]+)/[0-9-]+\.(json|prof)")
+
+
+def sanitize_input(value):
+    """Returns a copy of a request input fit to be kept on disk: credentials are redacted, and long strings and lists
+    are cut, noting what was left out. Names and IBANs are kept, since they are what makes a verification slow, and are
+    already visible to the administrators in the audit log."""
+    if isinstance(value, dict):
+        return {key: "[redacted]" if str(key).lower() in REDACTED_FIELDS else sanitize_input(item)
+                for key, item in value.items()}
+    if isinstance(value, list):
+        items = [sanitize_input(item) for item in value[:MAX_CAPTURED_ITEMS]]
+        if len(value) > MAX_CAPTURED_ITEMS:
+            items.append(f"[{len(value) - MAX_CAPTURED_ITEMS} more items]")
+        return items
+    if isinstance(value, str) and len(value) > MAX_CAPTURED_STRING_LENGTH:
+        return f"{value[:MAX_CAPTURED_STRING_LENGTH]}[{len(value)} characters in total]"
+    return value
+
+
+def describe_request(method, path, query, body, status):
+    return {
+        "recordedAt": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+        "method": method,
+        "path": path,
+        "query": sanitize_input(query),
+        "input": sanitize_input(body),
+        "status": status,
+    }
+
+
+def write_atomically(path, data):
+    with open(path + ".tmp", "wb") as capture_file:
+        capture_file.write(data)
+    os.replace(path + ".tmp", path)
+
+
+class RequestProfiler:
+    """Profiles requests with cProfile when they are sampled or carry a token issued to an administrator, and keeps the
+    inputs of the slowest requests, so that a slow input seen in production can be replayed.
+
+    Profiles go to a ring of the latest ring_size captures under directory/latest. Every request is timed as well, and
+    the slowest_size slowest of each endpoint are kept under directory/slowest/<endpoint>, with their profile when they
+    were profiled. All the workers write to the same directory: captures are files named after their time or duration,
+    so that pruning only needs the names. Only one request per process is profiled at a time, which bounds the overhead
+    of a high sample rate.
+    """
+
+    def __init__(self, directory, sample_rate=0.0, ring_size=100, slowest_size=10, secret_key="", token_ttl=900.0,
+                 excluded_endpoints=()):
+        self.directory = directory
+        self.sample_rate = sample_rate
+        self.ring_size = ring_size
+        self.slowest_size = slowest_size
+        self.key = hashlib.sha256(f"request-profiler:{secret_key}".encode()).digest()
+        self.token_ttl = token_ttl
+        # Endpoints neither profiled nor timed, e.g. the login, slow by design
+        self.excluded_endpoints = frozenset(excluded_endpoints)
+        self.profiling = threading.Lock()
+        self.lock = threading.Lock()
+        # Duration a request must exceed to be among the slowest of its endpoint, as last seen by this process
+        self.thresholds = {}
+        self.profiled = 0
+        self.skipped_busy = 0
+        self.slow_captures = 0
+        self.write_errors = 0
+
+    def sign(self, expires):
+        return hmac.new(self.key, expires.encode(), hashlib.sha256).hexdigest()
+
+    def issue_token(self):
+        """Returns a token that has the requests carrying it profiled for token_ttl seconds, and its expiry time."""
+        expires = int(time.time() + self.token_ttl)
+        return f"{expires}.{self.sign(str(expires))}", expires
+
+    def is_valid_token(self, token):
+        expires, _, signature = token.partition(".")
+        return expires.isdigit() and int(expires) >= time.time() and \
+            hmac.compare_digest(signature.encode(), self.sign(expires).encode())
+
+    def start(self, token=None):
+        """Returns a running profile when the request carries a valid token or is sampled, or else None. The profile
+        covers the calling thread only and must be stopped in it."""
+        if not (token and self.is_valid_token(token)) and not random.random() < self.sample_rate:
+            return None
+        if not self.profiling.acquire(blocking=False):
+            self.skipped_busy += 1
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profiler, e.g. a debugger, is already active
+            self.profiling.release()
+            self.skipped_busy += 1
+            return None
+        return profile
+
+    def stop(self, profile):
+        profile.disable()
+        self.profiling.release()
+        self.profiled += 1
+
+    def get_slowest_directory(self, endpoint):
+        return os.path.join(self.directory, "slowest", endpoint)
+
+    def is_slow(self, endpoint, duration):
+        if not self.slowest_size:
+            return False
+        threshold = self.thresholds.get(endpoint)
+        if threshold is None:
+            with self.lock:
+                threshold = self.thresholds[endpoint] = self.get_threshold(
+                    self.list_stems(self.get_slowest_directory(endpoint)))
+        return duration > threshold
+
+    def get_threshold(self, slowest_stems):
+        # The stems of the slowest captures start with their duration in microseconds
+        if len(slowest_stems) < self.slowest_size:
+            return 0.0
+        return int(slowest_stems[-self.slowest_size].split("-")[0]) / 1e6
+
+    def list_stems(self, directory):
+        try:
+            return sorted(name[:-5] for name in os.listdir(directory) if name.endswith(".json"))
+        except FileNotFoundError:
+            return []
+
+    def prune(self, directory, size):
+        """Removes all but the last size captures of directory by name, and returns the names of those kept."""
+        stems = self.list_stems(directory)
+        kept = max(len(stems) - size, 0)
+        for stem in stems[:kept]:
+            for suffix in (".prof", ".json"):
+                try:
+                    os.remove(os.path.join(directory, stem + suffix))
+                except FileNotFoundError:
+                    # Pruned by another worker in the meantime
+                    pass
+        return stems[kept:]
+
+    def write(self, directory, stem, details, profile_data):
+        os.makedirs(directory, exist_ok=True)
+        capture_id = os.path.relpath(os.path.join(directory, stem), self.directory).replace(os.sep, "/")
+        if profile_data is not None:
+            write_atomically(os.path.join(directory, stem + ".prof"), profile_data)
+        # The metadata is written last, as a capture is listed from it
+        details = dict(details, id=capture_id, profile=f"{capture_id}.prof" if profile_data is not None else None)
+        write_atomically(os.path.join(directory, stem + ".json"), json.dumps(details).encode("utf-8"))
+
+    def save(self, endpoint, duration, profile, details):
+        """Writes the capture of a finished request, once its response has been sent."""
+        details = dict(details, endpoint=endpoint, durationMs=round(duration * 1000, 3))
+        slow = self.is_slow(endpoint, duration)
+        try:
+            with self.lock:
+                stem = f"{time.time_ns()}-{os.getpid()}"
+                profile_data = None
+                if profile is not None:
+                    profile.create_stats()
+                    profile_data = marshal.dumps(profile.stats)
+                    latest_directory = os.path.join(self.directory, "latest")
+                    self.write(latest_directory, stem, details, profile_data)
+                    self.prune(latest_directory, self.ring_size)
+                if slow:
+                    slowest_directory = self.get_slowest_directory(endpoint)
+                    self.write(slowest_directory, f"{round(duration * 1e6):012d}-{stem}", details, profile_data)
+                    self.thresholds[endpoint] = self.get_threshold(self.prune(slowest_directory, self.slowest_size))
+                    self.slow_captures += 1
+        except OSError:
+            self.write_errors += 1
+
+    def read_captures(self, directory):
+        captures = []
+        for stem in self.list_stems(directory):
+            try:
+                with open(os.path.join(directory, stem + ".json"), encoding="utf-8") as capture_file:
+                    captures.append(json.load(capture_file))
+            except (FileNotFoundError, ValueError):
+                # Pruned since it was listed
+                continue
+        return captures
+
+    def list_captures(self):
+        """Returns the latest profiles, newest first, and the slowest requests of every endpoint, slowest first."""
+        latest = self.read_captures(os.path.join(self.directory, "latest"))
+        slowest_root = os.path.join(self.directory, "slowest")
+        endpoints = sorted(os.listdir(slowest_root)) if os.path.isdir(slowest_root) else []
+        slowest = {endpoint: self.read_captures(os.path.join(slowest_root, endpoint))[::-1] for endpoint in endpoints}
+        return latest[::-1], slowest
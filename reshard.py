@@ -0,0 +1,122 @@
+import argparse
+import os
+import sqlite3
+
+from rich.console import Console
+
+from db_utils import DATABASE, configure_database, get_shard_count, get_shard_path, get_iban_shard, save_shard_layout
+from initialize_database import create_tables
+
+console = Console()
+
+RESHARD_SUFFIX = ".reshard"
+BACKUP_SUFFIX = ".bak"
+
+
+def copy_table(source, targets, table, route, batch_size):
+    """Copies every row of a table to the target chosen by route, committing the targets after each batch."""
+    cursor = source.execute(f"SELECT * FROM {table}")
+    columns = [column[0] for column in cursor.description]
+    query = f"INSERT INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})"
+    copied = 0
+    while True:
+        rows = cursor.fetchmany(batch_size)
+        if not rows:
+            break
+        rows_by_target = {}
+        for row in rows:
+            rows_by_target.setdefault(route(row), []).append(row)
+        for target, target_rows in rows_by_target.items():
+            targets[target].executemany(query, target_rows)
+            targets[target].commit()
+        copied += len(rows)
+    return copied
+
+
+def count_holders(connections):
+    return sum(connection.execute("SELECT COUNT(*) FROM iban_holders").fetchone()[0] for connection in connections)
+
+
+def build_shards(current_shards, shards, batch_size):
+    """Writes the new layout next to the current files and returns the number of holders copied, or None."""
+    sources, targets = [], []
+    try:
+        for shard in range(shards):
+            path = get_shard_path(shard) + RESHARD_SUFFIX
+            if os.path.exists(path):
+                os.remove(path)
+            targets.append(sqlite3.connect(path))
+            create_tables(targets[shard].cursor(), shard)
+        save_shard_layout(targets[0], shards)
+        targets[0].commit()
+        copied = 0
+        for shard in range(current_shards):
+            sources.append(sqlite3.connect(get_shard_path(shard)))
+            if shard == 0:
+                copy_table(sources[0], targets, "administrators", lambda row: 0, batch_size)
+            copied += copy_table(sources[shard], targets, "iban_holders",
+                                 lambda row: get_iban_shard(row[1], shards), batch_size)
+            console.print(f"[cyan]Copied {copied} holders[/cyan]")
+        if count_holders(sources) != copied or count_holders(targets) != copied:
+            console.print("[bold red]Resharding failed:[/bold red] the database changed while it was being copied")
+            return None
+        return copied
+    except (sqlite3.Error, OSError) as e:
+        console.print(f"[bold red]Resharding failed:[/bold red] {e}")
+        return None
+    finally:
+        for connection in sources + targets:
+            connection.close()
+
+
+def replace_shards(current_shards, shards, keep_backup):
+    """Moves the current files aside and the new ones into place. The previous files are kept until both succeed."""
+    current_paths = [get_shard_path(shard) for shard in range(current_shards)]
+    for path in current_paths:
+        os.replace(path, path + BACKUP_SUFFIX)
+    for shard in range(shards):
+        os.replace(get_shard_path(shard) + RESHARD_SUFFIX, get_shard_path(shard))
+    if not keep_backup:
+        for path in current_paths:
+            os.remove(path + BACKUP_SUFFIX)
+
+
+def reshard(shards, batch_size=50000, keep_backup=False):
+    # Reads the number of shards recorded in the database
+    configure_database({})
+    current_shards = get_shard_count()
+    if shards == current_shards:
+        console.print(f"[bold yellow]{DATABASE} is already split into {shards} shards[/bold yellow]")
+        return False
+    # The write-ahead log of a database is removed when its last connection closes, so one left means a process,
+    # e.g. the app, still has the database open and could write to it while it is being copied
+    in_use = [get_shard_path(shard) for shard in range(current_shards) if os.path.exists(get_shard_path(shard) + "-wal")]
+    if in_use:
+        console.print(f"[bold red]Resharding aborted:[/bold red] {', '.join(in_use)} still in use, stop the app first")
+        return False
+    copied = build_shards(current_shards, shards, batch_size)
+    if copied is None:
+        for shard in range(shards):
+            if os.path.exists(get_shard_path(shard) + RESHARD_SUFFIX):
+                os.remove(get_shard_path(shard) + RESHARD_SUFFIX)
+        return False
+    replace_shards(current_shards, shards, keep_backup)
+    console.print(f"[bold green]{copied} holders split into {shards} shards[/bold green]")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Split the holders of {DATABASE} into a different number of shards "
+                                                 f"by bank code. The app must be stopped while it runs")
+    parser.add_argument("shards", type=int, help="Number of database files, 1 to merge them back into one")
+    parser.add_argument("--batch-size", type=int, default=50000, help="Rows copied per transaction")
+    parser.add_argument("--keep-backup", action="store_true",
+                        help=f"Keep the previous files with the {BACKUP_SUFFIX} suffix")
+    args = parser.parse_args()
+    if args.shards < 1:
+        parser.error("the number of shards must be at least 1")
+    reshard(args.shards, args.batch_size, args.keep_backup)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+import zlib
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+COMPRESSIBLE_MIMETYPES = {"application/json", "application/x-ndjson", "application/javascript", "text/css",
+                          "text/html", "text/javascript", "text/plain"}
+
+compression_settings = {"enabled": True, "min_size": 1024, "level": 6}
+
+
+def configure_compression(config):
+    compression_settings["enabled"] = config.get("COMPRESSION_ENABLED", compression_settings["enabled"])
+    compression_settings["min_size"] = config.get("COMPRESSION_MIN_SIZE", compression_settings["min_size"])
+    compression_settings["level"] = config.get("COMPRESSION_LEVEL", compression_settings["level"])
+
+
+def get_supported_encodings():
+    """Encodings in order of preference, the best compressing first."""
+    encodings = []
+    if zstandard:
+        encodings.append("zstd")
+    if brotli:
+        encodings.append("br")
+    return encodings + ["gzip"]
+
+
+def negotiate_encoding(accept_encodings):
+    """Returns the preferred encoding accepted by the client with the highest quality, or None."""
+    best, best_quality = None, 0
+    for encoding in get_supported_encodings():
+        quality = accept_encodings[encoding]
+        if quality > best_quality:
+            best, best_quality = encoding, quality
+    return best
+
+
+def get_identity_etag(etag):
+    """Returns the ETag of the uncompressed representation a compressed one was derived from."""
+    base, _, encoding = etag.rpartition("-")
+    return base if base and encoding in ("zstd", "br", "gzip") else etag
+
+
+class BrotliCompressor:
+    """Gives the brotli compressor the compress/flush interface of zlib and zstandard."""
+
+    def __init__(self, quality):
+        self.compressor = brotli.Compressor(quality=quality)
+
+    def compress(self, data):
+        return self.compressor.process(data)
+
+    def flush(self):
+        return self.compressor.finish()
+
+
+def get_compressor(encoding):
+    level = compression_settings["level"]
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=level).compressobj()
+    if encoding == "br":
+        return BrotliCompressor(min(level, 11))
+    return zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+
+
+def compress_chunks(chunks, compressor):
+    try:
+        for chunk in chunks:
+            data = compressor.compress(chunk.encode() if isinstance(chunk, str) else chunk)
+            if data:
+                yield data
+        yield compressor.flush()
+    finally:
+        # Lets streamed responses release their database connection when the client goes away
+        if hasattr(chunks, "close"):
+            chunks.close()
+
+
+def compress_response(response, accept_encodings):
+    """Compresses the response in place if the client accepts an encoding and the response is worth compressing.
+
+    Streamed responses are compressed chunk by chunk, since their size is not known in advance. Each content coding is a
+    representation of its own, so the encoding is appended to the ETag, e.g. "<tag>-gzip".
+    """
+    if not compression_settings["enabled"] or response.status_code != 200 or response.direct_passthrough or \
+            "Content-Encoding" in response.headers or response.mimetype not in COMPRESSIBLE_MIMETYPES:
+        return response
+    response.vary.add("Accept-Encoding")
+    encoding = negotiate_encoding(accept_encodings)
+    if not encoding:
+        return response
+    if response.is_streamed:
+        response.response = compress_chunks(response.response, get_compressor(encoding))
+        response.headers.pop("Content-Length", None)
+    else:
+        data = response.get_data()
+        if len(data) < compression_settings["min_size"]:
+            return response
+        compressor = get_compressor(encoding)
+        response.set_data(compressor.compress(data) + compressor.flush())
+    response.headers["Content-Encoding"] = encoding
+    etag, weak = response.get_etag()
+    if etag:
+        response.set_etag(f"{etag}-{encoding}", weak)
+    return response
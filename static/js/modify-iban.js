@@ -1,4 +1,4 @@
-import { API, sendRequest, showFailureAlert, hasEmptyRequiredFields, getAlert, handleApiResponse, showConfirmationAlert, clearFields,
+import { API, sendRequest, hasIbanRecords, selectIbanRecord, showFailureAlert, hasEmptyRequiredFields, getAlert, handleApiResponse, showConfirmationAlert, clearFields,
   disableInputFields,
   enableInputFields
 } from "./utilities.js";
@@ -7,54 +7,17 @@ let oldIbanId = "";
 let isCompanyName;
 
 async function setInputFields() {
-  const url = `${API}ibans`;
-  const response = await sendRequest(url);
-  if (response.hasOwnProperty("failed") || !response.ok) {
-    showFailureAlert(
-      "Error!",
-      "Unable to retrieve IBAN list. Please try again later.",
-      "error"
-    );
+  const hasRecords = await hasIbanRecords();
+  if (hasRecords === null) {
+    showFailureAlert("Error!", "Unable to retrieve IBAN list. Please try again later.", "error");
     return;
   }
-  const ibanRecords = await response.json();
-  if (ibanRecords.length === 0) {
+  if (!hasRecords) {
     showFailureAlert("Error!", "There is no iban to modify", "error");
     return;
   }
-  const inputOptions = ibanRecords.reduce((options, record) => {
-    const label = record.companyName
-      ? `${record.iban} - ${record.companyName}`
-      : `${record.iban} - ${record.firstName} ${record.lastName}`;
-    options[record.iban] = label;
-    return options;
-  }, {});
   enableInputFields(nameInput, surnameInput, ibanInput);
-  const { value: selectedIban } = await Swal.fire({
-    title: "Select the IBAN to modify",
-    input: "select",
-    inputOptions: inputOptions,
-    inputPlaceholder: "Select an IBAN",
-    confirmButtonText: "Ok",
-    confirmButtonColor: "#3085d6",
-    heightAuto: false,
-    allowOutsideClick: false,
-    allowEscapeKey: false,
-    didOpen: () => {
-      document.getElementsByTagName("option")[0].style.display = "none";
-    },
-    inputValidator: (value) => {
-      return new Promise((resolve) => {
-        if (ibanRecords.length > 0 && !value) {
-          resolve("You need to select an IBAN");
-        } 
-        else {
-          resolve();
-        }
-      });
-    },
-  });
-  const ibanRecord = ibanRecords.find((record) => record.iban === selectedIban);
+  const ibanRecord = await selectIbanRecord("Select the IBAN to modify");
   if (ibanRecord) {
     oldIbanId = ibanRecord.id;
     nameInput.value = ibanRecord.firstName || ibanRecord.companyName;
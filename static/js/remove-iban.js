@@ -1,52 +1,19 @@
-import { API, sendRequest, showFailureAlert, getAlert, handleApiResponse, showConfirmationAlert, clearFields } from "./utilities.js";
+import { API, sendRequest, hasIbanRecords, selectIbanRecord, showFailureAlert, getAlert, handleApiResponse, showConfirmationAlert, clearFields } from "./utilities.js";
 
 let isCompanyName;
 let ibanId = "";
 
 async function setInputFields() {
-  const url = `${API}ibans`;
-  const response = await sendRequest(url);
-  if (response.hasOwnProperty("failed") || !response.ok) {
-      showFailureAlert("Error!", "Unable to retrieve IBAN list. Please try again later.", "error");
-      return; 
+  const hasRecords = await hasIbanRecords();
+  if (hasRecords === null) {
+    showFailureAlert("Error!", "Unable to retrieve IBAN list. Please try again later.", "error");
+    return;
   }
-  const ibanRecords = await response.json();
-  if (ibanRecords.length === 0) {
-    showFailureAlert("Error!", "There is no iban to modify", "error")
+  if (!hasRecords) {
+    showFailureAlert("Error!", "There is no iban to remove", "error");
     return;
   }
-  const inputOptions = ibanRecords.reduce((options, record) => {
-    const label = record.companyName
-      ? `${record.iban} - ${record.companyName}`
-      : `${record.iban} - ${record.firstName} ${record.lastName}`;
-    options[record.iban] = label;
-    return options;
-  }, {});
-  const { value: selectedIban } = await Swal.fire({
-    title: "Select the IBAN to remove",
-    input: "select",
-    inputOptions: inputOptions,
-    inputPlaceholder: "Select an IBAN",
-    confirmButtonText: "Ok",
-    confirmButtonColor: "#3085d6",
-    heightAuto: false,
-    allowOutsideClick: false,
-    allowEscapeKey: false,
-    didOpen: () => {
-      document.getElementsByTagName("option")[0].style.display = "none";
-    },
-    inputValidator: (value) => {
-      return new Promise((resolve) => {
-        if (ibanRecords.length > 0 && !value) {
-          resolve("You need to select an IBAN");
-        }
-        else {
-          resolve();
-        }
-      });
-    },
-  });
-  const ibanRecord = ibanRecords.find(record => record.iban === selectedIban);
+  const ibanRecord = await selectIbanRecord("Select the IBAN to remove");
   if (ibanRecord) {
     ibanId = ibanRecord.id;
     nameInput.value = ibanRecord.firstName || ibanRecord.companyName;
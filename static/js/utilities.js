@@ -48,6 +48,104 @@ export async function sendRequest(url, method = "GET", data) {
   }
 }
 
+export async function hasIbanRecords() {
+  const response = await sendRequest(`${API}ibans?limit=1&fields=id`);
+  if (response.hasOwnProperty("failed") || !response.ok) {
+    return null;
+  }
+  return (await response.json()).length > 0;
+}
+
+export async function searchIbanRecords(query, limit = 10) {
+  const response = await sendRequest(`${API}ibans/search?q=${encodeURIComponent(query)}&limit=${limit}`);
+  if (response.hasOwnProperty("failed") || !response.ok) {
+    return null;
+  }
+  return (await response.json()).results;
+}
+
+function getIbanRecordLabel(record) {
+  return record.companyName
+    ? `${record.iban} - ${record.companyName}`
+    : `${record.iban} - ${record.firstName} ${record.lastName}`;
+}
+
+export async function selectIbanRecord(title) {
+  let selectedRecord = null;
+  let searchTimeout;
+  let lastQuery = "";
+  const showResults = (resultsList, records, message) => {
+    resultsList.replaceChildren();
+    if (message) {
+      const hint = document.createElement("div");
+      hint.className = "list-group-item text-muted";
+      hint.textContent = message;
+      resultsList.append(hint);
+      return;
+    }
+    for (const record of records) {
+      const item = document.createElement("button");
+      item.type = "button";
+      item.className = "list-group-item list-group-item-action";
+      item.textContent = getIbanRecordLabel(record);
+      item.addEventListener("click", () => {
+        selectedRecord = record;
+        Swal.getInput().value = getIbanRecordLabel(record);
+        resultsList.replaceChildren();
+        Swal.resetValidationMessage();
+      });
+      resultsList.append(item);
+    }
+  };
+  const { isConfirmed } = await Swal.fire({
+    title: title,
+    input: "text",
+    inputPlaceholder: "Search by name, company or IBAN",
+    html: '<div id="iban-search-results" class="list-group text-start mt-2" style="max-height: 300px; overflow-y: auto;"></div>',
+    confirmButtonText: "Ok",
+    confirmButtonColor: "#3085d6",
+    heightAuto: false,
+    allowOutsideClick: false,
+    allowEscapeKey: false,
+    didOpen: () => {
+      const input = Swal.getInput();
+      const resultsList = document.getElementById("iban-search-results");
+      input.setAttribute("autocomplete", "off");
+      input.addEventListener("input", () => {
+        selectedRecord = null;
+        clearTimeout(searchTimeout);
+        const query = input.value.trim();
+        lastQuery = query;
+        if (query.length < 3) {
+          showResults(resultsList, [], query ? "Type at least 3 characters" : "");
+          return;
+        }
+        searchTimeout = setTimeout(async () => {
+          const records = await searchIbanRecords(query);
+          // A slower response to an earlier query must not replace the results of the current one
+          if (query !== lastQuery) {
+            return;
+          }
+          if (!records) {
+            showResults(resultsList, [], "Unable to search the IBANs");
+          }
+          else {
+            showResults(resultsList, records, records.length === 0 ? "No IBAN found" : "");
+          }
+        }, 200);
+      });
+    },
+    preConfirm: () => {
+      if (!selectedRecord) {
+        Swal.showValidationMessage("You need to select an IBAN");
+        return false;
+      }
+      return true;
+    }
+  });
+  return isConfirmed ? selectedRecord : null;
+}
+
 export function showConfirmationAlert(name, surname, iban, action, isCompanyName) {
   const htmlContent = `
     <div style="text-align: left;">
@@ -1,9 +1,114 @@
 import re
-import regex
-from rapidfuzz import fuzz
+import string
+import threading
+from collections import namedtuple, OrderedDict
+
+import numpy as np
 
 from costants import IBAN_PATTERN, LEGAL_FORMS, COMPANY_NAME_PATTERN, FIRST_NAME_PATTERN, LAST_NAME_PATTERN, \
-    LEGAL_FORMS_PATTERN, UUID_V4_PATTERN
+    FULL_NAME_PATTERN, LEGAL_FORMS_PATTERN, UUID_V4_PATTERN, COMPANY_PARTNERS_PATTERN, IBAN_LENGTH
+
+LEGAL_FORM_REGEXES = [re.compile(pattern, re.IGNORECASE) for pattern in LEGAL_FORMS]
+
+# The patterns of costants.py, compiled on first use or by warm_patterns(). regex, needed for the \p{L} classes, and
+# rapidfuzz are only imported then, so that the scripts importing utils do not pay for them
+compiled_patterns = {}
+fuzz = None
+
+SIMILARITY_THRESHOLD = 85
+
+IBAN_LETTERS_TO_DIGITS = str.maketrans({letter: str(value) for value, letter in enumerate(string.ascii_uppercase, 10)})
+
+IBAN_CHARACTER_VALUES = np.full(256, 255, dtype=np.int64)
+IBAN_CHARACTER_VALUES[np.frombuffer(string.digits.encode(), dtype=np.uint8)] = np.arange(10)
+IBAN_CHARACTER_VALUES[np.frombuffer(string.ascii_uppercase.encode(), dtype=np.uint8)] = np.arange(10, 36)
+
+HolderRecord = namedtuple("HolderRecord", ["id", "iban", "first_name", "last_name", "company_name",
+                                           "first_name_folded", "last_name_folded", "company_name_folded",
+                                           "company_name_stripped", "legal_form"])
+
+
+class SimilarityCache:
+    """Thread-safe LRU cache of company-name similarity decisions."""
+
+    def __init__(self, max_size=10000):
+        self.max_size = max_size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            decision = self.entries.get(key)
+            if decision is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return decision
+
+    def put(self, key, decision):
+        if self.max_size <= 0:
+            return
+        with self.lock:
+            self.entries[key] = decision
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_size:
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+    def resize(self, max_size):
+        with self.lock:
+            self.max_size = max_size
+            while len(self.entries) > max(max_size, 0):
+                self.entries.popitem(last=False)
+                self.evictions += 1
+
+
+similarity_cache = SimilarityCache()
+similarity_settings = {"early_exit": True}
+
+
+def configure_similarity(config):
+    similarity_cache.resize(config.get("SIMILARITY_CACHE_SIZE", similarity_cache.max_size))
+    similarity_settings["early_exit"] = config.get("SIMILARITY_EARLY_EXIT", similarity_settings["early_exit"])
+
+
+def compile_patterns():
+    import regex
+
+    compiled_patterns.update({
+        "iban": re.compile(IBAN_PATTERN),
+        "uuid_v4": re.compile(UUID_V4_PATTERN),
+        "legal_forms": re.compile(LEGAL_FORMS_PATTERN, re.IGNORECASE),
+        "first_name": regex.compile(FIRST_NAME_PATTERN),
+        "last_name": regex.compile(LAST_NAME_PATTERN),
+        "full_name": regex.compile(FULL_NAME_PATTERN),
+        "company_name": regex.compile(COMPANY_NAME_PATTERN),
+        "company_partners": regex.compile(COMPANY_PARTNERS_PATTERN, flags=regex.IGNORECASE),
+    })
+    return compiled_patterns
+
+
+def get_pattern(name):
+    pattern = compiled_patterns.get(name)
+    return pattern if pattern is not None else compile_patterns()[name]
+
+
+def import_fuzz():
+    global fuzz
+    from rapidfuzz import fuzz as rapidfuzz_fuzz
+
+    fuzz = rapidfuzz_fuzz
+    return fuzz
+
+
+def warm_patterns():
+    """Compiles the patterns and imports rapidfuzz ahead of the first request that needs them."""
+    compile_patterns()
+    import_fuzz()
 
 
 def close_connection(connection):
@@ -23,22 +128,44 @@ def remove_spaces(input_string, input_field="iban"):
 
 
 def is_valid_iban(iban):
-    rearranged_iban = iban[4:] + iban[:4]
-    remainder = 0
-
-    for i in range(len(rearranged_iban)):
-        char_code = ord(rearranged_iban[i])
-        if 48 <= char_code <= 57:
-            numeric_value = char_code - 48
+    numeric_iban = (iban[4:] + iban[:4]).translate(IBAN_LETTERS_TO_DIGITS)
+    return numeric_iban.isascii() and numeric_iban.isdigit() and int(numeric_iban) % 97 == 1
+
+
+def validate_ibans(ibans):
+    valid = np.zeros(len(ibans), dtype=bool)
+    reasons = [""] * len(ibans)
+    candidates = []
+    for position, iban in enumerate(ibans):
+        if not isinstance(iban, str) or len(iban) != IBAN_LENGTH:
+            reasons[position] = f"IBAN must be {IBAN_LENGTH} characters long"
+        elif not iban.isascii():
+            # Rejected by IBAN_PATTERN and is_valid_iban as well, before the checksum is computed
+            reasons[position] = "IBAN format is not valid"
         else:
-            numeric_value = char_code - 55
-
-        if numeric_value > 9:
-            remainder = (100 * remainder + numeric_value) % 97
-        else:
-            remainder = (10 * remainder + numeric_value) % 97
-
-    return remainder == 1
+            candidates.append(position)
+    if not candidates:
+        return valid, reasons
+    codes = np.frombuffer("".join(ibans[position] for position in candidates).encode("ascii"),
+                          dtype=np.uint8).reshape(-1, IBAN_LENGTH)
+    values = IBAN_CHARACTER_VALUES[codes]
+    is_digit = values < 10
+    is_letter = (values >= 10) & (values < 36)
+    # Same structure as IBAN_PATTERN: IT, 2 check digits, CIN letter, ABI and CAB digits, 12 alphanumeric characters
+    matches_pattern = ((codes[:, 0] == ord("I")) & (codes[:, 1] == ord("T")) & is_digit[:, 2:4].all(axis=1) &
+                       is_letter[:, 4] & is_digit[:, 5:15].all(axis=1) & (is_digit | is_letter)[:, 15:].all(axis=1))
+    rearranged_values = np.concatenate((values[:, 4:], values[:, :4]), axis=1)
+    remainders = np.zeros(len(candidates), dtype=np.int64)
+    for column in rearranged_values.T:
+        remainders = np.where(column > 9, remainders * 100 + column, remainders * 10 + column) % 97
+    has_valid_checksum = matches_pattern & (remainders == 1)
+    valid[candidates] = has_valid_checksum
+    for position, pattern_match, checksum_match in zip(candidates, matches_pattern, has_valid_checksum):
+        if not pattern_match:
+            reasons[position] = "IBAN format is not valid"
+        elif not checksum_match:
+            reasons[position] = "IBAN checksum is not valid"
+    return valid, reasons
 
 
 def parse_input_data(data):
@@ -58,33 +185,33 @@ def validate_input(person_or_company_name, surname, iban, old_iban_id=None):
     if surname is not None:
         if person_or_company_name == "" or surname == "" or iban == "":
             return "All fields are required"
-        if not regex.fullmatch(FIRST_NAME_PATTERN, person_or_company_name):
+        if not get_pattern("first_name").fullmatch(person_or_company_name):
             return "Name is not valid"
-        if not regex.fullmatch(LAST_NAME_PATTERN, surname):
+        if not get_pattern("last_name").fullmatch(surname):
             return "Surname is not valid"
     else:
         if person_or_company_name == "" or iban == "":
             return "Company name and IBAN are required"
-        if not regex.fullmatch(COMPANY_NAME_PATTERN, person_or_company_name):
+        if not get_pattern("company_name").fullmatch(person_or_company_name):
             return "Company name is not valid"
 
-    if not re.fullmatch(IBAN_PATTERN, iban) or not is_valid_iban(iban):
+    if not get_pattern("iban").fullmatch(iban) or not is_valid_iban(iban):
         return "IBAN is not valid"
 
     if old_iban_id is not None:
-        if not re.fullmatch(UUID_V4_PATTERN, old_iban_id):
+        if not get_pattern("uuid_v4").fullmatch(old_iban_id):
             return "IBAN id is not valid"
     return ""
 
 
 def validate_iban_id(iban_id):
-    if not re.fullmatch(UUID_V4_PATTERN, iban_id):
+    if not get_pattern("uuid_v4").fullmatch(iban_id):
         return "IBAN id is not valid"
     return ""
 
 
 def validate_iban(iban):
-    if not re.fullmatch(IBAN_PATTERN, iban) or not is_valid_iban(iban):
+    if not get_pattern("iban").fullmatch(iban) or not is_valid_iban(iban):
         return "IBAN is not valid"
     return ""
 
@@ -93,7 +220,7 @@ def normalize_company_legal_form(person_or_company_name):
     def add_dots(match):
         return ".".join(match.group(1)) + "."
 
-    return re.sub(LEGAL_FORMS_PATTERN, add_dots, person_or_company_name, flags=re.IGNORECASE)
+    return get_pattern("legal_forms").sub(add_dots, person_or_company_name)
 
 
 def has_iban_record_changed(record, person_or_company_name, surname, new_iban):
@@ -114,28 +241,45 @@ def to_lower(string):
     return string.casefold() if string is not None else None
 
 
+def normalize_company_name(company_name):
+    company_name_folded = to_lower(company_name)
+    company_name_stripped = to_lower(strip_company_partners(company_name_folded))
+    return company_name_folded, company_name_stripped, extract_legal_form(company_name_folded)
+
+
+def to_holder_record(row):
+    if not row:
+        return None
+    holder_id, iban, first_name, last_name, company_name, company_name_folded, company_name_stripped, legal_form = row
+    if company_name and company_name_folded is None:
+        company_name_folded, company_name_stripped, legal_form = normalize_company_name(company_name)
+    return HolderRecord(holder_id, iban, first_name, last_name, company_name, to_lower(first_name), to_lower(last_name),
+                        company_name_folded, company_name_stripped, legal_form)
+
+
 def extract_legal_form(company_name):
-    for pattern in LEGAL_FORMS:
-        match = re.search(pattern, company_name, re.IGNORECASE)
+    for legal_form_regex in LEGAL_FORM_REGEXES:
+        match = legal_form_regex.search(company_name)
         if match:
             return match.group(0).replace(".", "").casefold()
     return None
 
 
-def is_correct_input_legal_form(input_company_name, db_company_name):
+def is_correct_input_legal_form(input_company_name, registered_legal_form):
     input_legal_form = extract_legal_form(input_company_name)
     if not input_legal_form:
         return True
-    registered_legal_form = extract_legal_form(db_company_name)
     return input_legal_form == registered_legal_form
 
 
 def strip_company_partners(db_company_name):
-    cleaned_company_name = regex.sub(r"\bdi\b[\p{L} '’\-]+(&\sc.)?$", "", db_company_name, flags=re.IGNORECASE)
+    cleaned_company_name = get_pattern("company_partners").sub("", db_company_name)
     return cleaned_company_name
 
 
 def compute_similarity_score(input_company_name, db_company_name):
+    if fuzz is None:
+        import_fuzz()
     ratio = fuzz.ratio(input_company_name, db_company_name)
     partial_ratio = fuzz.partial_ratio(input_company_name, db_company_name)
     weighted_ratio = fuzz.WRatio(input_company_name, db_company_name)
@@ -143,14 +287,40 @@ def compute_similarity_score(input_company_name, db_company_name):
     return round(weighted_score)
 
 
-def are_company_names_similar(input_company_name, db_company_name):
-    full_name_score = compute_similarity_score(input_company_name, db_company_name)
-    if full_name_score >= 85:
+def is_similarity_score_reached(input_company_name, db_company_name, threshold=SIMILARITY_THRESHOLD):
+    if not similarity_settings["early_exit"]:
+        return compute_similarity_score(input_company_name, db_company_name) >= threshold
+    if fuzz is None:
+        import_fuzz()
+    ratio = fuzz.ratio(input_company_name, db_company_name)
+    # partial_ratio and WRatio are at most 100, so a low ratio already decides the outcome
+    if 0.4 * ratio + 60 < threshold - 1:
+        return False
+    partial_ratio = fuzz.partial_ratio(input_company_name, db_company_name)
+    if 0.4 * ratio + 0.2 * partial_ratio + 40 < threshold - 1:
+        return False
+    # WRatio is never lower than ratio for non-empty strings
+    if input_company_name and db_company_name and 0.8 * ratio + 0.2 * partial_ratio >= threshold + 0.5:
+        return True
+    weighted_ratio = fuzz.WRatio(input_company_name, db_company_name)
+    return round(0.4 * ratio + 0.2 * partial_ratio + 0.4 * weighted_ratio) >= threshold
+
+
+def compare_company_names(input_company_name, db_company_name, stripped_company_name):
+    if is_similarity_score_reached(input_company_name, db_company_name):
         return True
-    stripped_company_name = to_lower(strip_company_partners(db_company_name))
     if stripped_company_name != db_company_name:
-        stripped_name_score = compute_similarity_score(input_company_name, stripped_company_name)
-        if stripped_name_score >= 85:
-            return True
+        return is_similarity_score_reached(input_company_name, stripped_company_name)
     return False
 
+
+def are_company_names_similar(input_company_name, db_company_name, stripped_company_name=None):
+    if stripped_company_name is None:
+        stripped_company_name = to_lower(strip_company_partners(db_company_name))
+    key = (input_company_name, db_company_name, stripped_company_name)
+    decision = similarity_cache.get(key)
+    if decision is None:
+        decision = compare_company_names(input_company_name, db_company_name, stripped_company_name)
+        similarity_cache.put(key, decision)
+    return decision
+
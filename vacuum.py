@@ -0,0 +1,48 @@
+import argparse
+import os
+import sqlite3
+
+from rich.console import Console
+
+from db_utils import DATABASE, configure_database, get_shard_count, get_shard_path, open_connection, vacuum_shard
+
+console = Console()
+
+
+def vacuum(shards=None):
+    """Vacuums the given shards, or all of them, one at a time. Returns whether every shard was vacuumed."""
+    if not os.path.exists(DATABASE):
+        console.print(f"[bold red]{DATABASE} not found:[/bold red] create it with initialize_database.py")
+        return False
+    configure_database({})
+    for shard in shards if shards is not None else range(get_shard_count()):
+        if not 0 <= shard < get_shard_count():
+            console.print(f"[bold red]{DATABASE} has no shard {shard}[/bold red]")
+            return False
+        path = get_shard_path(shard)
+        size = os.path.getsize(path)
+        connection = None
+        try:
+            connection = open_connection(shard)
+            vacuum_shard(connection)
+        except sqlite3.Error as e:
+            console.print(f"[bold red]Vacuuming {path} failed:[/bold red] {e}")
+            return False
+        finally:
+            if connection:
+                connection.close()
+        console.print(f"[cyan]{path}: {size // 1024} KiB -> {os.path.getsize(path) // 1024} KiB[/cyan]")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description=f"Vacuum the shards of {DATABASE} and rebuild their search index, "
+                                                 f"whose rowids VACUUM may invalidate")
+    parser.add_argument("--shard", type=int, action="append", dest="shards",
+                        help="Shard to vacuum, repeatable (default: every shard)")
+    args = parser.parse_args()
+    vacuum(args.shards)
+
+
+if __name__ == "__main__":
+    main()
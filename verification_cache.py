@@ -0,0 +1,69 @@
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+
+
+class VerificationCache:
+    """Short-lived cache of verification results that also coalesces identical concurrent verifications.
+
+    The first request for a key computes the result while identical requests arriving in the meantime wait for it,
+    so a burst of the same verification costs a single lookup. Results are then served until they expire or the
+    cache is cleared by a write to the registry. Only writes made by this process clear it, so the results may miss
+    the writes of other processes for up to ttl seconds.
+    """
+
+    def __init__(self, max_size=10000, ttl=5.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.entries = OrderedDict()
+        self.in_flight = {}
+        self.lock = threading.Lock()
+        # Bumped by clear(), so that a result computed before a write is not stored after it
+        self.generation = 0
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+    def get_or_compute(self, key, compute):
+        leader = False
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                if entry[0] > time.monotonic():
+                    self.entries.move_to_end(key)
+                    self.hits += 1
+                    return entry[1]
+                del self.entries[key]
+            call = self.in_flight.get(key)
+            if call is not None:
+                self.coalesced += 1
+            else:
+                call = self.in_flight[key] = Future()
+                self.misses += 1
+                generation = self.generation
+                leader = True
+        if not leader:
+            return call.result()
+        try:
+            result = compute()
+        except BaseException as e:
+            with self.lock:
+                self.in_flight.pop(key, None)
+            call.set_exception(e)
+            raise
+        with self.lock:
+            self.in_flight.pop(key, None)
+            if generation == self.generation and self.max_size > 0 and self.ttl > 0:
+                self.entries[key] = (time.monotonic() + self.ttl, result)
+                if len(self.entries) > self.max_size:
+                    self.entries.popitem(last=False)
+                    self.evictions += 1
+        call.set_result(result)
+        return result
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.generation += 1